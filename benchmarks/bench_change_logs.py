@@ -0,0 +1,71 @@
+"""
+Compares logging changes through the ORM (`add_all` of `ServerChangeLog` objects) with the bulk `INSERT … RETURNING` of `create_logs_from_changes`.
+
+Usage:
+    python benchmarks/bench_change_logs.py --changes 1000 5000 20000
+"""
+from __future__ import annotations
+
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--changes", type=int, nargs="+", default=[1000, 5000, 20000], help="The number of synthetic changes")
+args = parser.parse_args()
+
+# The package parses the command line on import
+sys.argv = sys.argv[:1]
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session as DatabaseSession, sessionmaker  # noqa: E402
+
+from hetzner_server_scouter.db.db_conf import DataBase  # noqa: E402
+from hetzner_server_scouter.db.db_utils import add_objects_to_database  # noqa: E402
+from hetzner_server_scouter.notifications.crud import create_logs_from_changes  # noqa: E402
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog, ServerChangeType  # noqa: E402
+
+
+def make_changes(num_changes: int) -> list[ServerChange]:
+    return [ServerChange(ServerChangeType.new, i, None, {
+        "id": i, "price": 40 + i % 50, "time_of_next_price_reduce": "2023-11-14T22:13:20", "datacenter": "FSN", "cpu_name": "Intel Core i7-8700",
+        "ram_size": 64, "ram_num": 4, "ram_is_ecc": True, "disks": {"hdd": [], "enterprise_hdd": [2000, 2000], "ssd": [512], "enterprise_ssd": []},
+        "specials": {"has_IPv4": False, "has_GPU": False, "has_iNIC": False, "has_HWR": False}, "last_message_id": None,
+    }) for i in range(num_changes)]
+
+
+def orm_add_all(db: DatabaseSession, changes: list[ServerChange]) -> None:
+    add_objects_to_database(db, [ServerChangeLog(server_id=change.server_id, change=change) for change in changes])
+
+
+def bulk_insert(db: DatabaseSession, changes: list[ServerChange]) -> None:
+    create_logs_from_changes(db, changes)
+
+
+def measure(func: Callable[[DatabaseSession, list[ServerChange]], None], changes: list[ServerChange]) -> float:
+    with TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp, 'bench.db')}")
+        DataBase.metadata.create_all(bind=engine)
+
+        with sessionmaker(bind=engine)() as db:
+            s = perf_counter()
+            func(db, changes)
+            took = perf_counter() - s
+
+        engine.dispose()
+
+    return took
+
+
+def main() -> None:
+    for num_changes in args.changes:
+        changes = make_changes(num_changes)
+        orm, bulk = measure(orm_add_all, changes), measure(bulk_insert, changes)
+        print(f"{num_changes:>7} changes:  ORM add_all {orm:6.3f}s  bulk insert {bulk:6.3f}s  ({orm / bulk:.1f}× faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures how much the notifications overlap with the database work when it is done on the dedicated database thread.
+
+The Telegram API is replaced by a delivery stage that just sleeps for `--send-latency` seconds per message.
+Without the database thread, every commit blocks the event loop and thereby the sends; with it, both run concurrently.
+
+Usage:
+    python benchmarks/bench_database_overlap.py --changes 2000 --send-latency 0.002
+"""
+from __future__ import annotations
+
+import asyncio
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--changes", type=int, default=2000, help="The number of new servers per run")
+parser.add_argument("--send-latency", type=float, default=0.002, help="The simulated latency of a single Telegram message (in s)")
+args = parser.parse_args()
+
+# The package parses the command line on import
+sys.argv = sys.argv[:1]
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session as DatabaseSession, sessionmaker  # noqa: E402
+
+from hetzner_server_scouter.db import db_utils  # noqa: E402
+from hetzner_server_scouter.db.crud import stream_server_changes  # noqa: E402
+from hetzner_server_scouter.db.db_conf import DataBase  # noqa: E402
+from hetzner_server_scouter.notifications.crud import process_changes  # noqa: E402
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLogRecord  # noqa: E402
+from hetzner_server_scouter.utils import run_concurrently  # noqa: E402
+
+
+def make_api_data(num_servers: int, price: float) -> dict[str, Any]:
+    return {"server": [{
+        "id": i, "price": price, "fixed_price": False, "next_reduce_timestamp": 1700000000,
+        "datacenter": "FSN1-DC1", "cpu": "Intel Core i7-8700", "ram_size": 64, "ram": ["4x RAM 16384 MB DDR4"], "specials": ["ECC"],
+        "hdd_arr": ["2 TB Enterprise HDD", "2 TB Enterprise HDD"], "serverDiskData": {"hdd": [2000, 2000], "sata": [], "nvme": [], "general": []},
+    } for i in range(num_servers)]}
+
+
+async def fake_telegram(db: DatabaseSession, logs: asyncio.Queue[ServerChangeLogRecord | None]) -> None:
+    while await logs.get() is not None:
+        await asyncio.sleep(args.send_latency)
+
+
+async def run(use_worker_thread: bool) -> tuple[float, float]:
+    db_utils.database_use_worker_thread = use_worker_thread  # type:ignore[attr-defined]
+    timings = []
+
+    with TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp, 'bench.db')}")
+        DataBase.metadata.create_all(bind=engine)
+
+        with sessionmaker(bind=engine)() as db, redirect_stdout(StringIO()):
+            # The first run only inserts, the second one changes every price
+            for price in [40, 30]:
+                changes: asyncio.Queue[ServerChange | None] = asyncio.Queue(maxsize=128)
+                s = perf_counter()
+                await run_concurrently(stream_server_changes(db, make_api_data(args.changes, price), changes), process_changes(db, changes, fake_telegram))
+                timings.append(perf_counter() - s)
+
+        engine.dispose()
+
+    return timings[0], timings[1]
+
+
+def main() -> None:
+    send_only = args.changes * args.send_latency
+    print(f"{args.changes} changes, {args.send_latency * 1000:.1f}ms per message → {send_only:.2f}s of pure sending per run\n")
+
+    for use_worker_thread in [False, True]:
+        new, price_changed = asyncio.run(run(use_worker_thread))
+        print(f"{'database thread' if use_worker_thread else 'event loop':>16}:  new {new:6.2f}s  price changed {price_changed:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
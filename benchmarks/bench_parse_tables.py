@@ -0,0 +1,76 @@
+"""
+Compares parsing the auction with and without the shared parse tables of `db/parse_tables.py`.
+
+Without the tables, every `hdd_arr`, CPU name and datacenter code is parsed again for every server and each server keeps its own copy.
+The auction is round-tripped through JSON first, so every server has its own string objects, as with the real download.
+The memory is the size of the parsed servers that is still allocated afterwards, as measured by tracemalloc.
+
+Usage:
+    python benchmarks/bench_parse_tables.py --servers 10000 50000
+"""
+from __future__ import annotations
+
+import json
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from statistics import median
+from time import perf_counter
+from typing import Any
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--servers", type=int, nargs="+", default=[10_000, 50_000], help="The number of servers in the auction")
+parser.add_argument("--repeat", type=int, default=7, help="How often the parse time is measured, the median is reported")
+args = parser.parse_args()
+
+# The package parses the command line on import
+sys.argv = sys.argv[:1]
+
+from hetzner_server_scouter.db import models as models_module  # noqa: E402
+from hetzner_server_scouter.db.models import Server  # noqa: E402
+from hetzner_server_scouter.db.parse_tables import ParseTables  # noqa: E402
+from hetzner_server_scouter.notifications.models import ServerChangeLog  # noqa: E402, F401  The model that `Server` relates to has to be mapped
+from synthetic import generate_auction  # noqa: E402
+
+
+def parse(api_data: dict[str, Any]) -> list[Server]:
+    return [Server.parse(data) for data in api_data["server"]]
+
+
+def measure(api_data: dict[str, Any], tables: ParseTables) -> tuple[float, float]:
+    """The median parse time in s and the memory of the parsed servers in MB"""
+    # `Server.parse` uses the tables that the models import
+    setattr(models_module, "parse_tables", tables)
+    timings = []
+
+    for _ in range(args.repeat):
+        s = perf_counter()
+        parse(api_data)
+        timings.append(perf_counter() - s)
+
+    tables.clear()
+    tracemalloc.start()
+    servers = parse(api_data)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del servers
+
+    return median(timings), size / 1024 ** 2
+
+
+def main() -> None:
+    for num_servers in args.servers:
+        api_data = json.loads(json.dumps(generate_auction(num_servers)))
+
+        # With a maximum size of 0, every table is cleared on every insert, so nothing is shared
+        uncached_s, uncached_mb = measure(api_data, ParseTables(max_size=0))
+        cached_s, cached_mb = measure(api_data, ParseTables())
+
+        print(
+            f"{num_servers:>7} servers:  without tables {uncached_s:6.3f}s {uncached_mb:7.1f}MB  with tables {cached_s:6.3f}s {cached_mb:7.1f}MB  "
+            f"({uncached_s / cached_s:.2f}× faster, {1 - cached_mb / uncached_mb:.0%} less memory)"
+        )
+
+
+if __name__ == "__main__":
+    main()
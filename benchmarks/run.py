@@ -0,0 +1,169 @@
+"""
+The benchmark suite: Measures the hot paths of a run on synthetic auctions of different sizes.
+
+The results are written as JSON into `benchmarks/results/`. Pass a previous result with `--compare` to see how much each benchmark has changed.
+
+Usage:
+    python benchmarks/run.py
+    python benchmarks/run.py --scales 1000 10000 --repeat 5 --compare benchmarks/results/<previous>.json
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--scales", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="The number of servers in the auction")
+parser.add_argument("--repeat", type=int, default=3, help="How often each benchmark is repeated")
+parser.add_argument("--output", type=Path, default=Path(__file__).parent / "results", help="The directory where the results are stored")
+parser.add_argument("--compare", type=Path, help="A previous result to compare against")
+args = parser.parse_args()
+
+# The package parses the command line on import
+sys.argv = sys.argv[:1]
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from hetzner_server_scouter.db.crud import download_server_list, update_server_list  # noqa: E402
+from hetzner_server_scouter.db.db_conf import DataBase  # noqa: E402
+from hetzner_server_scouter.db.models import Server  # noqa: E402
+from hetzner_server_scouter.notifications.crud import create_logs_from_changes  # noqa: E402
+from hetzner_server_scouter.utils import filter_server_with_program_args, program_args  # noqa: E402
+from hetzner_server_scouter.version import __version__  # noqa: E402
+from synthetic import generate_auction, mutate_auction  # noqa: E402
+
+# These filters are set for the `filter` benchmark. Every other benchmark runs without filters, so all servers are processed.
+benchmark_filters = {"price": 80, "ram": 64, "disk_num": 2, "disk_size_raid1": 4000, "datacenter": ["FSN", "NBG"]}
+
+
+def measure(func: Callable[[], Any], repeat: int, setup: Callable[[], Any] | None = None) -> dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        s = perf_counter()
+        func()
+        timings.append(perf_counter() - s)
+
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+
+def run_scale(num_servers: int, repeat: int) -> dict[str, dict[str, float]]:
+    results = {}
+    first = generate_auction(num_servers)
+    second = mutate_auction(first)
+
+    def download(api_data: dict[str, Any]) -> list[Server]:
+        servers = asyncio.run(download_server_list(api_data))
+        assert servers is not None
+        return servers
+
+    results["download_server_list"] = measure(lambda: download(first), repeat)
+    servers, next_servers = download(first), download(second)
+
+    def run_filter() -> None:
+        prev = {k: getattr(program_args, k) for k in benchmark_filters}
+        try:
+            for k, v in benchmark_filters.items():
+                setattr(program_args, k, v)
+
+            for server in servers:
+                filter_server_with_program_args(server)
+        finally:
+            for k, v in prev.items():
+                setattr(program_args, k, v)
+
+    results["filter_server_with_program_args"] = measure(run_filter, repeat)
+
+    with TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp, 'bench.db')}")
+        db = sessionmaker(bind=engine)()
+
+        def reset() -> None:
+            db.expunge_all()
+            DataBase.metadata.drop_all(bind=engine)
+            DataBase.metadata.create_all(bind=engine)
+
+        def reset_to_first_run() -> None:
+            reset()
+            update_server_list(db, servers)
+
+        results["update_server_list (first run)"] = measure(lambda: update_server_list(db, servers), repeat, reset)
+        results["update_server_list (next run)"] = measure(lambda: update_server_list(db, next_servers), repeat, reset_to_first_run)
+
+        reset()
+        new_changes = update_server_list(db, servers)
+        next_changes = update_server_list(db, next_servers)
+
+        results["create_logs_from_changes (first run)"] = measure(lambda: create_logs_from_changes(db, new_changes), repeat, reset)
+        results["create_logs_from_changes (next run)"] = measure(lambda: create_logs_from_changes(db, next_changes), repeat, reset)
+
+        db.close()
+        engine.dispose()
+
+    def render() -> None:
+        for change in new_changes:
+            # The message is cached on the change, so it is dropped to measure building it
+            change.message = None
+            change.to_console_str()
+            change.to_telegram_str()
+
+    results["render messages"] = measure(render, repeat)
+
+    for it in results.values():
+        it["per_server_us"] = it["min"] / num_servers * 1e6
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_results(results: dict[str, dict[str, dict[str, float]]], previous: dict[str, Any] | None) -> None:
+    for scale, benchmarks in results.items():
+        print(f"\n{int(scale):,} servers")
+
+        for name, it in benchmarks.items():
+            line = f"  {name:<38} {it['min']:9.4f}s  (median {it['median']:9.4f}s, {it['per_server_us']:8.2f}µs / server)"
+
+            if previous is not None and (old := previous["results"].get(scale, {}).get(name)) is not None:
+                line += f"  {it['min'] / old['min']:6.2f}× of {previous['version']}"
+
+            print(line)
+
+
+def main() -> None:
+    previous = json.loads(args.compare.read_text()) if args.compare is not None else None
+    results = {str(scale): run_scale(scale, args.repeat) for scale in args.scales}
+
+    output = {
+        "version": __version__, "commit": git_commit(), "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(), "repeat": args.repeat, "results": results,
+    }
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    path = Path(args.output, f"{__version__}-{output['commit'] or 'unknown'}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    path.write_text(json.dumps(output, indent=2))
+
+    print_results(results, previous)
+    print(f"\nThe results have been written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+A generator for synthetic auction payloads in the format of `live_data_sb_EUR.json`.
+
+The payloads are deterministic for a given seed, so benchmark results of different versions are comparable.
+"""
+from __future__ import annotations
+
+import copy
+import random
+from typing import Any
+
+cpus = [
+    "Intel Core i7-6700", "Intel Core i7-7700", "Intel Core i7-8700", "Intel Core i9-9900K", "Intel Xeon E3-1275V6",
+    "Intel Xeon E5-1650V3", "Intel Xeon W-2145", "AMD Ryzen 7 3700X", "AMD Ryzen 9 3900", "AMD Ryzen 9 5950X", "AMD EPYC 7502P",
+]
+
+# (hdd_arr string, kind in serverDiskData, size in GB)
+disks = [
+    ("2 TB Enterprise HDD", "hdd", 2000), ("3 TB HDD", "hdd", 3000), ("4 TB Enterprise HDD", "hdd", 4000), ("8 TB Enterprise HDD", "hdd", 8000),
+    ("10 TB Enterprise HDD", "hdd", 10000), ("16 TB Enterprise HDD", "hdd", 16000), ("240 GB SATA SSD", "sata", 240), ("480 GB SATA SSD", "sata", 480),
+    ("960 GB Datacenter SSD", "sata", 960), ("512 GB NVMe SSD", "nvme", 512), ("1 TB NVMe SSD", "nvme", 1000), ("3.84 TB Datacenter SSD", "nvme", 3840),
+]
+
+datacenters = [f"FSN1-DC{i}" for i in range(1, 19)] + [f"NBG1-DC{i}" for i in range(1, 5)] + [f"HEL1-DC{i}" for i in range(1, 9)]
+specials = ["IPv4", "GPU", "iNIC", "ECC", "HWR"]
+
+# The time the payloads are generated at (2023-11-14). It is fixed, so the payloads don't depend on the clock.
+epoch = 1_700_000_000
+
+
+def generate_server(rng: random.Random, server_id: int, now: int) -> dict[str, Any]:
+    cpu = rng.choice(cpus)
+    ram_num = rng.choice([2, 4, 8])
+    ram_module_size = rng.choice([8, 16, 32])
+    is_ecc = rng.random() < 0.4
+
+    disk_type = rng.choice(disks)
+    server_disks = [disk_type] * rng.choice([1, 2, 2, 2, 3, 4])
+    if rng.random() < 0.3:
+        server_disks += [rng.choice(disks)] * rng.choice([1, 2])
+
+    server_disk_data: dict[str, list[int]] = {"nvme": [], "sata": [], "hdd": [], "general": []}
+    for _, kind, size in server_disks:
+        server_disk_data[kind].append(size)
+        server_disk_data["general"].append(size)
+
+    server_specials = [it for it in specials if it != "ECC" and rng.random() < 0.15] + (["ECC"] if is_ecc else [])
+    fixed_price = rng.random() < 0.2
+    price = round(rng.uniform(28, 250), 2)
+
+    return {
+        "id": server_id,
+        "key": server_id,
+        "name": f"SB{rng.randint(10, 200)}",
+        "description": [cpu, f"{ram_num}x RAM {ram_module_size * 1024} MB DDR4{' ECC' if is_ecc else ''}", *(it[0] for it in server_disks)],
+        "information": [],
+        "category": "Dedicated Root Server",
+        "cat_id": 1,
+        "cpu": cpu,
+        "cpu_count": 1,
+        "is_highio": False,
+        "traffic": "unlimited",
+        "bandwidth": 1000,
+        "ram": [f"{ram_num}x RAM {ram_module_size * 1024} MB DDR4{' ECC' if is_ecc else ''}"],
+        "ram_size": ram_num * ram_module_size,
+        "price": price,
+        "setup_price": 0,
+        "hourly_price": round(price / 730, 4),
+        "hdd_arr": [it[0] for it in server_disks],
+        "hdd_hr": [it[0] for it in server_disks],
+        "hdd_size": min(it[2] for it in server_disks),
+        "hdd_count": len(server_disks),
+        "serverDiskData": server_disk_data,
+        "is_ecc": is_ecc,
+        "datacenter": rng.choice(datacenters),
+        "specials": server_specials,
+        "dist": ["Rescue system (English)"],
+        "fixed_price": fixed_price,
+        "next_reduce": 0 if fixed_price else rng.randint(0, 3 * 86400),
+        "next_reduce_hr": not fixed_price,
+        "next_reduce_timestamp": 0 if fixed_price else now + rng.randint(0, 3 * 86400),
+        "ip_price": {"Monthly": 1.7, "Hourly": 0.0027, "Amount": 1},
+    }
+
+
+def generate_auction(num_servers: int, seed: int = 0, now: int = epoch) -> dict[str, Any]:
+    rng = random.Random(seed)
+
+    return {"server": [generate_server(rng, 2_000_000 + i, now) for i in range(num_servers)], "serverCount": num_servers}
+
+
+def mutate_auction(data: dict[str, Any], seed: int = 1, sold: float = 0.02, price_changed: float = 0.05, new: float = 0.02) -> dict[str, Any]:
+    """Creates the next snapshot: Some servers are sold, some get cheaper and some new ones appear."""
+    rng = random.Random(seed)
+    data = copy.deepcopy(data)
+    now = max(it["next_reduce_timestamp"] for it in data["server"]) if data["server"] else epoch
+
+    servers = [it for it in data["server"] if rng.random() >= sold]
+    for server in servers:
+        if not server["fixed_price"] and rng.random() < price_changed:
+            server["price"] = round(max(server["price"] - rng.uniform(1, 5), 20), 2)
+
+    next_id = max((it["id"] for it in data["server"]), default=2_000_000) + 1
+    servers += [generate_server(rng, next_id + i, now) for i in range(int(len(data["server"]) * new))]
+
+    return {"server": servers, "serverCount": len(servers)}
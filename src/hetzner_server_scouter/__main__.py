@@ -1,32 +1,219 @@
 import asyncio
+import sys
 
-from hetzner_server_scouter.db.crud import download_server_list, update_server_list
+from hetzner_server_scouter.archive import SnapshotArchive
+from hetzner_server_scouter.backtest import backtest_filters
+from hetzner_server_scouter.change_feed import ChangeFeed
+from hetzner_server_scouter.auction_index import AuctionApi
+from hetzner_server_scouter.daemon import MetricsExposition, HttpServer, run_daemon
+from hetzner_server_scouter.data_sources import Snapshot, make_data_source, record_snapshot
+from hetzner_server_scouter.db.crud import stream_server_changes, read_matching_servers, read_watchlist, add_to_watchlist, remove_from_watchlist, read_server_snapshots
 from hetzner_server_scouter.db.db_conf import init_database, DatabaseSessionMaker
-from hetzner_server_scouter.notifications.crud import process_changes
-from hetzner_server_scouter.notifications.notify_telegram import notify_exception_via_telegram
-from hetzner_server_scouter.settings import error_exit
-from hetzner_server_scouter.utils import program_args, print_version, print_exception
+from hetzner_server_scouter.db.db_utils import run_in_database_thread
+from hetzner_server_scouter.db.state_file import ServerStateFile
+from hetzner_server_scouter.export import export, ExportError
+from hetzner_server_scouter.fetch import load_hetzner_prices
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.notifications.crud import process_changes, discard_changes, read_change_logs, DeliveryStage
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType, ServerChangeLogRecord
+from hetzner_server_scouter.notifications.notify_telegram import notify_exception_via_telegram, telegram_notify_about_changes
+from hetzner_server_scouter.profiling import profile_run
+from hetzner_server_scouter.rankings import Rankings, ranking_keys, notify_about_ranking_changes, format_ranking
+from hetzner_server_scouter.replay import make_replay_session, replay_snapshots
+from hetzner_server_scouter.settings import error_exit, pipeline_change_queue_size, snapshot_archive_enabled, rankings_watched, change_feed_enabled, change_feed_size
+from hetzner_server_scouter.utils import program_args, print_version, print_exception, run_concurrently, path, parse_filter_variant, hetzner_prices
+
+
+async def run() -> None:
+    try:
+        with metrics.span("run"):
+            snapshot = await poll()
+
+    finally:
+        if program_args.metrics is not None:
+            metrics.export(program_args.metrics)
+
+    # Only after the export, as `error_exit` exits right away without running any `finally`
+    if snapshot is None:
+        error_exit(1, "Failed to download the server list!")
+
+
+async def load_rankings() -> Rankings | None:
+    """The watched rankings of the stored servers that match the filters, just as `hscout top` ranks them, or `None` if no ranking is watched"""
+    if not rankings_watched:
+        return None
+
+    with DatabaseSessionMaker() as db:
+        servers = await run_in_database_thread(lambda: read_matching_servers(db, program_args))
+
+    with metrics.span("rankings"):
+        return Rankings.from_names(rankings_watched).build(servers)
+
+
+async def poll(rankings: Rankings | None = None) -> Snapshot | None:
+    """
+    Downloads the auction and runs the pipeline. Returns the downloaded snapshot, or `None` if the download failed.
+    The `rankings` are kept up to date by the changes. Without them, they are ranked from the database first, which is the state of the previous run.
+    """
+    snapshot = await make_data_source(program_args.source).fetch_latest()
+    if snapshot is None:
+        return None
+
+    hetzner_prices.update_from_snapshot(snapshot.data)
+
+    if program_args.record is not None:
+        record_snapshot(program_args.record, snapshot)
+
+    rankings = rankings or await load_rankings()
+    state = ServerStateFile(path("state.bin"))
+    with DatabaseSessionMaker() as db:
+        watchlist = await run_in_database_thread(lambda: read_watchlist(db))
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue(maxsize=pipeline_change_queue_size)
+        logged: list[ServerChangeLogRecord] = []
+        await run_concurrently(stream_server_changes(db, snapshot.data, changes, state, watchlist), process_changes(db, changes, rankings=rankings, logged=logged))
+
+        # The feeds only render the changes that were logged since their last update. The ones of this run are reused with their rendered messages.
+        if change_feed_enabled:
+            with metrics.span("change_feed"):
+                feed = ChangeFeed.load(path("feed"))
+                feed.update(await run_in_database_thread(lambda: read_change_logs(db, feed.last_id, change_feed_size, logged)))
+
+    # Only now the database won't change anymore during this run
+    state.commit()
+
+    if rankings is not None:
+        await notify_about_ranking_changes(rankings.commit())
+
+    # Archiving is done last, as it is not needed for the notifications
+    if program_args.source is None and snapshot_archive_enabled:
+        with metrics.span("archive"):
+            SnapshotArchive(path("archive")).append(snapshot)
+
+    return snapshot
+
+
+async def daemon() -> None:
+    exposition = MetricsExposition(metrics)
+    server = HttpServer({"/metrics": exposition.response}, program_args.metrics_host, program_args.metrics_port)
+
+    # The rankings are only ranked once, afterwards they are updated by the changes of every cycle
+    rankings = await load_rankings()
+    await run_daemon(lambda: poll(rankings), program_args.interval, exposition, server, program_args.metrics)
+
+
+async def serve() -> None:
+    api, exposition = AuctionApi(program_args), MetricsExposition(metrics)
+    server = HttpServer({"/servers": api.servers, "/metrics": exposition.response}, program_args.host, program_args.port)
+
+    rankings = await load_rankings()
+
+    async def poll_and_index() -> Snapshot | None:
+        if (snapshot := await poll(rankings)) is not None:
+            await api.update(snapshot)
+
+        return snapshot
+
+    await run_daemon(poll_and_index, program_args.interval, exposition, server, program_args.metrics)
+
+
+async def replay() -> None:
+    source = make_data_source(program_args.replay_source)
+    deliver: DeliveryStage = discard_changes
+    if program_args.notify:
+        deliver = telegram_notify_about_changes
+
+    with make_replay_session() as db:
+        stats = await replay_snapshots(db, source.snapshots(), deliver, program_args.print_changes)
+
+    print(stats.to_str())
+
+
+def top() -> None:
+    try:
+        rankings = Rankings.from_names(program_args.rankings or ranking_keys, program_args.rankings_size)
+    except ValueError as ex:
+        error_exit(1, str(ex))
+
+    with DatabaseSessionMaker() as db:
+        servers = {it.id: it for it in read_matching_servers(db, program_args)}
+
+    rankings.build(servers.values())
+    print("\n\n".join(format_ranking(it, servers) for it in rankings.rankings))
+
+
+def export_history() -> None:
+    path_, fmt = program_args.export_path, program_args.export_format
+    if fmt is None:
+        fmt = path_.suffix.lstrip(".") if path_ is not None and path_.suffix.lstrip(".") in {"csv", "jsonl", "parquet"} else "csv"
+
+    try:
+        with DatabaseSessionMaker() as db:
+            num_rows, last_id = export(db, program_args.export_table, path_, fmt, program_args.since_id, program_args.since)
+    except ExportError as ex:
+        error_exit(1, str(ex))
+
+    print(f"Exported {num_rows} {program_args.export_table}{f', the last log id is {last_id}' if last_id is not None else ''}", file=sys.stderr)
+
+
+def watch() -> None:
+    with DatabaseSessionMaker() as db:
+        match program_args.watch_command:
+            case "add":
+                add_to_watchlist(db, program_args.server_ids)
+            case "remove":
+                remove_from_watchlist(db, program_args.server_ids)
+            case "list":
+                watchlist = read_watchlist(db)
+                servers = read_server_snapshots(db, list(watchlist))
+
+                for server_id in sorted(watchlist):
+                    it = ServerChange(ServerChangeType.new, server_id, None, servers[server_id]).to_message() if server_id in servers else None
+                    print(f"{server_id}: {f'{it.price:.2f}€ {it.price_decreases_in}'.strip() if it is not None else 'Not in the auction'}")
+
+
+def backtest() -> None:
+    source = make_data_source(program_args.backtest_source or path("archive"))
+
+    variants = list(program_args.variants)
+    if program_args.variants_file is not None:
+        variants += [line.strip() for line in program_args.variants_file.read_text().splitlines() if line.strip() and not line.startswith("#")]
+
+    # Without any variants, the filters of the command line are tested
+    filters = {it: parse_filter_variant(it, program_args) for it in variants} or {"<command line>": program_args}
+    print(backtest_filters(source.snapshots(), filters).to_str())
 
 
 async def _main() -> None:
     init_database()
+    load_hetzner_prices()
 
     if program_args.version:
         print_version()
         exit(0)
 
-    with DatabaseSessionMaker() as db:
-        servers = await download_server_list()
-        if servers is None:
-            error_exit(1, "Failed to download the server list!")
-
-        changes = update_server_list(db, servers)
-        await process_changes(db, changes)
+    match program_args.command:
+        case "replay":
+            await replay()
+        case "backtest":
+            backtest()
+        case "top":
+            top()
+        case "watch":
+            watch()
+        case "export":
+            export_history()
+        case "daemon":
+            await daemon()
+        case "serve":
+            await serve()
+        case _:
+            await run()
 
 
 def main() -> None:
     try:
-        asyncio.run(_main())
+        with profile_run(program_args.profile, program_args.profile_memory):
+            asyncio.run(_main())
     except Exception as ex:
         print_exception(ex)
         asyncio.run(notify_exception_via_telegram(ex))
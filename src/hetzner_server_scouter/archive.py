@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, cast
+
+from hetzner_server_scouter.data_sources import DataSource, Snapshot
+from hetzner_server_scouter.settings import snapshot_archive_keyframe_interval, snapshot_archive_compression_level
+
+
+@dataclass
+class ArchiveEntry:
+    time: int
+    segment: str
+    offset: int
+    length: int
+    is_keyframe: bool
+
+    def to_json(self) -> str:
+        return json.dumps({"time": self.time, "segment": self.segment, "offset": self.offset, "length": self.length, "is_keyframe": self.is_keyframe})
+
+    @classmethod
+    def from_json(cls, it: str) -> ArchiveEntry:
+        return cls(**json.loads(it))
+
+
+def encode_delta(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any]:
+    """
+    Encodes the difference between two payloads: The servers that were added or removed and, for every other server, only the fields that changed.
+    Every other top-level key of the payload is stored in `meta` if it changed.
+    """
+    old_servers = {it["id"]: it for it in old["server"]}
+    new_servers = {it["id"]: it for it in new["server"]}
+
+    added = [it for it in new["server"] if it["id"] not in old_servers]
+    removed = [server_id for server_id in old_servers if server_id not in new_servers]
+    changed, unset = {}, {}
+
+    for server_id, server in new_servers.items():
+        if (prev := old_servers.get(server_id)) is None or prev == server:
+            continue
+
+        if fields := {k: v for k, v in server.items() if k not in prev or prev[k] != v}:
+            changed[str(server_id)] = fields
+        if missing := [k for k in prev if k not in server]:
+            unset[str(server_id)] = missing
+
+    delta: dict[str, Any] = {"added": added, "removed": removed, "changed": changed}
+    if unset:
+        delta["unset"] = unset
+    if meta := {k: v for k, v in new.items() if k != "server" and old.get(k) != v}:
+        delta["meta"] = meta
+
+    # The order of the servers is only stored if it can't be reconstructed. `apply_delta` keeps the order of the old servers and appends the added ones.
+    removed_ids = set(removed)
+    if [server_id for server_id in old_servers if server_id not in removed_ids] + [it["id"] for it in added] != list(new_servers):
+        delta["order"] = list(new_servers)
+
+    return delta
+
+
+def apply_delta(old: dict[str, Any], delta: dict[str, Any]) -> dict[str, Any]:
+    removed = set(delta["removed"])
+    servers = {it["id"]: it for it in old["server"] if it["id"] not in removed}
+
+    for server_id, fields in delta["changed"].items():
+        servers[int(server_id)] = servers[int(server_id)] | fields
+    for server_id, keys in delta.get("unset", {}).items():
+        servers[int(server_id)] = {k: v for k, v in servers[int(server_id)].items() if k not in keys}
+    for server in delta["added"]:
+        servers[server["id"]] = server
+
+    new: dict[str, Any] = {k: v for k, v in old.items() if k != "server"} | delta.get("meta", {})
+    new["server"] = [servers[it] for it in delta["order"]] if "order" in delta else list(servers.values())
+
+    return new
+
+
+@dataclass
+class SnapshotArchive(DataSource):
+    """
+    An append-only archive of raw snapshots.
+
+    Every `keyframe_interval` snapshots a full keyframe starts a new segment file, every other snapshot is stored as a delta to the previous one.
+    Each record is compressed on its own and `index.jsonl` stores the time, segment and offset of every record, which allows random access by time.
+    The last appended snapshot is also kept decoded in `latest.json`, so the next delta doesn't have to decode the whole segment first.
+    """
+    path: Path
+    keyframe_interval: int = snapshot_archive_keyframe_interval
+
+    @property
+    def index_path(self) -> Path:
+        return Path(self.path, "index.jsonl")
+
+    @property
+    def latest_path(self) -> Path:
+        return Path(self.path, "latest.json")
+
+    def read_latest(self, entry: ArchiveEntry) -> dict[str, Any] | None:
+        """The cached data of the snapshot of the `entry`, or `None` if the cache is missing or belongs to another one"""
+        try:
+            it = json.loads(self.latest_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+        return cast(dict[str, Any], it["data"]) if isinstance(it, dict) and it.get("time") == entry.time else None
+
+    def write_latest(self, time: int, data: dict[str, Any]) -> None:
+        tmp_file = self.latest_path.with_name(f".{self.latest_path.name}.tmp")
+        tmp_file.write_text(json.dumps({"time": time, "data": data}, separators=(",", ":")))
+        os.replace(tmp_file, self.latest_path)
+
+    def entries(self) -> list[ArchiveEntry]:
+        if not self.index_path.exists():
+            return []
+
+        with self.index_path.open() as f:
+            return [ArchiveEntry.from_json(line) for line in f if line.strip()]
+
+    def read_record(self, entry: ArchiveEntry) -> dict[str, Any]:
+        with Path(self.path, entry.segment).open("rb") as f:
+            f.seek(entry.offset)
+            return cast(dict[str, Any], json.loads(zlib.decompress(f.read(entry.length))))
+
+    def decode(self, entries: list[ArchiveEntry]) -> Iterator[Snapshot]:
+        """Decodes the entries sequentially. The first one has to be a keyframe."""
+        data: dict[str, Any] | None = None
+
+        for entry in entries:
+            record = self.read_record(entry)
+            data = record if entry.is_keyframe else apply_delta(cast(dict[str, Any], data), record)
+            yield Snapshot(datetime.fromtimestamp(entry.time), data)
+
+    def snapshots(self, start: datetime | None = None, end: datetime | None = None) -> Iterator[Snapshot]:
+        entries = self.entries()
+        times = [it.time for it in entries]
+
+        lo = bisect.bisect_left(times, int(start.timestamp())) if start is not None else 0
+        hi = bisect.bisect_right(times, int(end.timestamp())) if end is not None else len(entries)
+        if lo >= hi:
+            return
+
+        keyframe = max(i for i in range(lo + 1) if entries[i].is_keyframe)
+        for i, snapshot in enumerate(self.decode(entries[keyframe:hi]), start=keyframe):
+            if i >= lo:
+                yield snapshot
+
+    def at(self, time: datetime) -> Snapshot | None:
+        """The latest snapshot at the given time"""
+        entries = self.entries()
+        i = bisect.bisect_right([it.time for it in entries], int(time.timestamp())) - 1
+        if i < 0:
+            return None
+
+        return self.latest_of(entries[:i + 1])
+
+    def latest(self) -> Snapshot | None:
+        return self.latest_of(self.entries())
+
+    def latest_of(self, entries: list[ArchiveEntry]) -> Snapshot | None:
+        if not entries:
+            return None
+
+        keyframe = max(i for i, it in enumerate(entries) if it.is_keyframe)
+        it = None
+        for it in self.decode(entries[keyframe:]):
+            pass
+
+        return it
+
+    def append(self, snapshot: Snapshot) -> ArchiveEntry | None:
+        entries = self.entries()
+        time = int(snapshot.time.timestamp())
+
+        if entries and time <= entries[-1].time:
+            logging.warning(f"Not archiving the snapshot of {snapshot.time} as the archive already contains a newer one")
+            return None
+
+        keyframe = max((i for i, it in enumerate(entries) if it.is_keyframe), default=None)
+        is_keyframe = keyframe is None or len(entries) - keyframe >= self.keyframe_interval
+
+        if is_keyframe:
+            record, segment = snapshot.data, f"segment-{time}.bin"
+        else:
+            if (previous := self.read_latest(entries[-1])) is None:
+                previous = cast(Snapshot, self.latest_of(entries)).data
+
+            record, segment = encode_delta(previous, snapshot.data), entries[-1].segment
+
+        os.makedirs(self.path, exist_ok=True)
+        data = zlib.compress(json.dumps(record, separators=(",", ":")).encode(), snapshot_archive_compression_level)
+
+        with Path(self.path, segment).open("ab") as f:
+            offset = f.tell()
+            f.write(data)
+
+        # The index is written last, so a crash in between only leaves unreferenced bytes in the segment
+        entry = ArchiveEntry(time, segment, offset, len(data), is_keyframe)
+        with self.index_path.open("a") as f:
+            f.write(entry.to_json() + "\n")
+
+        self.write_latest(time, snapshot.data)
+        return entry
+
+    def size(self) -> int:
+        """The size of the archive in bytes, without the cache of the latest snapshot"""
+        return sum(it.stat().st_size for it in self.path.iterdir() if it.name != self.latest_path.name) if self.path.exists() else 0
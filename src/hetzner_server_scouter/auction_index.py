@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import json
+from argparse import Namespace
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable
+
+from hetzner_server_scouter.daemon import HttpResponse
+from hetzner_server_scouter.data_sources import Snapshot
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.settings import Datacenters
+from hetzner_server_scouter.utils import filter_server, parse_filter_query, FilterQueryError, hetzner_prices
+
+specials: dict[str, Callable[[Server], bool]] = {
+    "ipv4": lambda it: it.specials.has_IPv4, "gpu": lambda it: it.specials.has_GPU, "inic": lambda it: it.specials.has_iNIC,
+    "hwr": lambda it: it.specials.has_HWR, "ecc": lambda it: it.ram_is_ecc,
+}
+
+
+@dataclass
+class SortedIndex:
+    """The positions of the servers, sorted by a key. Allows to look up all servers within a range of the key."""
+    keys: list[float]
+    positions: list[int]
+
+    @classmethod
+    def build(cls, keys: dict[int, float]) -> SortedIndex:
+        items = sorted(keys.items(), key=lambda it: it[1])
+        return cls([key for _, key in items], [position for position, _ in items])
+
+    def range(self, lo: float | None = None, hi: float | None = None) -> list[int]:
+        """The positions of all servers with `lo <= key <= hi`"""
+        start = bisect.bisect_left(self.keys, lo) if lo is not None else 0
+        end = bisect.bisect_right(self.keys, hi) if hi is not None else len(self.keys)
+        return self.positions[start:end]
+
+
+@dataclass
+class AuctionIndex:
+    """
+    An immutable index over all servers of a snapshot. Range filters (price, RAM, disk sizes) are looked up in sorted indexes, datacenters and specials are bitsets.
+    Only the servers of the smallest range are checked against the full filters, so a query never scans the whole auction unless it has no range filter.
+    """
+    time: datetime
+    servers: list[Server]
+
+    # The price is indexed separately for servers with and without IPv4, as the IPv4 price is added on top
+    price_with_ipv4: SortedIndex
+    price_without_ipv4: SortedIndex
+    ram: SortedIndex
+    min_disk: SortedIndex
+    total_disk: SortedIndex
+
+    datacenters: dict[Datacenters | None, int] = field(default_factory=dict)
+    specials: dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, snapshot: Snapshot) -> AuctionIndex:
+        servers = [Server.parse(data) for data in snapshot.data["server"]]
+        positions = dict(enumerate(servers))
+
+        datacenters: dict[Datacenters | None, int] = {}
+        for i, server in positions.items():
+            datacenters[server.datacenter] = datacenters.get(server.datacenter, 0) | 1 << i
+
+        return cls(
+            snapshot.time, servers,
+            price_with_ipv4=SortedIndex.build({i: it.price for i, it in positions.items() if it.specials.has_IPv4}),
+            price_without_ipv4=SortedIndex.build({i: it.price for i, it in positions.items() if not it.specials.has_IPv4}),
+            ram=SortedIndex.build({i: it.ram_size for i, it in positions.items()}),
+            min_disk=SortedIndex.build({i: it.disk_summary.min_size or 0 for i, it in positions.items()}),
+            total_disk=SortedIndex.build({i: it.disk_summary.total_size for i, it in positions.items()}),
+            datacenters=datacenters,
+            specials={name: sum(1 << i for i, it in positions.items() if has_special(it)) for name, has_special in specials.items()},
+        )
+
+    def candidates(self, args: Namespace) -> list[int] | None:
+        """The positions of the smallest range that is restricted by the filters. `None` if no range filter is given."""
+        ranges = []
+
+        if args.price:
+            # Solve `price * (1 + tax) + ipv4_price <= args.price` for the price. Rounding errors are caught by the exact check afterwards.
+            factor = 1 + args.tax / 100
+            ranges.append(self.price_with_ipv4.range(hi=(args.price - (hetzner_prices.ipv4 or 0)) / factor + 1e-9) + self.price_without_ipv4.range(hi=args.price / factor + 1e-9))
+        if args.ram:
+            ranges.append(self.ram.range(lo=args.ram))
+        if args.disk_size:
+            ranges.append(self.min_disk.range(lo=args.disk_size))
+        if args.disk_size_exact:
+            ranges.append(self.min_disk.range(lo=args.disk_size_exact, hi=args.disk_size_exact))
+        if args.disk_size_raid0:
+            ranges.append(self.total_disk.range(lo=args.disk_size_raid0))
+
+        return min(ranges, key=len) if ranges else None
+
+    def mask(self, args: Namespace) -> int:
+        mask = (1 << len(self.servers)) - 1
+
+        if args.datacenter:
+            selected = {Datacenters.from_data(it) for it in args.datacenter}
+            mask &= sum(bits for datacenter, bits in self.datacenters.items() if datacenter in selected)
+
+        for name in specials:
+            if getattr(args, name):
+                mask &= self.specials[name]
+
+        return mask
+
+    def query(self, args: Namespace) -> list[Server]:
+        """All servers that match the filters, sorted by price"""
+        # Looking up single bits of a big int is linear in its size, the string of bits isn't
+        bits = bin(self.mask(args))[:1:-1].ljust(len(self.servers), "0")
+        candidates = self.candidates(args)
+        if candidates is None:
+            candidates = [i for i, bit in enumerate(bits) if bit == "1"]
+
+        matches = [self.servers[i] for i in candidates if bits[i] == "1" and filter_server(self.servers[i], args) is not None]
+        return sorted(matches, key=lambda it: it.calculate_price(args.tax))
+
+
+@dataclass
+class AuctionApi:
+    """
+    Answers queries over the latest snapshot. The index is rebuilt in a thread after every poll and then swapped in with a single assignment,
+    so a query always sees one consistent snapshot.
+    """
+    base_filters: Namespace
+    index: AuctionIndex | None = None
+
+    async def update(self, snapshot: Snapshot) -> None:
+        self.index = await asyncio.to_thread(AuctionIndex.build, snapshot)
+
+    def servers(self, query: dict[str, list[str]]) -> HttpResponse:
+        index = self.index
+        if index is None:
+            return "503 Service Unavailable", "application/json", json.dumps({"error": "The auction has not been downloaded yet"}).encode()
+
+        try:
+            limit = int(query.pop("limit", ["0"])[-1]) or None
+            if limit is not None and limit < 0:
+                raise ValueError(f"The limit must not be negative, but is {limit}")
+
+            args = parse_filter_query(query, self.base_filters)
+        except (FilterQueryError, ValueError) as ex:
+            return "400 Bad Request", "application/json", json.dumps({"error": str(ex)}).encode()
+
+        matches = index.query(args)
+        servers = [it.to_dict() | {"total_price": round(it.calculate_price(args.tax), 2)} for it in matches[:limit]]
+        return "200 OK", "application/json", json.dumps({"time": index.time.isoformat(), "count": len(matches), "servers": servers}).encode()
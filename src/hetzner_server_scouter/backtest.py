@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from argparse import Namespace
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Iterable, Hashable
+
+from hetzner_server_scouter.data_sources import Snapshot
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.notifications.models import ServerChangeType
+from hetzner_server_scouter.utils import server_matches_hardware, server_matches_price, hetzner_prices
+
+
+@dataclass
+class VariantResult:
+    name: str
+    filters: Namespace
+
+    initial_matches: int = 0
+    alerts: Counter[ServerChangeType] = field(default_factory=Counter)
+    times_to_sale: list[timedelta] = field(default_factory=list)
+
+    # The servers that currently match, with the time of their first match. It is `None` for the servers of the first snapshot, as their listing time is unknown.
+    matches: dict[int, datetime | None] = field(default_factory=dict, repr=False)
+
+    def time_to_sale_str(self, quantile: float) -> str:
+        if not self.times_to_sale:
+            return "-"
+
+        hours = sorted(it.total_seconds() / 3600 for it in self.times_to_sale)
+        return f"{hours[min(int(quantile * len(hours)), len(hours) - 1)]:.1f}h"
+
+
+@dataclass
+class BacktestResult:
+    variants: list[VariantResult]
+    snapshots: int = 0
+    start: datetime | None = None
+    end: datetime | None = None
+    took: float = 0
+
+    def to_str(self) -> str:
+        if self.start is None or self.end is None:
+            return "There are no snapshots to test against"
+
+        days = max((self.end - self.start).total_seconds() / 86400, 1e-9)
+        width = max(len(it.name) for it in self.variants)
+
+        lines = [
+            f"Tested {len(self.variants)} variants against {self.snapshots} snapshots from {self.start:%Y-%m-%d %H:%M} to {self.end:%Y-%m-%d %H:%M} in {self.took:.2f}s\n",
+            f"{'variant':<{width}}  {'initial':>7}  {'new':>5}  {'price':>5}  {'sold':>5}  {'alerts/day':>10}  {'sales':>5}  {'median time to sale':>19}  {'p90':>7}",
+        ]
+
+        for it in self.variants:
+            lines.append(
+                f"{it.name:<{width}}  {it.initial_matches:>7}  {it.alerts[ServerChangeType.new]:>5}  {it.alerts[ServerChangeType.price_changed]:>5}  {it.alerts[ServerChangeType.sold]:>5}  "
+                f"{it.alerts.total() / days:>10.1f}  {len(it.times_to_sale):>5}  {it.time_to_sale_str(0.5):>19}  {it.time_to_sale_str(0.9):>7}"
+            )
+
+        return "\n".join(lines)
+
+
+def hardware_filter_key(filters: Namespace) -> Hashable:
+    """Variants that only differ in price (or tax) share the result of `server_matches_hardware`"""
+    return tuple((k, repr(v)) for k, v in sorted(vars(filters).items()) if k not in {"price", "tax"})
+
+
+def backtest_filters(snapshots: Iterable[Snapshot], variants: dict[str, Namespace]) -> BacktestResult:
+    """
+    Runs all variants against the snapshots in a single pass. For each variant, the alerts are the ones the pipeline would have sent with these filters.
+    The first snapshot is the baseline, so it doesn't produce any alerts.
+
+    Every server is only parsed once, when it appears. The hardware filters are evaluated once per server (and per distinct set of hardware filters),
+    so for each following snapshot only the new and changed servers have to be looked at.
+    """
+    result = BacktestResult([VariantResult(name, filters) for name, filters in variants.items()])
+    hardware_keys = [hardware_filter_key(it.filters) for it in result.variants]
+    hardware_matches: dict[Hashable, dict[int, bool]] = {key: {} for key in hardware_keys}
+    servers: dict[int, Server] = {}
+    s = perf_counter()
+
+    for snapshot in snapshots:
+        is_baseline = result.start is None
+        hetzner_prices.update_from_snapshot(snapshot.data)
+        current = {it["id"]: it for it in snapshot.data["server"]}
+        sold = [server_id for server_id in servers if server_id not in current]
+        changed = []
+
+        for server_id, data in current.items():
+            if (server := servers.get(server_id)) is None:
+                servers[server_id] = Server.parse(data)
+                changed.append(server_id)
+
+            elif server.price != data["price"]:
+                server.price = data["price"]
+                changed.append(server_id)
+
+        for server_id in sold:
+            del servers[server_id]
+            for matches in hardware_matches.values():
+                matches.pop(server_id, None)
+
+        for variant, key in zip(result.variants, hardware_keys):
+            for server_id in sold:
+                if server_id in variant.matches:
+                    variant.alerts[ServerChangeType.sold] += 1
+                    if (first_match := variant.matches.pop(server_id)) is not None:
+                        variant.times_to_sale.append(snapshot.time - first_match)
+
+            hardware_cache = hardware_matches[key]
+            for server_id in changed:
+                server = servers[server_id]
+                if (matches_hardware := hardware_cache.get(server_id)) is None:
+                    matches_hardware = hardware_cache[server_id] = server_matches_hardware(server, variant.filters)
+
+                is_match, was_match = matches_hardware and server_matches_price(server, variant.filters), server_id in variant.matches
+
+                if is_match and not was_match:
+                    variant.matches[server_id] = None if is_baseline else snapshot.time
+                    if is_baseline:
+                        variant.initial_matches += 1
+                    else:
+                        variant.alerts[ServerChangeType.new] += 1
+
+                elif is_match:
+                    variant.alerts[ServerChangeType.price_changed] += 1
+
+                elif was_match:
+                    # The price went up, so the server disappears from the filtered list just as if it was sold
+                    del variant.matches[server_id]
+                    variant.alerts[ServerChangeType.sold] += 1
+
+        result.snapshots += 1
+        result.start, result.end = result.start or snapshot.time, snapshot.time
+
+    result.took = perf_counter() - s
+    return result
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from html import escape
+from pathlib import Path
+from typing import Any
+
+from hetzner_server_scouter.notifications.models import ServerChangeLogRecord
+from hetzner_server_scouter.settings import change_feed_size, change_feed_title, change_feed_url
+
+# The names of the files in the feed directory. The entries hold the rendered fragments of every entry, so they are only rendered once.
+feed_files = {"atom": "changes.atom", "json": "changes.json", "html": "changes.html"}
+feed_entries_file = "entries.json"
+
+
+def atomic_write(file: Path, text: str) -> None:
+    tmp_file = file.with_name(f".{file.name}.tmp")
+    tmp_file.write_text(text)
+    os.replace(tmp_file, file)
+
+
+def feed_time(it: datetime) -> str:
+    """The time in RFC 3339, as both Atom and JSON Feed want it. The times of the logs are local, so the offset is added."""
+    return it.astimezone().isoformat(timespec="seconds")
+
+
+@dataclass
+class FeedEntry:
+    """A single change, rendered for each of the feeds"""
+    id: int
+    time: str
+    fragments: dict[str, Any]
+
+    @classmethod
+    def render(cls, log: ServerChangeLogRecord) -> FeedEntry | None:
+        message = log.change.to_message()
+        if message is None:
+            return None
+
+        title = f"{message.header[0]} {message.server_id} {message.header[1]}"
+        html = message.render("telegram").replace("\n", "<br>\n")
+        time, entry_id = feed_time(log.time), f"{change_feed_url or 'urn:hscout:'}changes#{log.id}"
+
+        return cls(log.id, time, {
+            "json": {"id": entry_id, "url": message.url, "title": title, "content_html": html, "content_text": message.render("console"), "date_published": time},
+            "atom": f"""<entry><id>{escape(entry_id)}</id><title>{escape(title)}</title><link href="{escape(message.url)}"/><updated>{time}</updated><content type="html">{escape(html)}</content></entry>""",
+            "html": f"""<article id="{log.id}"><h2>{escape(title)}</h2><time datetime="{time}">{log.time:%Y-%m-%d %H:%M}</time><p>{html}</p></article>""",
+        })
+
+
+@dataclass
+class ChangeFeed:
+    """
+    An Atom feed, a JSON Feed and an HTML page of the latest changes, as static files that any web server can publish.
+    Every run only renders its new changes. They are added in front of the stored entries, the oldest ones are dropped, and the files are replaced atomically.
+    """
+    directory: Path
+    entries: list[FeedEntry] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, directory: Path) -> ChangeFeed:
+        try:
+            entries = json.loads((directory / feed_entries_file).read_text())
+        except (OSError, ValueError):
+            entries = []
+
+        return cls(directory, [FeedEntry(**it) for it in entries])
+
+    @property
+    def last_id(self) -> int:
+        """The id of the newest log in the feed, the next update starts after it"""
+        return self.entries[0].id if self.entries else 0
+
+    def update(self, logs: list[ServerChangeLogRecord]) -> int:
+        """Adds the logs (ordered from old to new) to the feeds. Returns the number of added entries."""
+        new_entries = [it for log in reversed(logs) if log.id > self.last_id and (it := FeedEntry.render(log)) is not None]
+        if not new_entries and self.entries:
+            return 0
+
+        self.entries = (new_entries + self.entries)[:change_feed_size]
+        self.write()
+        return len(new_entries)
+
+    def write(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        updated = self.entries[0].time if self.entries else feed_time(datetime.now())
+        feed_id = f"{change_feed_url or 'urn:hscout:'}changes"
+
+        atom_head = f"""<id>{escape(feed_id)}</id><title>{escape(change_feed_title)}</title><updated>{updated}</updated>"""
+        if change_feed_url:
+            atom_head += f"""<link rel="self" href="{escape(change_feed_url + feed_files['atom'])}"/>"""
+
+        atom = "\n".join([
+            """<?xml version="1.0" encoding="utf-8"?>""",
+            """<feed xmlns="http://www.w3.org/2005/Atom">""",
+            atom_head,
+            *(it.fragments["atom"] for it in self.entries),
+            "</feed>",
+        ])
+
+        json_feed: dict[str, Any] = {"version": "https://jsonfeed.org/version/1.1", "title": change_feed_title, "items": [it.fragments["json"] for it in self.entries]}
+        if change_feed_url:
+            json_feed["feed_url"] = change_feed_url + feed_files["json"]
+
+        html = "\n".join([
+            """<!DOCTYPE html>""",
+            f"""<html><head><meta charset="utf-8"><title>{escape(change_feed_title)}</title><link rel="alternate" type="application/atom+xml" href="{feed_files['atom']}"></head><body>""",
+            f"""<h1>{escape(change_feed_title)}</h1>""",
+            *(it.fragments["html"] for it in self.entries),
+            "</body></html>",
+        ])
+
+        # The entries are written last: If anything fails before, the next run renders the same logs again
+        atomic_write(self.directory / feed_files["atom"], atom + "\n")
+        atomic_write(self.directory / feed_files["json"], json.dumps(json_feed, ensure_ascii=False, indent=1))
+        atomic_write(self.directory / feed_files["html"], html + "\n")
+        atomic_write(self.directory / feed_entries_file, json.dumps([{"id": it.id, "time": it.time, "fragments": it.fragments} for it in self.entries], ensure_ascii=False))
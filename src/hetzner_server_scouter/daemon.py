@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Coroutine, Any
+from urllib.parse import urlsplit, parse_qs
+
+from sqlalchemy.engine import make_url
+
+from hetzner_server_scouter.metrics import Metrics, Histogram, metrics
+from hetzner_server_scouter.notifications.notify_telegram import notify_exception_via_telegram
+from hetzner_server_scouter.settings import database_url, daemon_latency_buckets_s, daemon_cycle_buckets_s
+from hetzner_server_scouter.utils import print_exception, logger
+
+# The spans that are exposed as histograms, see `Metrics.histograms`
+daemon_histograms = {
+    "run": ("hscout_cycle_duration_seconds", "The duration of a polling cycle", daemon_cycle_buckets_s),
+    "fetch": ("hscout_fetch_latency_seconds", "The latency of fetching the auction", daemon_latency_buckets_s),
+    "telegram_send": ("hscout_telegram_send_latency_seconds", "The latency of sending a single Telegram message", daemon_latency_buckets_s),
+}
+
+
+def database_file_size() -> int | None:
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite" or not url.database or not os.path.exists(url.database):
+        return None
+
+    return os.path.getsize(url.database)
+
+
+@dataclass
+class MetricsExposition:
+    """
+    The text that is served on `/metrics`. It is rendered once at the end of every cycle, so a scrape only has to write out a string.
+    """
+    metrics: Metrics
+    cycles: int = 0
+    failed_cycles: int = 0
+    text: bytes = b""
+
+    def __post_init__(self) -> None:
+        self.metrics.histograms.update({span: Histogram(buckets) for span, (_, _, buckets) in daemon_histograms.items()})
+        self.update()
+
+    def finish_cycle(self, is_success: bool) -> None:
+        self.cycles += 1
+        self.failed_cycles += not is_success
+        self.update()
+
+    def update(self) -> None:
+        it = self.metrics
+        run = it.spans.get("run")
+
+        gauges = [
+            ("hscout_servers_in_auction", "The number of servers in the auction during the last cycle", it.counters.get("servers_seen", 0)),
+            ("hscout_servers_matching", "The number of servers that matched the filters during the last cycle", it.counters.get("servers_matched", 0)),
+            ("hscout_last_cycle_duration_seconds", "The duration of the last cycle", run.total if run is not None else 0),
+            ("hscout_outbox_max_depth", "The maximum number of messages that waited to be sent during the last cycle", it.gauges.get("outbox_max_depth", 0)),
+            ("hscout_database_size_bytes", "The size of the database file", database_file_size() or 0),
+            ("hscout_last_cycle_timestamp_seconds", "The time the last cycle has finished", datetime.now().timestamp() if self.cycles else 0),
+        ]
+
+        lines = []
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value:.10g}"]
+
+        for name, help_text, value in [("hscout_cycles_total", "The number of polling cycles", self.cycles), ("hscout_failed_cycles_total", "The number of polling cycles that failed", self.failed_cycles)]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+
+        for span, (name, help_text, _) in daemon_histograms.items():
+            lines += it.histograms[span].to_prometheus(name, help_text)
+
+        self.text = ("\n".join(lines) + "\n").encode()
+
+    def response(self, _: dict[str, list[str]]) -> HttpResponse:
+        return "200 OK", "text/plain; version=0.0.4; charset=utf-8", self.text
+
+
+# The status, content type and body of a response
+HttpResponse = tuple[str, str, bytes]
+HttpRoute = Callable[[dict[str, list[str]]], HttpResponse]
+
+
+@dataclass
+class HttpServer:
+    """
+    A minimal HTTP server that answers GET requests. It runs on the same event loop as the polling.
+    The routes get the parsed query string and have to be cheap, as they run on the event loop.
+    """
+    routes: dict[str, HttpRoute]
+    host: str
+    port: int
+
+    server: asyncio.Server | None = field(default=None, repr=False)
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Listening on http://{self.host}:{self.port} ({', '.join(self.routes)})")
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def respond(self, method: str, target: str) -> HttpResponse:
+        url = urlsplit(target)
+        if method != "GET" or (route := self.routes.get(url.path)) is None:
+            return "404 Not Found", "text/plain; charset=utf-8", b"Not Found\n"
+
+        return route(parse_qs(url.query, keep_blank_values=True))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+
+            # The headers are not needed, but have to be read
+            while await asyncio.wait_for(reader.readline(), timeout=5) not in {b"\r\n", b"\n", b""}:
+                pass
+
+            method, target, *_ = request_line.decode("latin-1").split(" ") + ["", ""]
+            status, content_type, body = self.respond(method, target)
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+
+async def run_daemon(
+    poll: Callable[[], Coroutine[Any, Any, object]], interval_s: float, exposition: MetricsExposition, server: HttpServer | None = None,
+    export_path: Path | None = None, max_cycles: int | None = None
+) -> None:
+    """
+    Polls every `interval_s` seconds until it is cancelled (or after `max_cycles`). A cycle fails if `poll` raises or returns a falsy value.
+    A failed cycle is reported, but doesn't stop the daemon. The metrics are reset at the start of every cycle, only the histograms are kept.
+    """
+    if server is not None:
+        await server.start()
+
+    try:
+        while max_cycles is None or exposition.cycles < max_cycles:
+            metrics.reset()
+            is_success = False
+
+            try:
+                with metrics.span("run"):
+                    is_success = bool(await poll())
+
+            except Exception as ex:
+                print_exception(ex)
+                await notify_exception_via_telegram(ex)
+
+            exposition.finish_cycle(is_success)
+            if export_path is not None:
+                metrics.export(export_path)
+
+            if max_cycles is None or exposition.cycles < max_cycles:
+                await asyncio.sleep(interval_s)
+
+    finally:
+        if server is not None:
+            await server.stop()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, cast
+
+from hetzner_server_scouter.fetch import fetch_auction
+from hetzner_server_scouter.utils import clock
+
+snapshot_name_regex = re.compile(r".*-(\d+)\.json(\.gz)?$")
+
+
+@dataclass
+class Snapshot:
+    time: datetime
+    data: dict[str, Any]
+
+
+class DataSource(ABC):
+    """A source of auction data. Next to the live Hetzner API, recorded snapshots can be used to reproduce a run offline."""
+
+    @abstractmethod
+    def snapshots(self) -> Iterator[Snapshot]:
+        """All snapshots of the source in chronological order. They are loaded lazily, so only one is in memory at a time."""
+
+    def latest(self) -> Snapshot | None:
+        it = None
+        for it in self.snapshots():
+            pass
+
+        return it
+
+    async def fetch_latest(self) -> Snapshot | None:
+        # Reading runs in a thread, so e.g. the metrics endpoint of the daemon stays responsive
+        return await asyncio.to_thread(self.latest)
+
+
+class LiveSource(DataSource):
+    def snapshots(self) -> Iterator[Snapshot]:
+        if (it := asyncio.run(self.fetch_latest())) is not None:
+            yield it
+
+    async def fetch_latest(self) -> Snapshot | None:
+        data = await fetch_auction()
+        return Snapshot(clock.now(), data) if data is not None else None
+
+
+@dataclass
+class FileSource(DataSource):
+    path: Path
+
+    def snapshots(self) -> Iterator[Snapshot]:
+        yield Snapshot(snapshot_time_from_path(self.path), read_snapshot_file(self.path))
+
+
+@dataclass
+class DirectorySource(DataSource):
+    """A directory of snapshots as written by `record_snapshot`."""
+    path: Path
+
+    def files(self) -> list[Path]:
+        return sorted((it for it in self.path.iterdir() if snapshot_name_regex.match(it.name)), key=snapshot_time_from_path)
+
+    def snapshots(self) -> Iterator[Snapshot]:
+        for file in self.files():
+            yield Snapshot(snapshot_time_from_path(file), read_snapshot_file(file))
+
+    def latest(self) -> Snapshot | None:
+        files = self.files()
+        if not files:
+            return None
+
+        return Snapshot(snapshot_time_from_path(files[-1]), read_snapshot_file(files[-1]))
+
+
+def make_data_source(path: Path | None) -> DataSource:
+    from hetzner_server_scouter.archive import SnapshotArchive
+
+    if path is None:
+        return LiveSource()
+    elif path.is_dir() and Path(path, "index.jsonl").exists():
+        return SnapshotArchive(path)
+    elif path.is_dir():
+        return DirectorySource(path)
+
+    return FileSource(path)
+
+
+def snapshot_time_from_path(path: Path) -> datetime:
+    if (it := snapshot_name_regex.match(path.name)) is not None:
+        return datetime.fromtimestamp(int(it.group(1)))
+
+    return datetime.fromtimestamp(path.stat().st_mtime)
+
+
+def read_snapshot_file(path: Path) -> dict[str, Any]:
+    if path.suffix == ".gz":
+        with gzip.open(path, "rt") as f:
+            return cast(dict[str, Any], json.load(f))
+
+    with path.open() as f:
+        return cast(dict[str, Any], json.load(f))
+
+
+def record_snapshot(directory: Path, snapshot: Snapshot) -> Path:
+    """Writes the snapshot into the directory, so it can be replayed later with a `DirectorySource`."""
+    os.makedirs(directory, exist_ok=True)
+    path = Path(directory, f"live_data_sb_EUR-{int(snapshot.time.timestamp())}.json.gz")
+
+    # Write to a temporary file first, so an interrupted write never leaves a broken snapshot behind
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with gzip.open(tmp_path, "wt") as f:
+        json.dump(snapshot.data, f)
+
+    os.replace(tmp_path, path)
+    return path
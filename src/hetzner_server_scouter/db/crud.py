@@ -1,76 +1,297 @@
-from collections import defaultdict
-from typing import Any
+import asyncio
+from argparse import Namespace
+from time import perf_counter
+from typing import Any, AbstractSet, Iterator, Iterable
 
-from sqlalchemy import select
+from sqlalchemy import select, update, delete, and_, or_, func, case, ColumnElement
 from sqlalchemy.orm import Session as DatabaseSession
 
-from hetzner_server_scouter.db.db_utils import database_transaction
-from hetzner_server_scouter.db.models import Server, DiskType
-from hetzner_server_scouter.notifications.models import ServerChange
-from hetzner_server_scouter.settings import get_hetzner_api, is_testing
-from hetzner_server_scouter.utils import filter_none
+from hetzner_server_scouter.db.db_utils import database_transaction, run_in_database_thread
+from hetzner_server_scouter.db.models import Server, WatchedServer
+from hetzner_server_scouter.db.state_file import ServerStateFile, find_changed_ids
+from hetzner_server_scouter.fetch import fetch_auction
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType
+from hetzner_server_scouter.settings import pipeline_log_batch_size, Datacenters
+from hetzner_server_scouter.utils import datetime_nullable_fromisoformat, filter_server_with_program_args, debug_time, program_args, hetzner_prices
+from hetzner_server_scouter.validation import payload_validator
 
 
 def read_servers(db: DatabaseSession) -> list[Server]:
     return list(db.execute(select(Server)).scalars().all())
 
 
+def read_server_snapshots(db: DatabaseSession, ids: list[int] | None = None) -> dict[int, dict[str, Any]]:
+    """Reads the servers (or only the ones with the `ids`) as plain dicts so the diff doesn't depend on the state of the session."""
+    if ids is None:
+        return {server.id: server.to_dict() for server in read_servers(db)}
+
+    return {server.id: server.to_dict() for server in db.execute(select(Server).where(Server.id.in_(ids))).scalars()}
+
+
+def server_filter_clauses(args: Namespace) -> list[ColumnElement[bool]]:
+    """The filters of `filter_server` as SQL, evaluated on the derived columns of `Server`"""
+    columns = Server.__table__.c
+    disk_num = columns.disk_num_hdd + columns.disk_num_enterprise_hdd + columns.disk_num_ssd + columns.disk_num_enterprise_ssd
+    clauses: list[ColumnElement[bool]] = [disk_num > 0]
+
+    if args.price:
+        # The stored `total_price` is calculated with the tax of the run that stored the server. So the price is compared instead, for which
+        # `price * (1 + tax) + ipv4_price <= args.price` is solved separately with and without IPv4 so the index on (has_ipv4, price) can be used.
+        # The exact check afterwards guards against rounding errors of the bound.
+        factor, ipv4_price = 1 + args.tax / 100, hetzner_prices.ipv4 or 0
+        clauses.append(or_(
+            and_(columns.has_ipv4.is_(True), Server.price <= (args.price - ipv4_price) / factor + 1e-9),
+            and_(columns.has_ipv4.is_(False), Server.price <= args.price / factor + 1e-9),
+        ))
+        clauses.append(Server.price * factor + case((columns.has_ipv4.is_(True), ipv4_price), else_=0.0) <= args.price)
+
+    if args.cpu:
+        clauses.append(func.lower(Server.cpu_name).contains(args.cpu.lower(), autoescape=True))
+    if args.datacenter:
+        clauses.append(Server.datacenter.in_({Datacenters.from_data(it) for it in args.datacenter}))
+    if args.ram:
+        clauses.append(Server.ram_size >= args.ram)
+
+    if args.disk_num:
+        clauses.append(disk_num >= args.disk_num)
+    if args.disk_num_exact:
+        clauses.append(disk_num == args.disk_num_exact)
+    if args.disk_num_quick:
+        clauses.append(columns.disk_num_ssd + columns.disk_num_enterprise_ssd == args.disk_num_quick)
+    if args.disk_size:
+        clauses.append(columns.disk_min_size >= args.disk_size)
+    if args.disk_size_exact:
+        clauses += [columns.disk_min_size == args.disk_size_exact, columns.disk_max_size == args.disk_size_exact]
+    if args.disk_size_any:
+        clauses.append(columns.disk_max_size >= args.disk_size_any)
+    if args.disk_enterprise:
+        clauses += [columns.disk_num_hdd == 0, columns.disk_num_ssd == 0]
+
+    if (it := args.disk_size_redundant) is not None:
+        clauses.append(or_(columns.raid1_size >= it, columns.raid5_size >= it, columns.raid6_size >= it))
+    for size, column in [(args.disk_size_raid0, columns.disk_total_size), (args.disk_size_raid1, columns.raid1_size), (args.disk_size_raid5, columns.raid5_size), (args.disk_size_raid6, columns.raid6_size)]:
+        if size is not None:
+            clauses.append(column >= size)
+
+    for special, column in [("ipv4", columns.has_ipv4), ("gpu", columns.has_gpu), ("inic", columns.has_inic), ("hwr", columns.has_hwr), ("ecc", Server.ram_is_ecc)]:
+        if getattr(args, special):
+            clauses.append(column.is_(True))
+
+    return clauses
+
+
+def read_matching_servers(db: DatabaseSession, args: Namespace) -> list[Server]:
+    """
+    The stored servers that match the filters, sorted by price. The filters are evaluated by the database, so this is cheap even for the whole auction.
+    Only servers that are stored can be found, so it is most useful with `--store-all`.
+    """
+    return list(db.execute(select(Server).where(*server_filter_clauses(args)).order_by(Server.price)).scalars().all())
+
+
+def read_watchlist(db: DatabaseSession) -> frozenset[int]:
+    return frozenset(db.execute(select(WatchedServer.id)).scalars())
+
+
+def add_to_watchlist(db: DatabaseSession, server_ids: Iterable[int]) -> None:
+    database_transaction(db, lambda: [db.merge(WatchedServer(id=it)) for it in server_ids])
+
+
+def remove_from_watchlist(db: DatabaseSession, server_ids: Iterable[int]) -> None:
+    """
+    Without `--store-all`, a server that doesn't match the filters is only stored because it is watched. Its row is deleted along with it,
+    as the next run wouldn't see the server anymore and would report it as sold while it is still in the auction.
+    """
+    server_ids = list(server_ids)
+
+    def modify() -> None:
+        db.execute(delete(WatchedServer).where(WatchedServer.id.in_(server_ids)))
+        if not program_args.store_all:
+            unmatched_ids = [it.id for it in db.execute(select(Server).where(Server.id.in_(server_ids))).scalars() if filter_server_with_program_args(it) is None]
+            db.execute(delete(Server).where(Server.id.in_(unmatched_ids)))
+
+    database_transaction(db, modify)
+
+
+def update_derived_columns(db: DatabaseSession) -> None:
+    """Recalculates the derived columns of all servers, e.g. after they have been added to an existing database"""
+    database_transaction(db, lambda: [it.with_derived_columns() for it in read_servers(db)])
+
+
+def parse_server_list(api_data: dict[str, Any], watchlist: frozenset[int] = frozenset(), skipped: set[int] | None = None) -> Iterator[Server]:
+    """
+    Yields the servers that match the filters and the ones of the `watchlist`, regardless of the filters.
+    With `--store-all`, every server is yielded (the matching ones are still counted).
+
+    Records that fail the validation are not yielded, their ids are added to `skipped`.
+    The time of the `parse` and `filter` spans and the counts are summed up locally and added to the metrics once, as they would cost more than the filters themselves per server.
+    """
+    parse_s, filter_s, num_seen, num_matched, num_watched = 0.0, 0.0, 0, 0, 0
+
+    try:
+        for data in api_data["server"]:
+            s = perf_counter()
+            server = payload_validator.parse(data)
+            parse_s += perf_counter() - s
+
+            if server is None:
+                if skipped is not None and isinstance(data.get("id"), int):
+                    skipped.add(data["id"])
+                continue
+
+            s = perf_counter()
+            is_match = filter_server_with_program_args(server) is not None
+            filter_s += perf_counter() - s
+
+            num_seen += 1
+            num_matched += is_match
+            num_watched += server.id in watchlist
+            if is_match or program_args.store_all or server.id in watchlist:
+                yield server
+
+    finally:
+        metrics.record("parse", parse_s)
+        metrics.record("filter", filter_s)
+        metrics.count("servers_seen", num_seen)
+        metrics.count("servers_matched", num_matched)
+        metrics.count("servers_watched", num_watched)
+
+
 async def download_server_list(_api_data: dict[str, Any] | None = None) -> list[Server] | None:
-    api_data = _api_data or get_hetzner_api()
+    api_data = _api_data or await fetch_auction()
     if api_data is None:
         return None
 
-    return filter_none([Server.from_data(data) for data in api_data["server"]])
+    return list(parse_server_list(api_data))
+
+
+def diff_server_list(
+    existing: dict[int, dict[str, Any]], new_servers: Iterable[Server], watchlist: frozenset[int] = frozenset(), skipped: AbstractSet[int] = frozenset()
+) -> Iterator[ServerChange]:
+    """
+    Compares the new servers with the `existing` ones and yields a change as soon as it is found.
+    Sold servers can only be detected once all new servers are seen, so they are yielded last. The changes of the servers in the `watchlist` are marked.
+    The servers that are `skipped` by the validation are still in the auction, so they are not sold.
+
+    Note: `existing` is consumed in the process.
+    """
+    for server in new_servers:
+        old = existing.pop(server.id, None)
+
+        if old is None:
+            yield ServerChange(ServerChangeType.new, server.id, None, server.to_dict(), is_watched=server.id in watchlist)
+
+        elif old["price"] != server.price:
+            attrs = old | {"price": server.price, "time_of_next_price_reduce": server.to_dict()["time_of_next_price_reduce"]}
+            yield ServerChange(ServerChangeType.price_changed, server.id, old["last_message_id"], attrs, old["price"], is_watched=server.id in watchlist)
+
+    for old in existing.values():
+        if old["id"] in skipped:
+            continue
+
+        yield ServerChange(ServerChangeType.sold, old["id"], old["last_message_id"], old, is_watched=old["id"] in watchlist)
+
 
+def apply_server_changes(db: DatabaseSession, changes: list[ServerChange]) -> None:
+    """Writes the changes to the `servers` table. This does not commit."""
+    price_updates, sold_ids = [], []
+
+    for change in changes:
+        match change.kind:
+            case ServerChangeType.new:
+                db.add(Server.from_dict(change.attrs))
+            case ServerChangeType.price_changed:
+                price_updates.append({
+                    "id": change.server_id, "price": change.attrs["price"], "total_price": Server._calculate_price(change.attrs["price"], change.attrs["specials"]["has_IPv4"]),
+                    "time_of_next_price_reduce": datetime_nullable_fromisoformat(change.attrs["time_of_next_price_reduce"])
+                })
+            case ServerChangeType.sold:
+                sold_ids.append(change.server_id)
+
+    if price_updates:
+        db.execute(update(Server), price_updates)
+    if sold_ids:
+        db.execute(delete(Server).where(Server.id.in_(sold_ids)))
+
+
+def write_last_message_ids(db: DatabaseSession, message_ids: dict[int, int]) -> None:
+    """Writes the ids of the sent messages in a single bulk UPDATE. This does not commit."""
+    if message_ids:
+        db.execute(update(Server), [{"id": server_id, "last_message_id": message_id} for server_id, message_id in message_ids.items()])
+
+
+def update_server_list(db: DatabaseSession, new_servers: Iterable[Server]) -> list[ServerChange]:
+    changes = list(diff_server_list(read_server_snapshots(db), new_servers))
+    database_transaction(db, lambda: apply_server_changes(db, changes))
+    return changes
+
+
+async def read_existing_servers(db: DatabaseSession, new_servers: list[Server], state: ServerStateFile) -> dict[int, dict[str, Any]] | None:
+    """
+    The existing servers for `diff_server_list`, but only the changed and sold ones are loaded from the database. The others only need their price,
+    which is taken from the state file. Returns `None` if the state file can't be used.
+    """
+    if (prices := state.read()) is None:
+        return None
+
+    with metrics.span("state_diff"):
+        changed_ids = find_changed_ids(prices, sorted((it.id, it.price) for it in new_servers))
+
+    rows = await run_in_database_thread(lambda: read_server_snapshots(db, changed_ids))
+    if len(rows) != len(changed_ids):
+        return None
 
-def update_server_list(db: DatabaseSession, _new_servers: list[Server]) -> list[ServerChange]:
-    existing_servers = read_servers(db)
-    new_servers = {it.id: it for it in _new_servers}
+    metrics.count("state_file_rows_loaded", len(rows))
+    return {server_id: {"id": server_id, "price": price} for server_id, price in prices} | rows
 
-    updates = [server.update(db, new_servers.pop(server.id, None)) for server in existing_servers]
-    new = [server.new(db) for server in new_servers.values()]
 
-    database_transaction(db, lambda: None)
-    return filter_none(updates) + new
+@debug_time("diff")
+async def stream_server_changes(
+    db: DatabaseSession, api_data: dict[str, Any], queue: asyncio.Queue[ServerChange | None], state: ServerStateFile | None = None, watchlist: frozenset[int] = frozenset()
+) -> None:
+    """
+    The diff stage of the pipeline: Every change is put into the `queue` as soon as it is found, `None` marks the end.
+    The queue is bounded, so if the consumers lag behind, the diff waits for them.
 
+    With a `state` file, the servers are parsed up front, so only the changed rows have to be loaded. The new prices are left in `state.pending`,
+    they have to be committed once everything has been written to the database.
 
-def create_disk_type_from_string(string: str) -> tuple[DiskType, int]:
-    _size, unit, *rest = string.split(" ")
-    is_enterprise = "Enterprise" in rest or "Datacenter" in rest
+    The servers of the `watchlist` are stored and notified regardless of the filters. They are diffed before all other servers,
+    so their changes are the first in the queue and don't wait behind the rest of a large refresh.
+    """
+    skipped: set[int] = set()
+    records = api_data["server"]
+    watched_records = [it for it in records if it.get("id") in watchlist] if watchlist else []
+    if watched_records:
+        records = [it for it in records if it.get("id") not in watchlist]
 
-    if unit == "GB":
-        size = int(_size)
-    elif unit == "TB":
-        size = int(round(float(_size) * 1000, 0))
-    elif unit == "PB":
-        size = int(round(float(_size) * 1000 ** 2, 0))
-    else:
-        # If disk sizes ever exceed Petabytes, I'll eat a broom
-        assert False, f"Wrong unit detected: {unit!r}"
+    watched_servers = list(parse_server_list({"server": watched_records}, watchlist, skipped))
+    new_servers: Iterable[Server] = parse_server_list({"server": records}, watchlist, skipped)
+    existing = None
 
-    if "HDD" in rest:
-        if is_enterprise:
-            return "enterprise_hdd", size
-        else:
-            return "hdd", size
-    if "SSD" in rest:
-        if is_enterprise:
-            return "enterprise_ssd", size
-        else:
-            return "ssd", size
+    if state is not None:
+        new_servers = list(new_servers)
+        state.pending = [(it.id, it.price) for it in watched_servers + new_servers]
+        existing = await read_existing_servers(db, watched_servers + new_servers, state)
+        metrics.count("state_file_hits" if existing is not None else "state_file_misses")
 
-    assert False, f"Wrong Disk Type detected: {' '.join(rest)}"
+    if existing is None:
+        existing = await run_in_database_thread(lambda: read_server_snapshots(db))
 
+    watched_existing = {it: existing.pop(it) for it in watchlist if it in existing}
+    for change in diff_server_list(watched_existing, watched_servers, watchlist, skipped):
+        await queue.put(change)
+        await asyncio.sleep(0)
 
-def create_disk_dict_from_hdd_arr(hdd_arr: list[str], server_disk_data: dict[str, list[int]]) -> dict[DiskType, list[int]]:
-    disks = defaultdict(list)
+    for i, change in enumerate(diff_server_list(existing, new_servers, watchlist, skipped)):
+        await queue.put(change)
 
-    for disk in hdd_arr:
-        disk_type, disk_size = create_disk_type_from_string(disk)
-        disks[disk_type].append(disk_size)
+        if i % pipeline_log_batch_size == 0:
+            # Hand over control after the first change (and then after every batch) so it can be delivered while the diff continues
+            await asyncio.sleep(0)
 
-    if is_testing or True:
-        assert sorted(server_disk_data["hdd"]) == sorted(disks["hdd"] + disks["enterprise_hdd"])
-        assert sorted(server_disk_data["sata"] + server_disk_data["nvme"]) == sorted(disks["ssd"] + disks["enterprise_ssd"])
+    if skipped and state is not None:
+        # The skipped servers are still stored, but they have no price in this run. Without a new state file, the next run reads every row again.
+        state.pending = None
 
-    return disks
+    await queue.put(None)
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Type, TypeVar
 
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, Engine, MetaData, inspect, text
 from sqlalchemy.orm import declarative_base, DeclarativeMeta, sessionmaker
 
 from hetzner_server_scouter.settings import error_exit, database_url, db_make_sqlite_url, sqlite_database_name, database_verbose_sql, warning_text
@@ -58,6 +59,42 @@ DatabaseSessionMaker = sessionmaker(autocommit=False, bind=database_engine)
 DataBase: Type[DeclarativeMeta] = declarative_base(cls=DatabaseObject)
 DB_T = TypeVar("DB_T", bound=DatabaseObject)
 
+# The thread that does all the database work if `database_use_worker_thread` is set. As a session is not thread-safe, there must only be exactly one worker.
+database_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hscout-db")
+
+
+def add_missing_columns(engine: Engine, metadata: MetaData) -> list[str]:
+    """
+    `create_all` only creates missing tables, so columns that have been added to an existing table (and their indexes) are created here.
+    The new columns have to be nullable. Returns the added columns as `table.column`.
+    """
+    inspector, quote = inspect(engine), engine.dialect.identifier_preparer.quote
+    added = []
+
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing_columns = {it["name"] for it in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    connection.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(engine.dialect)}"))
+                    added.append(f"{table.name}.{column.name}")
+
+            existing_indexes = {it["name"] for it in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+
+    return added
+
 
 def init_database() -> None:
     DataBase.metadata.create_all(bind=database_engine)
+
+    if any(it.startswith("servers.") for it in add_missing_columns(database_engine, DataBase.metadata)):
+        from hetzner_server_scouter.db.crud import update_derived_columns
+
+        with DatabaseSessionMaker() as db:
+            update_derived_columns(db)
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
+import asyncio
 from logging import error
 from typing import Type, Any, Callable
 
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session as DatabaseSession
 
-from hetzner_server_scouter.db.db_conf import DB_T
-from hetzner_server_scouter.settings import is_testing
+from hetzner_server_scouter.db.db_conf import DB_T, database_executor
+from hetzner_server_scouter.settings import is_testing, database_use_worker_thread
 from hetzner_server_scouter.utils import T, KT
 
 
@@ -23,6 +24,21 @@ def database_transaction(db: DatabaseSession, db_modify_func: Callable[[], Any])
             raise
 
 
+async def run_in_database_thread(func: Callable[[], T]) -> T:
+    """
+    Runs the function on the database thread. Everything that touches a session – including attribute access on loaded objects, which may lazily load them – has to go through here.
+    If `database_use_worker_thread` is not set, the function is simply called.
+    """
+    if not database_use_worker_thread:
+        return func()
+
+    return await asyncio.get_running_loop().run_in_executor(database_executor, func)
+
+
+async def database_transaction_async(db: DatabaseSession, db_modify_func: Callable[[], Any]) -> None:
+    await run_in_database_thread(lambda: database_transaction(db, db_modify_func))
+
+
 def add_object_to_database(db: DatabaseSession, it: T) -> T | None:
     database_transaction(db, lambda: db.add(it))
     return it
@@ -1,27 +1,19 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Any, TYPE_CHECKING, TypedDict, Literal
+from typing import Any, TYPE_CHECKING
 
-from sqlalchemy import Text
-from sqlalchemy.orm import Session as DatabaseSession, mapped_column, Mapped, composite, relationship
+from sqlalchemy import Text, Index
+from sqlalchemy.orm import mapped_column, Mapped, composite, relationship
 from sqlalchemy_utils import JSONType
 
 from hetzner_server_scouter.db.db_conf import DataBase
+from hetzner_server_scouter.db.parse_tables import DiskSummary, DiskTypeDict, parse_tables
 from hetzner_server_scouter.settings import Datacenters, ServerSpecials
-from hetzner_server_scouter.utils import datetime_nullable_fromtimestamp, program_args, hetzner_ipv4_price
+from hetzner_server_scouter.utils import datetime_nullable_fromtimestamp, datetime_nullable_fromisoformat, program_args, hetzner_prices
 
 if TYPE_CHECKING:
-    from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog
-
-DiskType = Literal["hdd"] | Literal["enterprise_hdd"] | Literal["ssd"] | Literal["enterprise_ssd"]
-
-
-class DiskTypeDict(TypedDict):
-    hdd: list[int]
-    enterprise_hdd: list[int]
-    ssd: list[int]
-    enterprise_ssd: list[int]
+    from hetzner_server_scouter.notifications.models import ServerChangeLog
 
 
 class Server(DataBase):  # type:ignore[valid-type, misc]
@@ -34,6 +26,7 @@ class Server(DataBase):  # type:ignore[valid-type, misc]
     time_of_next_price_reduce: Mapped[datetime | None] = mapped_column(nullable=True)
     datacenter: Mapped[Datacenters] = mapped_column(nullable=False)
     cpu_name: Mapped[str] = mapped_column(Text, nullable=False)
+    cpu_cores: Mapped[int | None] = mapped_column(nullable=True)  # Derived from the CPU name, see `cpu_cores_by_model`. `None` for unknown CPUs.
 
     ram_size: Mapped[int] = mapped_column(nullable=False)
     ram_num: Mapped[int] = mapped_column(nullable=False)
@@ -44,6 +37,18 @@ class Server(DataBase):  # type:ignore[valid-type, misc]
         mapped_column("has_ipv4"), mapped_column("has_gpu"), mapped_column("has_inic"), mapped_column("has_hwr")
     )
 
+    # Derived from the columns above when the server is parsed, so neither the filters nor the messages have to look at the single disks.
+    # They are nullable as they are added to existing databases by `init_database`.
+    total_price: Mapped[float | None] = mapped_column(nullable=True, index=True)  # At the tax of the run that stored the server
+    disk_summary: Mapped[DiskSummary] = composite(
+        mapped_column("disk_num_hdd", nullable=True), mapped_column("disk_num_enterprise_hdd", nullable=True), mapped_column("disk_num_ssd", nullable=True),
+        mapped_column("disk_num_enterprise_ssd", nullable=True), mapped_column("disk_min_size", nullable=True, index=True), mapped_column("disk_max_size", nullable=True),
+        mapped_column("disk_total_size", nullable=True, index=True), mapped_column("raid1_size", nullable=True), mapped_column("raid5_size", nullable=True),
+        mapped_column("raid6_size", nullable=True),
+    )
+
+    __table_args__ = (Index("ix_servers_ipv4_price", "has_ipv4", "price"), Index("ix_servers_ram_size", "ram_size"))
+
     change_logs: Mapped[list[ServerChangeLog]] = relationship("ServerChangeLog", back_populates="server")
 
     @property
@@ -52,46 +57,56 @@ class Server(DataBase):  # type:ignore[valid-type, misc]
 
     @property
     def all_hdds(self) -> list[int]:
-        return [disk for disk in self.disks["hdd"] + self.disks["enterprise_hdd"]]
+        return [disk for disk in self.disks.get("hdd", []) + self.disks.get("enterprise_hdd", [])]
 
     @property
     def all_ssds(self) -> list[int]:
-        return [disk for disk in self.disks["ssd"] + self.disks["enterprise_ssd"]]
+        return [disk for disk in self.disks.get("ssd", []) + self.disks.get("enterprise_ssd", [])]
 
     @classmethod
     def from_data(cls, data: dict[str, Any], last_message_id: int | None = None) -> Server | None:
         from hetzner_server_scouter.utils import filter_server_with_program_args
-        from hetzner_server_scouter.db.crud import create_disk_dict_from_hdd_arr
-
-        return filter_server_with_program_args(
-            Server(
-                id=data["id"], price=data["price"],
-                time_of_next_price_reduce=datetime_nullable_fromtimestamp(None if data["fixed_price"] else data["next_reduce_timestamp"]),
-                datacenter=Datacenters.from_data(data["datacenter"]), cpu_name=data["cpu"],
-                ram_size=data["ram_size"], ram_num=int(data["ram"][0][0]), ram_is_ecc="ECC" in data["specials"],
-                disks=create_disk_dict_from_hdd_arr(data["hdd_arr"], data["serverDiskData"]),
-                specials=ServerSpecials("IPv4" in data["specials"], "GPU" in data["specials"], "iNIC" in data["specials"], "HWR" in data["specials"]),
-                last_message_id=last_message_id
-            )
-        )
 
-    def to_dict(self) -> dict[str, Any]:
-        ret: dict[str, Any] = {}
+        return filter_server_with_program_args(cls.parse(data, last_message_id))
 
-        for key, item in self.__dict__.items():
-            if key.startswith("_sa"):
-                continue
+    @classmethod
+    def parse(cls, data: dict[str, Any], last_message_id: int | None = None) -> Server:
+        """Parses the data of the Hetzner API without applying any filters. The repeating strings are looked up in the `parse_tables`."""
+        disks = parse_tables.parse_disks(data["hdd_arr"])
+        return Server(
+            id=data["id"], price=data["price"],
+            time_of_next_price_reduce=datetime_nullable_fromtimestamp(None if data["fixed_price"] else data["next_reduce_timestamp"]),
+            datacenter=parse_tables.datacenter(data["datacenter"]), cpu_name=parse_tables.cpu_name(data["cpu"]),
+            ram_size=data["ram_size"], ram_num=int(data["ram"][0][0]), ram_is_ecc="ECC" in data["specials"],
+            disks=disks.disks,
+            specials=ServerSpecials("IPv4" in data["specials"], "GPU" in data["specials"], "iNIC" in data["specials"], "HWR" in data["specials"]),
+            last_message_id=last_message_id
+        ).with_derived_columns(disks.summary)
 
-            if isinstance(item, ServerSpecials):
-                ret[key] = item.__dict__
-            elif isinstance(item, Datacenters):
-                ret[key] = item.value
-            elif isinstance(item, datetime):
-                ret[key] = item.isoformat()
-            else:
-                ret[key] = item
+    @classmethod
+    def from_dict(cls, it: dict[str, Any]) -> Server:
+        """The inverse of `to_dict`"""
+        return Server(
+            id=it["id"], price=it["price"], time_of_next_price_reduce=datetime_nullable_fromisoformat(it["time_of_next_price_reduce"]),
+            datacenter=Datacenters(it["datacenter"]) if it["datacenter"] is not None else None, cpu_name=it["cpu_name"],
+            ram_size=it["ram_size"], ram_num=it["ram_num"], ram_is_ecc=it["ram_is_ecc"],
+            disks=it["disks"], specials=ServerSpecials(**it["specials"]), last_message_id=it["last_message_id"]
+        ).with_derived_columns()
+
+    def with_derived_columns(self, disk_summary: DiskSummary | None = None) -> Server:
+        self.cpu_cores = parse_tables.cores_of_cpu(self.cpu_name)
+        self.total_price = self._calculate_price(self.price, self.specials.has_IPv4)
+        self.disk_summary = disk_summary or DiskSummary.from_disks(self.disks)
+        return self
 
-        return ret
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id, "price": self.price,
+            "time_of_next_price_reduce": self.time_of_next_price_reduce.isoformat() if self.time_of_next_price_reduce is not None else None,
+            "datacenter": self.datacenter.value if self.datacenter is not None else None, "cpu_name": self.cpu_name, "cpu_cores": self.cpu_cores,
+            "ram_size": self.ram_size, "ram_num": self.ram_num, "ram_is_ecc": self.ram_is_ecc,
+            "disks": dict(self.disks), "specials": dict(self.specials.__dict__), "last_message_id": self.last_message_id,
+        }
 
     def __eq__(self, other: object | Server) -> bool:
         if not isinstance(other, Server):
@@ -100,30 +115,17 @@ class Server(DataBase):  # type:ignore[valid-type, misc]
         return (self.id == other.id and self.price == other.price and self.datacenter == other.datacenter and self.cpu_name == other.cpu_name and
                 self.ram_size == other.ram_size and self.ram_num == other.ram_num and self.disks == other.disks and self.specials == other.specials)
 
-    def new(self, db: DatabaseSession) -> ServerChange:
-        from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType
-
-        db.add(self)
-        return ServerChange(ServerChangeType.new, self.id, None, self.to_dict())
-
-    def update(self, db: DatabaseSession, new: Server | None) -> ServerChange | None:
-        from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType
+    def calculate_price(self, tax: int | None = None) -> float:
+        return self._calculate_price(self.price, self.specials.has_IPv4, tax)
 
-        if new is None:
-            change = ServerChange(ServerChangeType.sold, self.id, self.last_message_id, self.to_dict())
-            db.delete(self)
-            return change
-
-        if self.price == new.price:
-            return None
+    @staticmethod
+    def _calculate_price(price: float, has_ipv4: bool, tax: int | None = None) -> float:
+        return float(price * (1 + (program_args.tax if tax is None else tax) / 100) + (hetzner_prices.ipv4 or 0) * has_ipv4)
 
-        self.price = new.price
-        self.time_of_next_price_reduce = new.time_of_next_price_reduce
-        return ServerChange(ServerChangeType.price_changed, self.id, self.last_message_id, self.to_dict())
 
-    def calculate_price(self) -> float:
-        return self._calculate_price(self.price, self.specials.has_IPv4)
+class WatchedServer(DataBase):  # type:ignore[valid-type, misc]
+    """A server whose changes are always notified, regardless of the filters. It doesn't have to be in the auction (anymore)."""
+    __tablename__ = "watched_servers"
 
-    @staticmethod
-    def _calculate_price(price: float, has_ipv4: bool) -> float:
-        return float(price * (1 + program_args.tax / 100) + (hetzner_ipv4_price or 0) * has_ipv4)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    time: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Literal, TypedDict
+
+from hetzner_server_scouter.settings import Datacenters, parse_tables_max_size
+from hetzner_server_scouter.utils import KT, T
+
+DiskType = Literal["hdd"] | Literal["enterprise_hdd"] | Literal["ssd"] | Literal["enterprise_ssd"]
+
+
+class DiskTypeDict(TypedDict):
+    hdd: list[int]
+    enterprise_hdd: list[int]
+    ssd: list[int]
+    enterprise_ssd: list[int]
+
+
+@dataclass(frozen=True)
+class DiskSummary:
+    """The numbers of the disks of a server that the filters and messages need. It is calculated once when the server is parsed."""
+    num_hdd: int
+    num_enterprise_hdd: int
+    num_ssd: int
+    num_enterprise_ssd: int
+
+    min_size: int | None
+    max_size: int | None
+    total_size: int
+
+    # The usable capacity of each RAID level when using all disks. `None` if there are not enough disks for the level.
+    raid1_size: int | None
+    raid5_size: int | None
+    raid6_size: int | None
+
+    @classmethod
+    def from_disks(cls, disks: DiskTypeDict) -> DiskSummary:
+        all_disks = [disk for kind in disks.values() for disk in kind]  # type:ignore[attr-defined]
+        num, min_size = len(all_disks), min(all_disks, default=None)
+
+        return cls(
+            len(disks.get("hdd", [])), len(disks.get("enterprise_hdd", [])), len(disks.get("ssd", [])), len(disks.get("enterprise_ssd", [])),
+            min_size, max(all_disks, default=None), sum(all_disks),
+            raid1_size=min_size * (num // 2) if min_size is not None else None,
+            raid5_size=min_size * (num - 1) if min_size is not None and num >= 3 else None,
+            raid6_size=min_size * (num - 2) if min_size is not None and num >= 4 else None,
+        )
+
+    @property
+    def num(self) -> int:
+        return self.num_hdd + self.num_enterprise_hdd + self.num_ssd + self.num_enterprise_ssd
+
+    @property
+    def num_quick(self) -> int:
+        return self.num_ssd + self.num_enterprise_ssd
+
+    @property
+    def raid0_size(self) -> int:
+        return self.total_size
+
+    @property
+    def is_enterprise(self) -> bool:
+        return self.num_hdd == 0 and self.num_ssd == 0
+
+
+class PayloadError(ValueError):
+    """A record of the auction that doesn't have the expected format"""
+
+    def __init__(self, check: str, message: str) -> None:
+        super().__init__(message)
+        self.check = check
+
+
+def create_disk_type_from_string(string: str) -> tuple[DiskType, int]:
+    _size, unit, *rest = string.split(" ")
+    is_enterprise = "Enterprise" in rest or "Datacenter" in rest
+
+    if unit == "GB":
+        size = int(_size)
+    elif unit == "TB":
+        size = int(round(float(_size) * 1000, 0))
+    elif unit == "PB":
+        size = int(round(float(_size) * 1000 ** 2, 0))
+    else:
+        # If disk sizes ever exceed Petabytes, I'll eat a broom
+        raise PayloadError("disks", f"Wrong unit detected: {unit!r}")
+
+    if "HDD" in rest:
+        if is_enterprise:
+            return "enterprise_hdd", size
+        else:
+            return "hdd", size
+    if "SSD" in rest:
+        if is_enterprise:
+            return "enterprise_ssd", size
+        else:
+            return "ssd", size
+
+    raise PayloadError("disks", f"Wrong Disk Type detected: {' '.join(rest)}")
+
+
+def create_disk_dict_from_hdd_arr(hdd_arr: list[str]) -> dict[DiskType, list[int]]:
+    """The sizes of the disks by their type. Whether they match the `serverDiskData` is checked by `validation.check_disks`."""
+    disks = defaultdict(list)
+
+    for disk in hdd_arr:
+        disk_type, disk_size = create_disk_type_from_string(disk)
+        disks[disk_type].append(disk_size)
+
+    return disks
+
+
+# The number of cores of the CPUs of the auction, as the feed only has their name (and `cpu_count`, which is the number of sockets).
+# The first pattern that is found in the name wins. A CPU that is not listed has no cores, and is therefore not in the "core" ranking.
+cpu_cores_by_model: list[tuple[re.Pattern[str], int]] = [(re.compile(pattern), cores) for pattern, cores in [
+    (r"\bi7-(920|950|960|975|2600|3770|4770|4790|6700|7700)\b", 4), (r"\bi7-8700\b", 6), (r"\bi9-9900K\b", 8), (r"\bi9-12900K\b", 16), (r"\bi9-13900\b", 24),
+    (r"\bi5-12500\b", 6), (r"\bi5-13500\b", 14),
+    (r"\bXeon E3-12\d\d", 4), (r"\bXeon E5-1620", 4), (r"\bXeon E5-1650", 6), (r"\bXeon E-2[12]76G\b", 6), (r"\bXeon E-2388G\b", 8),
+    (r"\bXeon W-2[12]45\b", 8), (r"\bXeon W-2295\b", 18), (r"\bXeon Gold 5412U\b", 24),
+    (r"\bRyzen 5 3600\b", 6), (r"\bRyzen 7 (PRO )?(1700X|3700X|7700X?)\b", 8), (r"\bRyzen 9 (3900|5900X)\b", 12), (r"\bRyzen 9 (5950X|7950X3D)\b", 16),
+    (r"\bThreadripper 2950X\b", 16), (r"\bEPYC 7401P\b", 24), (r"\bEPYC 7443P\b", 24), (r"\bEPYC 7502P\b", 32), (r"\bEPYC 9454P\b", 48),
+]]
+
+
+@dataclass(frozen=True)
+class ParsedDisks:
+    """The disks of an `hdd_arr`. They are shared by every server with the same disks, so they must not be modified."""
+    disks: DiskTypeDict
+    summary: DiskSummary
+
+
+@dataclass
+class ParseTables:
+    """
+    The parse results of the strings that repeat throughout the auction: The `hdd_arr` of a server, its CPU name (and thereby its cores) and its datacenter code.
+    An auction only has a few dozen of each, so every distinct string is parsed once and all servers with it share the result and a single copy of the string.
+    The tables live as long as the process, so the daemon reuses them in every cycle.
+    """
+    max_size: int = parse_tables_max_size
+    disks: dict[tuple[str, ...], ParsedDisks] = field(default_factory=dict)
+    cpu_names: dict[str, str] = field(default_factory=dict)
+    cpu_cores: dict[str, int | None] = field(default_factory=dict)
+    datacenters: dict[str, Datacenters | None] = field(default_factory=dict)
+
+    def add(self, table: dict[KT, T], key: KT, value: T) -> T:
+        if len(table) >= self.max_size:
+            table.clear()
+
+        table[key] = value
+        return value
+
+    def parse_disks(self, hdd_arr: list[str]) -> ParsedDisks:
+        key = tuple(hdd_arr)
+        if (it := self.disks.get(key)) is not None:
+            return it
+
+        parsed = create_disk_dict_from_hdd_arr(hdd_arr)
+        disks = DiskTypeDict(hdd=parsed["hdd"], enterprise_hdd=parsed["enterprise_hdd"], ssd=parsed["ssd"], enterprise_ssd=parsed["enterprise_ssd"])
+        return self.add(self.disks, key, ParsedDisks(disks, DiskSummary.from_disks(disks)))
+
+    def cpu_name(self, name: str) -> str:
+        return self.cpu_names.get(name) or self.add(self.cpu_names, name, name)
+
+    def cores_of_cpu(self, name: str) -> int | None:
+        if name in self.cpu_cores:
+            return self.cpu_cores[name]
+
+        cores = next((cores for pattern, cores in cpu_cores_by_model if pattern.search(name)), None)
+        return self.add(self.cpu_cores, name, cores)
+
+    def datacenter(self, code: str | None) -> Datacenters | None:
+        if code is None:
+            return None
+        if code in self.datacenters:
+            return self.datacenters[code]
+
+        return self.add(self.datacenters, code, Datacenters.from_data(code))
+
+    def clear(self) -> None:
+        self.disks.clear()
+        self.cpu_names.clear()
+        self.cpu_cores.clear()
+        self.datacenters.clear()
+
+
+parse_tables = ParseTables()
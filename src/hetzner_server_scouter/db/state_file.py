@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Iterator, cast
+
+from sqlalchemy.engine import make_url
+
+from hetzner_server_scouter.settings import database_url
+
+# magic, version, number of records, size and mtime of the database file the records belong to
+state_header = struct.Struct("<4sIQQQ")
+state_record = struct.Struct("<Qd")  # server id, price
+state_magic, state_version = b"HSST", 1
+
+
+def database_token() -> tuple[int, int] | None:
+    """The size and modification time of the SQLite file. Any commit changes it, so a state file with another token is stale."""
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite" or not url.database or not os.path.exists(url.database):
+        return None
+
+    stat = os.stat(url.database)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@dataclass
+class ServerPrices:
+    """The records of a state file, sorted by the server id. They are read straight from the memory map, nothing is parsed up front."""
+    buffer: memoryview
+
+    def __len__(self) -> int:
+        return len(self.buffer) // state_record.size
+
+    def __iter__(self) -> Iterator[tuple[int, float]]:
+        return cast(Iterator[tuple[int, float]], state_record.iter_unpack(self.buffer))
+
+    def id_at(self, i: int) -> int:
+        return int(state_record.unpack_from(self.buffer, i * state_record.size)[0])
+
+    def get(self, server_id: int) -> float | None:
+        """Looks up the price by a binary search over the records"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.id_at(mid) < server_id:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < len(self) and self.id_at(lo) == server_id:
+            return float(state_record.unpack_from(self.buffer, lo * state_record.size)[1])
+
+        return None
+
+
+def find_changed_ids(existing: Iterable[tuple[int, float]], new: Iterable[tuple[int, float]]) -> list[int]:
+    """
+    The ids of the existing servers whose price has changed or that are gone, found in a single merge pass. Both have to be sorted by the id.
+    New servers are not returned, as there is nothing to load for them.
+    """
+    changed = []
+    new_it = iter(new)
+    new_id, new_price = next(new_it, (None, None))
+
+    for server_id, price in existing:
+        while new_id is not None and new_id < server_id:
+            new_id, new_price = next(new_it, (None, None))
+
+        if new_id != server_id or new_price != price:
+            changed.append(server_id)
+
+    return changed
+
+
+@dataclass
+class ServerStateFile:
+    """
+    The ids and prices of the stored servers as a compact, memory-mapped array of fixed-size records. If nothing (or not much) has changed,
+    the diff only has to load the rows of the changed servers from the database instead of all of them.
+
+    The file is only valid for the exact state of the database it was written after. For other databases than SQLite, that can't be checked, so it is never used.
+    """
+    path: Path
+    pending: list[tuple[int, float]] | None = field(default=None, repr=False)
+
+    def read(self) -> ServerPrices | None:
+        """The records, or `None` if the file is missing or stale"""
+        if (token := database_token()) is None:
+            return None
+
+        try:
+            with self.path.open("rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if len(buffer) < state_header.size:
+            return None
+
+        magic, version, num, db_size, db_mtime = state_header.unpack_from(buffer)
+        if magic != state_magic or version != state_version or (db_size, db_mtime) != token or len(buffer) != state_header.size + num * state_record.size:
+            return None
+
+        return ServerPrices(memoryview(buffer)[state_header.size:])
+
+    def write(self, records: Iterable[tuple[int, float]]) -> None:
+        """Writes the records with the current token of the database, so this has to be called after the last commit"""
+        if (token := database_token()) is None:
+            return
+
+        records = sorted(records)
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+
+        with tmp_path.open("wb") as f:
+            f.write(state_header.pack(state_magic, state_version, len(records), *token))
+            f.write(b"".join(state_record.pack(*it) for it in records))
+
+        os.replace(tmp_path, self.path)
+
+    def commit(self) -> None:
+        """Writes the records the diff has left in `pending`"""
+        if self.pending is not None:
+            self.write(self.pending)
+            self.pending = None
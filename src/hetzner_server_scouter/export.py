@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import csv
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TextIO
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session as DatabaseSession
+
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.notifications.models import ServerChangeLog
+from hetzner_server_scouter.settings import export_chunk_size
+from hetzner_server_scouter.utils import datetime_nullable_fromisoformat
+
+export_formats = ["csv", "jsonl", "parquet"]
+
+# The flattened columns of a server and their types. The disks are lists of the sizes (in GB) of every disk of that type.
+server_columns = {
+    "id": "int", "price": "float", "time_of_next_price_reduce": "datetime", "datacenter": "str", "cpu_name": "str", "cpu_cores": "int",
+    "ram_size": "int", "ram_num": "int", "ram_is_ecc": "bool",
+    "disks_hdd": "ints", "disks_enterprise_hdd": "ints", "disks_ssd": "ints", "disks_enterprise_ssd": "ints",
+    "has_ipv4": "bool", "has_gpu": "bool", "has_inic": "bool", "has_hwr": "bool", "last_message_id": "int",
+}
+
+export_columns = {
+    "servers": server_columns | {"total_price": "float"},
+    "changes": {"log_id": "int", "time": "datetime", "kind": "str"} | server_columns,
+}
+
+Chunks = Iterable[list[dict[str, Any]]]
+
+
+class ExportError(Exception):
+    pass
+
+
+def flatten_attrs(attrs: dict[str, Any]) -> dict[str, Any]:
+    """Flattens a server as returned by `Server.to_dict` (and stored in the attrs of a change). Attributes that older logs don't have are `None`."""
+    disks, specials = attrs.get("disks") or {}, attrs.get("specials") or {}
+
+    return {
+        "id": attrs.get("id"), "price": attrs.get("price"), "time_of_next_price_reduce": datetime_nullable_fromisoformat(attrs.get("time_of_next_price_reduce")),
+        "datacenter": attrs.get("datacenter"), "cpu_name": attrs.get("cpu_name"), "cpu_cores": attrs.get("cpu_cores"),
+        "ram_size": attrs.get("ram_size"), "ram_num": attrs.get("ram_num"), "ram_is_ecc": attrs.get("ram_is_ecc"),
+        **{f"disks_{kind}": list(disks.get(kind, [])) for kind in ["hdd", "enterprise_hdd", "ssd", "enterprise_ssd"]},
+        "has_ipv4": specials.get("has_IPv4"), "has_gpu": specials.get("has_GPU"), "has_inic": specials.get("has_iNIC"), "has_hwr": specials.get("has_HWR"),
+        "last_message_id": attrs.get("last_message_id"),
+    }
+
+
+def read_server_chunks(db: DatabaseSession) -> Iterator[list[dict[str, Any]]]:
+    """
+    The flattened servers in chunks. They are streamed from the database, and as the session only keeps weak references to the loaded objects,
+    every chunk is freed once it is flattened. So the memory stays constant.
+    """
+    result = db.execute(select(Server).order_by(Server.id).execution_options(yield_per=export_chunk_size))
+
+    for chunk in result.scalars().partitions():
+        yield [flatten_attrs(it.to_dict()) | {"total_price": it.total_price} for it in chunk]
+
+
+def read_change_chunks(db: DatabaseSession, since_id: int | None = None, since: datetime | None = None) -> Iterator[list[dict[str, Any]]]:
+    """The flattened change logs in chunks, optionally only the ones after the log `since_id` and from the time `since` on"""
+    query = select(ServerChangeLog).order_by(ServerChangeLog.id).execution_options(yield_per=export_chunk_size)
+    if since_id is not None:
+        query = query.where(ServerChangeLog.id > since_id)
+    if since is not None:
+        query = query.where(ServerChangeLog.time >= since)
+
+    for chunk in db.execute(query).scalars().partitions():
+        yield [{"log_id": it.id, "time": it.time, "kind": it.change.kind.name} | flatten_attrs(it.change.attrs) for it in chunk]
+
+
+def format_value(value: Any) -> Any:
+    """The value as it is written to CSV and JSON lines"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    return value
+
+
+def write_csv(f: TextIO, columns: list[str], chunks: Chunks) -> None:
+    writer = csv.DictWriter(f, columns)
+    writer.writeheader()
+
+    for chunk in chunks:
+        writer.writerows({k: " ".join(map(str, v)) if isinstance(v, list) else format_value(v) for k, v in row.items()} for row in chunk)
+
+
+def write_jsonl(f: TextIO, columns: list[str], chunks: Chunks) -> None:
+    for chunk in chunks:
+        f.writelines(json.dumps({k: format_value(row[k]) for k in columns}) + "\n" for row in chunk)
+
+
+text_writers = {"csv": write_csv, "jsonl": write_jsonl}
+
+
+def write_parquet(file: Path, columns: dict[str, str], chunks: Chunks) -> None:
+    """Every chunk is written as its own row group. This needs pyarrow, which is an optional dependency."""
+    try:
+        import pyarrow  # type: ignore
+        import pyarrow.parquet  # type: ignore
+    except ImportError:
+        raise ExportError("The Parquet export needs pyarrow, install it with `pip install pyarrow`")
+
+    types = {"int": pyarrow.int64(), "float": pyarrow.float64(), "str": pyarrow.string(), "bool": pyarrow.bool_(), "datetime": pyarrow.timestamp("us"), "ints": pyarrow.list_(pyarrow.int64())}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in columns.items()])
+
+    with pyarrow.parquet.ParquetWriter(file, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pyarrow.Table.from_pylist(chunk, schema))
+
+
+def export(db: DatabaseSession, table: str, file: Path | None, fmt: str, since_id: int | None = None, since: datetime | None = None) -> tuple[int, int | None]:
+    """
+    Streams the `servers` or the `changes` into the file, which is replaced atomically once the export is complete. Without a file, it is written to stdout.
+    Returns the number of exported rows and, for the changes, the id of the last exported log, from which the next export can continue.
+    """
+    if fmt not in export_formats:
+        raise ExportError(f"Unknown format {fmt!r}, expected one of {', '.join(export_formats)}")
+    if fmt == "parquet" and file is None:
+        raise ExportError("Parquet can only be exported to a file")
+
+    num_rows, last_id = 0, since_id
+    chunks = read_server_chunks(db) if table == "servers" else read_change_chunks(db, since_id, since)
+
+    def counted(chunks: Chunks) -> Chunks:
+        nonlocal num_rows, last_id
+        for chunk in chunks:
+            num_rows += len(chunk)
+            last_id = chunk[-1].get("log_id", last_id)
+            yield chunk
+
+    columns = export_columns[table]
+    if file is None:
+        text_writers[fmt](sys.stdout, list(columns), counted(chunks))
+        return num_rows, last_id
+
+    tmp_file = file.with_name(f".{file.name}.tmp")
+    if fmt == "parquet":
+        write_parquet(tmp_file, columns, counted(chunks))
+    else:
+        with tmp_file.open("w", newline="") as f:
+            text_writers[fmt](f, list(columns), counted(chunks))
+
+    os.replace(tmp_file, file)
+    return num_rows, last_id
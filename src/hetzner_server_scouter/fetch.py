@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from time import perf_counter, time
+from typing import Any, cast
+
+import requests
+
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.settings import (
+    hetzner_api_feeds, hetzner_ipv4_price_url, hetzner_api_get_headers, hetzner_api_timeout_s, hetzner_api_retry_count, hetzner_api_retry_backoff_s,
+    hetzner_api_hedge_quantile, hetzner_api_hedge_min_samples, hetzner_api_latency_history, hetzner_api_breaker_threshold, hetzner_api_breaker_open_s,
+    hetzner_api_state_file_name, warning_text
+)
+from hetzner_server_scouter.utils import hetzner_prices, path
+
+ipv4_price_regex = re.compile(r"Primäre IPv4[\w</>\s]*(\d,\d\d)\s*€ pro Monat")
+
+
+class FetchError(Exception):
+    pass
+
+
+@dataclass
+class SourceState:
+    """The circuit breaker and the recent latencies of a single source"""
+    failures: int = 0
+    open_until: float = 0
+    latencies: list[float] = field(default_factory=list)
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def is_half_open(self) -> bool:
+        """The breaker has been open before, so only a single request is tried"""
+        return self.failures >= hetzner_api_breaker_threshold
+
+    def hedge_delay(self) -> float | None:
+        if hetzner_api_hedge_quantile is None or len(self.latencies) < hetzner_api_hedge_min_samples:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(int(hetzner_api_hedge_quantile * len(latencies)), len(latencies) - 1)]
+
+    def record_success(self, latency: float) -> None:
+        self.failures, self.open_until = 0, 0
+        self.latencies = (self.latencies + [round(latency, 4)])[-hetzner_api_latency_history:]
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        if self.failures >= hetzner_api_breaker_threshold:
+            self.open_until = now + hetzner_api_breaker_open_s
+
+
+@dataclass
+class FetchState:
+    """
+    The state of all sources. It is persisted between runs, so a run started by a timer still knows about the outage the previous run has seen.
+    The last fetched IPv4 price is kept with it, so it is known to the commands that don't fetch and to runs whose fetch of it fails.
+    """
+    sources: dict[str, SourceState] = field(default_factory=dict)
+    ipv4_price: float | None = None
+
+    def __getitem__(self, name: str) -> SourceState:
+        return self.sources.setdefault(name, SourceState())
+
+    @classmethod
+    def load(cls, file: Path) -> FetchState:
+        try:
+            data = json.loads(file.read_text())
+            return cls({name: SourceState(**it) for name, it in data.get("sources", {}).items()}, data.get("ipv4_price"))
+        except (OSError, ValueError, TypeError, AttributeError):
+            return cls()
+
+    def save(self, file: Path) -> None:
+        os.makedirs(file.parent, exist_ok=True)
+        tmp_file = file.with_name(f".{file.name}.tmp")
+        tmp_file.write_text(json.dumps({"sources": {name: asdict(it) for name, it in self.sources.items()}, "ipv4_price": self.ipv4_price}))
+        os.replace(tmp_file, file)
+
+
+def get(url: str) -> requests.Response:
+    response = requests.get(url, headers=hetzner_api_get_headers, timeout=hetzner_api_timeout_s)
+    if not response.ok:
+        raise FetchError(f"{url} responded with {response.status_code}")
+
+    return response
+
+
+async def get_hedged(url: str, hedge_delay: float | None) -> requests.Response:
+    """
+    A single attempt, limited to `hetzner_api_timeout_s`. If there is no response after `hedge_delay`, a second request is sent and the first response wins.
+    The request that loses can't be cancelled, as it runs in a thread. It ends on its own at the latest after the timeout of `requests`.
+    """
+    requests_ = [asyncio.ensure_future(asyncio.to_thread(get, url))]
+    deadline = perf_counter() + hetzner_api_timeout_s
+
+    try:
+        if hedge_delay is not None and hedge_delay < hetzner_api_timeout_s:
+            done, _ = await asyncio.wait(requests_, timeout=hedge_delay)
+            if not done:
+                metrics.count("fetch_hedged")
+                requests_.append(asyncio.ensure_future(asyncio.to_thread(get, url)))
+
+        pending = set(requests_)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(deadline - perf_counter(), 0), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise FetchError(f"{url} did not respond within {hetzner_api_timeout_s}s")
+
+            for it in done:
+                if it.exception() is None:
+                    return it.result()
+
+        # All requests failed, raise the error of the first one
+        return requests_[0].result()
+
+    finally:
+        for it in requests_:
+            it.cancel()
+
+
+async def fetch(name: str, url: str, state: FetchState | None = None) -> requests.Response | None:
+    """
+    Fetches a single source with a deadline per attempt, hedging and retries. The time is recorded as the span `fetch_<name>`.
+    If the circuit breaker of the source is open, nothing is fetched at all.
+    """
+    state = state or FetchState()
+    source, now = state[name], time()
+    if source.is_open(now):
+        print(f"{warning_text} Skipping {name}: It has failed {source.failures} times in a row, the next try is in {source.open_until - now:.0f}s")
+        metrics.count("fetch_skipped")
+        return None
+
+    with metrics.span(f"fetch_{name}"):
+        for attempt in range(1 if source.is_half_open() else hetzner_api_retry_count):
+            if attempt:
+                metrics.count("fetch_retries")
+                await asyncio.sleep(hetzner_api_retry_backoff_s * 2 ** (attempt - 1))
+
+            s = perf_counter()
+            try:
+                response = await get_hedged(url, source.hedge_delay())
+            except Exception as ex:
+                print(f"Error fetching {name}: {ex}")
+                continue
+
+            source.record_success(perf_counter() - s)
+            return response
+
+    source.record_failure(time())
+    return None
+
+
+def parse_ipv4_price(text: str) -> float | None:
+    it = ipv4_price_regex.search(text)
+    if it is None:
+        return None
+
+    try:
+        return float(it.group(1).replace(",", "."))
+    except Exception:
+        return None
+
+
+async def fetch_ipv4_price(state: FetchState | None = None) -> float | None:
+    response = await fetch("ipv4_price", hetzner_ipv4_price_url, state)
+    return parse_ipv4_price(response.text) if response is not None else None
+
+
+def load_hetzner_prices(state_file: Path | None = None) -> None:
+    """Sets the prices that were fetched last, possibly by a previous run. Every command needs them, e.g. `hscout top` for the price of the IPv4 addresses."""
+    if (it := FetchState.load(state_file or path(hetzner_api_state_file_name)).ipv4_price) is not None:
+        hetzner_prices.ipv4 = it
+
+
+def merge_feeds(feeds: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """
+    Merges the feeds of the different currencies by the server id. The first feed is the base, its servers get the prices of all feeds as `prices`, keyed by the currency.
+    Servers that are missing in the base feed are dropped, as their price in the base currency is unknown.
+    """
+    (base_currency, base), *others = feeds.items()
+    if not others:
+        return base
+
+    servers = {it["id"]: it | {"prices": {base_currency: it["price"]}} for it in base["server"]}
+    for currency, feed in others:
+        for it in feed["server"]:
+            if (server := servers.get(it["id"])) is not None:
+                server["prices"][currency] = it["price"]
+            else:
+                metrics.count("feed_servers_dropped")
+
+    return base | {"server": list(servers.values())}
+
+
+async def fetch_auction(state_file: Path | None = None) -> dict[str, Any] | None:
+    """
+    Fetches all feeds and the IPv4 price concurrently, so the download takes as long as the slowest source instead of the sum of all.
+    The IPv4 price is stored in `hetzner_prices` and the state file, and recorded in the returned data. If it can't be fetched, the last known one is used.
+    Returns `None` if the base feed could not be fetched.
+    """
+    state_file = state_file or path(hetzner_api_state_file_name)
+    state = FetchState.load(state_file)
+
+    try:
+        with metrics.span("fetch"):
+            *responses, ipv4_price = await asyncio.gather(*(fetch(f"feed_{currency}", url, state) for currency, url in hetzner_api_feeds.items()), fetch_ipv4_price(state))
+
+        if ipv4_price is not None:
+            state.ipv4_price = ipv4_price
+
+    finally:
+        state.save(state_file)
+
+    if state.ipv4_price is not None:
+        hetzner_prices.ipv4 = state.ipv4_price
+
+    for currency, it in zip(hetzner_api_feeds, responses):
+        if it is None:
+            print(f"{warning_text} Could not fetch the {currency} feed")
+            metrics.count("feed_failures")
+
+    if responses[0] is None:
+        return None
+
+    with metrics.span("decode"):
+        feeds = {currency: cast(dict[str, Any], it.json()) for currency, it in zip(hetzner_api_feeds, responses) if it is not None}
+
+    data = merge_feeds(feeds)
+    if hetzner_prices.ipv4 is not None:
+        data["ipv4_price"] = hetzner_prices.ipv4
+
+    return data
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import json
+import os
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import Iterator
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    total: float = 0
+    max: float = 0
+
+
+@dataclass
+class Histogram:
+    """A Prometheus histogram. Unlike the spans, it is cumulative over the lifetime of the process."""
+    buckets: tuple[float, ...]
+    counts: list[int] = field(default_factory=list)
+    sum: float = 0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = self.counts or [0] * len(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def to_prometheus(self, name: str, help_text: str) -> list[str]:
+        lines, cumulative = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"], 0
+        for bound, num in zip(self.buckets, self.counts):
+            cumulative += num
+            lines.append(f'{name}_bucket{{le="{bound:g}"}} {cumulative}')
+
+        return lines + [f'{name}_bucket{{le="+Inf"}} {self.count}', f"{name}_sum {self.sum:.6g}", f"{name}_count {self.count}"]
+
+
+@dataclass
+class Span:
+    name: str
+    start: float = field(default_factory=perf_counter)
+    took: float = 0
+
+
+@dataclass
+class Metrics:
+    """
+    Timings and counters of a run. A span is entered once per phase (e.g. `fetch`) or once per item (e.g. `commit` for every batch of changes), so the stats are accumulated per name.
+    Spans measure the wall time, so a span around a coroutine includes the time it waits.
+
+    This module is imported nearly everywhere, so it must not depend on anything else of the package.
+    """
+    spans: defaultdict[str, SpanStats] = field(default_factory=lambda: defaultdict(SpanStats))
+    counters: Counter[str] = field(default_factory=Counter)
+    gauges: dict[str, float] = field(default_factory=dict)
+
+    # Every span whose name is in here is also observed in the histogram. They are kept on `reset`.
+    histograms: dict[str, Histogram] = field(default_factory=dict)
+
+    # Spans are also recorded on the database thread
+    lock: Lock = field(default_factory=Lock, repr=False)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[Span]:
+        it = Span(name)
+        try:
+            yield it
+        finally:
+            it.took = perf_counter() - it.start
+            self.record(name, it.took)
+
+    def record(self, name: str, took: float) -> None:
+        with self.lock:
+            stats = self.spans[name]
+            stats.count += 1
+            stats.total += took
+            stats.max = max(stats.max, took)
+
+            if (histogram := self.histograms.get(name)) is not None:
+                histogram.observe(took)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge_max(self, name: str, value: float) -> None:
+        """Sets the gauge to the highest value seen during the run"""
+        with self.lock:
+            self.gauges[name] = max(self.gauges.get(name, value), value)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def to_prometheus(self, time: datetime) -> str:
+        lines = [
+            "# HELP hscout_last_run_timestamp_seconds The time the last run has finished", "# TYPE hscout_last_run_timestamp_seconds gauge",
+            f"hscout_last_run_timestamp_seconds {time.timestamp():.0f}",
+        ]
+
+        for metric, help_text, attr in [
+            ("hscout_span_seconds", "The total time spent in each phase of the last run", "total"),
+            ("hscout_span_count", "How often each phase was entered during the last run", "count"),
+            ("hscout_span_max_seconds", "The longest single time spent in each phase during the last run", "max"),
+        ]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            lines += [f'{metric}{{span="{name}"}} {getattr(stats, attr):.6g}' for name, stats in sorted(self.spans.items())]
+
+        for name, value in sorted((self.counters | self.gauges).items()):
+            lines += [f"# TYPE hscout_{name} gauge", f"hscout_{name} {value:.10g}"]
+
+        return "\n".join(lines) + "\n"
+
+    def to_json(self, time: datetime) -> str:
+        spans = {name: {"count": it.count, "total": round(it.total, 6), "max": round(it.max, 6)} for name, it in sorted(self.spans.items())}
+        return json.dumps({"time": time.isoformat(timespec="seconds"), "spans": spans, "counters": dict(sorted((self.counters | self.gauges).items()))})
+
+    def export(self, path: Path, time: datetime | None = None) -> None:
+        """
+        Writes the metrics of the run. A `.prom` file is written in the Prometheus textfile format, e.g. for the textfile collector of the node exporter.
+        Every other file gets one JSON line appended per run.
+        """
+        time = time or datetime.now()
+        os.makedirs(path.parent, exist_ok=True)
+
+        if path.suffix != ".prom":
+            with path.open("a") as f:
+                f.write(self.to_json(time) + "\n")
+
+            return
+
+        # The collector may read the file at any time, so it is replaced atomically
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(self.to_prometheus(time))
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -1,22 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Callable, Coroutine, Any, TYPE_CHECKING
+
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session as DatabaseSession
 
-from hetzner_server_scouter.db.db_utils import add_objects_to_database
-from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog
+from hetzner_server_scouter.db.crud import apply_server_changes
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.db.db_utils import database_transaction, run_in_database_thread
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType, ServerChangeLog, ServerChangeLogRecord, server_change_logs_bulk_table
 from hetzner_server_scouter.notifications.notify_telegram import telegram_notify_about_changes
+from hetzner_server_scouter.settings import pipeline_log_batch_size, pipeline_send_queue_size
+from hetzner_server_scouter.utils import queue_get_batch, run_concurrently, clock, debug_time, program_args, filter_server_with_program_args, UrgentFirstQueue
+
+if TYPE_CHECKING:
+    from hetzner_server_scouter.rankings import Rankings
+
+console_separator = f"\n\n\n{'─' * 20}\n\n\n"
+
+# The last stage of the pipeline, it has to consume the queue until `None` is received
+DeliveryStage = Callable[[DatabaseSession, asyncio.Queue[ServerChangeLogRecord | None]], Coroutine[Any, Any, None]]
+
+
+def insert_change_logs(db: DatabaseSession, changes: list[ServerChange]) -> list[ServerChangeLogRecord]:
+    """
+    Inserts the logs with one executemany `INSERT … RETURNING` instead of going through the ORM. This does not commit.
+    The changes of a single run all have different server ids, so the ids are matched via the server id. This keeps SQLAlchemy from falling back to one INSERT per row to guarantee the order.
+    """
+    if not changes:
+        return []
+
+    now = clock.now()
+    rows = [{
+        "server_id": change.server_id, "time": now, "kind": change.kind, "change_server_id": change.server_id,
+        "last_message_id": change.last_message_id, "attrs": json.dumps(change.attrs)
+    } for change in changes]
+
+    ids = dict(db.execute(insert(server_change_logs_bulk_table).returning(server_change_logs_bulk_table.c.change_server_id, server_change_logs_bulk_table.c.id), rows).tuples().all())
+    return [ServerChangeLogRecord(ids[change.server_id], change.server_id, now, change) for change in changes]
+
+
+def create_logs_from_changes(db: DatabaseSession, changes: list[ServerChange]) -> list[ServerChangeLogRecord]:
+    records: list[ServerChangeLogRecord] = []
+    database_transaction(db, lambda: records.extend(insert_change_logs(db, changes)))
+    return records
+
+
+def changes_to_notify(changes: list[ServerChange]) -> list[ServerChange]:
+    """
+    With `--store-all` the changes of every server are stored, but only the ones of the servers that match the filters are logged and notified.
+    A price change that moves a server into (or out of) the filters is notified as new (or sold), just as it would be without `--store-all`.
+    The changes of watched servers are always notified as they are.
+    """
+    if not program_args.store_all:
+        return changes
+
+    def matches(attrs: dict[str, Any]) -> bool:
+        return filter_server_with_program_args(Server.from_dict(attrs)) is not None
+
+    notified = []
+    for change in changes:
+        if change.is_watched:
+            notified.append(change)
+            continue
+
+        if change.kind != ServerChangeType.price_changed:
+            if matches(change.attrs):
+                notified.append(change)
+            continue
+
+        is_match, was_match = matches(change.attrs), matches(change.attrs | {"price": change.old_price})
+        if is_match and was_match:
+            notified.append(change)
+        elif is_match:
+            notified.append(ServerChange(ServerChangeType.new, change.server_id, change.last_message_id, change.attrs))
+        elif was_match:
+            notified.append(ServerChange(ServerChangeType.sold, change.server_id, change.last_message_id, change.attrs))
+
+    return notified
+
+
+@debug_time("commit")
+def persist_changes(db: DatabaseSession, changes: list[ServerChange]) -> list[ServerChangeLogRecord]:
+    """Applies the changes to the servers and logs the ones to notify about in a single transaction."""
+    records: list[ServerChangeLogRecord] = []
+
+    def modify() -> None:
+        apply_server_changes(db, changes)
+        records.extend(insert_change_logs(db, changes_to_notify(changes)))
+
+    database_transaction(db, modify)
+    return records
+
+
+def read_change_logs(db: DatabaseSession, after_id: int, limit: int, known_logs: list[ServerChangeLogRecord] | None = None) -> list[ServerChangeLogRecord]:
+    """
+    The latest logs after the log `after_id`, but at most `limit`, ordered from old to new.
+    The `known_logs` are the latest logs that are still in memory, e.g. the ones of this run. They are returned as they are, so their messages aren't built again, and only the older logs are read.
+    """
+    known_logs = [it for it in known_logs or [] if it.id > after_id][-limit:]
+    query = select(ServerChangeLog).where(ServerChangeLog.id > after_id)
+    if known_logs:
+        query = query.where(ServerChangeLog.id < known_logs[0].id)
+
+    logs = db.execute(query.order_by(ServerChangeLog.id.desc()).limit(limit - len(known_logs))).scalars().all() if len(known_logs) < limit else []
+    return [it.to_record() for it in reversed(logs)] + known_logs
+
+
+def console_notify_about_changes(change_logs: list[ServerChangeLogRecord]) -> None:
+    with metrics.span("render"):
+        text = console_separator.join(log.change.to_console_str() or f"Error producing the message for server {log.server_id}!" for log in change_logs)
+
+    print(text)
+
+
+async def log_changes(
+    db: DatabaseSession, changes: asyncio.Queue[ServerChange | None], logs: asyncio.Queue[ServerChangeLogRecord | None], print_changes: bool = True, rankings: Rankings | None = None,
+    logged: list[ServerChangeLogRecord] | None = None,
+) -> None:
+    """
+    The logging stage of the pipeline: Persists the changes in small batches and forwards them to the notifiers. Every logged change also updates the `rankings`.
+    The new logs are collected in `logged` (ordered from old to new), so later consumers of this run can reuse them with their already built messages.
+    The changes of watched servers are persisted and forwarded on their own before the rest of their batch, so they don't wait for it.
+    """
+    is_first_batch, is_done = True, False
+    pending: list[ServerChange] = []
+
+    while not is_done or pending:
+        if pending:
+            batch, pending = pending, []
+        else:
+            batch, is_done = await queue_get_batch(changes, pipeline_log_batch_size)
+
+        if any(it.is_watched for it in batch) and not all(it.is_watched for it in batch):
+            pending = [it for it in batch if not it.is_watched]
+            batch = [it for it in batch if it.is_watched]
+
+        if not batch:
+            continue
+
+        new_logs = await run_in_database_thread(lambda: persist_changes(db, batch))
+        if rankings is not None:
+            # Like the notifications, the rankings only follow the servers that match the filters, even with `--store-all`
+            with metrics.span("rankings"):
+                rankings.apply(log.change for log in new_logs)
+
+        for log in new_logs:
+            metrics.count(f"changes_{log.change.kind.name}")
+
+        if logged is not None:
+            logged.extend(new_logs)
+
+        if print_changes:
+            if not is_first_batch:
+                print(console_separator, end="")
 
+            console_notify_about_changes(new_logs)
+            is_first_batch = False
 
-def create_logs_from_changes(db: DatabaseSession, changes: list[ServerChange]) -> list[ServerChangeLog] | None:
-    return add_objects_to_database(db, [ServerChangeLog(server_id=change.server_id, change=change) for change in changes])
+        for log in new_logs:
+            await logs.put(log)
+            metrics.gauge_max("outbox_max_depth", logs.qsize())
 
+    await logs.put(None)
 
-def console_notify_about_changes(change_logs: list[ServerChangeLog]) -> None:
-    print(f"\n\n\n{'─' * 20}\n\n\n".join(log.change.to_console_str() or f"Error producing the message for server {log.server_id}!" for log in change_logs))
 
+async def discard_changes(db: DatabaseSession, logs: asyncio.Queue[ServerChangeLogRecord | None]) -> None:
+    """A delivery stage that doesn't notify at all"""
+    while await logs.get() is not None:
+        pass
 
-async def process_changes(db: DatabaseSession, changes: list[ServerChange]) -> None:
-    logs = create_logs_from_changes(db, changes)
-    if logs is None:
-        return
 
-    console_notify_about_changes(logs)
-    await telegram_notify_about_changes(db, logs)
+async def process_changes(
+    db: DatabaseSession, changes: asyncio.Queue[ServerChange | None], deliver: DeliveryStage = telegram_notify_about_changes, print_changes: bool = True, rankings: Rankings | None = None,
+    logged: list[ServerChangeLogRecord] | None = None,
+) -> None:
+    # The changes of watched servers jump ahead of all others that wait to be sent
+    logs: asyncio.Queue[ServerChangeLogRecord | None] = UrgentFirstQueue(lambda it: it is not None and it.change.is_watched, maxsize=pipeline_send_queue_size)
+    await run_concurrently(log_changes(db, changes, logs, print_changes, rankings, logged), deliver(db, logs))
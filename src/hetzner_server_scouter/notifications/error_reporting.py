@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from dataclasses import dataclass, field
+from time import perf_counter
+from traceback import format_exception, extract_tb
+from typing import Callable, Awaitable
+
+from hetzner_server_scouter.settings import error_text, telegram_error_report_window_s, telegram_error_report_rate_m
+from hetzner_server_scouter.utils import RateLimiter, print_exception
+
+
+def exception_signature(ex: BaseException) -> str:
+    """
+    The signature of an exception is made up of its type and the frames of its traceback, but *not* of its message.
+    This way e.g. "Flood control exceeded. Retry in 12 seconds" and "… in 13 seconds" are counted as the same error.
+    """
+    frames = "|".join(f"{frame.filename}:{frame.name}:{frame.lineno}" for frame in extract_tb(ex.__traceback__))
+    return hashlib.sha1(f"{type(ex).__qualname__}|{frames}".encode()).hexdigest()[:12]
+
+
+@dataclass
+class ExceptionAggregate:
+    kind: str
+    message: str
+    traceback: str
+
+    count: int = 1
+    first_seen: float = field(default_factory=perf_counter)
+    last_seen: float = field(default_factory=perf_counter)
+
+    def to_str(self) -> str:
+        return f"{self.count}× {self.kind}: {self.message}"
+
+
+@dataclass
+class ErrorReporter:
+    """
+    Collects exceptions and sends them as one summary per `window_s` seconds.
+
+    Reporting an exception never awaits, so it can be called from the main delivery path without slowing it down.
+    The summaries are sent from a background task with its own rate limiter, so a flood of errors can't eat up the budget of the real alerts.
+    """
+    send: Callable[[str], Awaitable[None]]
+    window_s: float = telegram_error_report_window_s
+    limiter: RateLimiter = field(default_factory=lambda: RateLimiter(rate_s=1, rate_m=telegram_error_report_rate_m))
+
+    pending: dict[str, ExceptionAggregate] = field(default_factory=dict)
+    _task: asyncio.Task[None] | None = None
+    _flushing: asyncio.Task[None] | None = None
+
+    def report(self, ex: BaseException) -> None:
+        signature = exception_signature(ex)
+
+        if (it := self.pending.get(signature)) is not None:
+            it.count += 1
+            it.message = str(ex)
+            it.last_seen = perf_counter()
+        else:
+            self.pending[signature] = ExceptionAggregate(type(ex).__qualname__, str(ex), "".join(format_exception(ex)))
+
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def summary(self) -> str | None:
+        if not self.pending:
+            return None
+
+        aggregates = sorted(self.pending.values(), key=lambda it: it.count, reverse=True)
+        header = f"{sum(it.count for it in aggregates)} unexpected error(s) of {len(aggregates)} kind(s) have occured:\n"
+        lines = "\n".join(it.to_str() for it in aggregates)
+
+        # The messages are sent as markdown, and the error messages often contain `_` or `*`, so everything is put into the code block.
+        # Only the traceback of the most frequent error is included as the message is limited to 4096 characters. It is cut before it is wrapped, so the block stays closed.
+        body = f"{header}{lines}\n\n{aggregates[0].traceback}"
+        return f"```\n{body[:4096 - 7]}```"
+
+    async def flush(self) -> None:
+        text = self.summary()
+        self.pending = {}
+        if text is None:
+            return
+
+        await self.limiter.wait()
+        try:
+            await self.send(text)
+        except Exception as ex:
+            print(f"{error_text} Sending the error summary failed!", flush=True)
+            print_exception(ex)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # A summary that is being sent right now has already left `pending`, so it is finished instead of cancelled
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.window_s)
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+            await asyncio.shield(self._flushing)
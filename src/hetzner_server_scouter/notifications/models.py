@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import json
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Any
+from typing import Any, Callable
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Table, MetaData, Column, UnicodeText, Enum as SqlEnum, Integer
 from sqlalchemy.orm import mapped_column, Mapped, composite, relationship
 from sqlalchemy_utils import JSONType
 
@@ -26,6 +27,7 @@ class ServerChangeType(Enum):
 class ServerChangeMessage:
     """
     This class exists to make formatting the messages easier as e.g. telegram expects HTML.
+    It is built once per change, and every format is rendered at most once, see `render`.
     """
     server_id: int
     was_sold: bool
@@ -38,6 +40,15 @@ class ServerChangeMessage:
     specials: str
     location: Datacenters | None
 
+    rendered: dict[str, str] = field(default_factory=dict, repr=False, compare=False)
+
+    def render(self, formatter: str) -> str:
+        """The message in the format of the `formatter` (see `message_formatters`). It is cached, so every consumer and every retry shares it."""
+        if (it := self.rendered.get(formatter)) is None:
+            it = self.rendered[formatter] = message_formatters[formatter](self)
+
+        return it
+
     def to_console(self) -> str:
         if self.was_sold:
             return f"""{self.header[0]} {self.url} {self.header[1]} for {self.price:.2f}€!"""
@@ -62,6 +73,43 @@ Location: {self.location}"""
 {f'{lf}<u><b>Specials</b></u>{lf}{self.specials}{lf}' if self.specials else ''}
 <b>Location:</b> {self.location}"""
 
+    def to_markdown(self) -> str:
+        if self.was_sold:
+            return f"""{self.header[0]} [{self.server_id}]({self.url}) {self.header[1]} for {self.price:.2f}€!"""
+
+        return f"""{self.header[0]} [{self.server_id}]({self.url}) {self.header[1]}
+**Price**: {self.price:.2f}€  {f'({self.price_decreases_in})' if self.price_decreases_in else ''}
+
+**Specs**
+{lf.join(f'- {it}' for it in self.specs.splitlines())}
+{f'{lf}**Specials**{lf}{lf.join(f"- {it}" for it in self.specials.splitlines())}{lf}' if self.specials else ''}
+**Location:** {self.location}"""
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "server_id": self.server_id, "was_sold": self.was_sold, "title": " ".join([self.header[0], str(self.server_id), self.header[1]]), "url": self.url,
+            "price": round(self.price, 2), "price_decreases_in": self.price_decreases_in or None, "specs": self.specs.splitlines(), "specials": self.specials.splitlines(),
+            "location": str(self.location) if self.location is not None else None,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def to_webhook(self) -> str:
+        """The payload for a chat webhook (Slack, Mattermost, …): The Markdown as `text`, and the message as structured data"""
+        return json.dumps({"text": self.render("markdown"), "server": self.to_dict()}, ensure_ascii=False)
+
+
+# The formats a `ServerChangeMessage` can be rendered in. Add a channel with `register_formatter`.
+message_formatters: dict[str, Callable[[ServerChangeMessage], str]] = {
+    "console": ServerChangeMessage.to_console, "telegram": ServerChangeMessage.to_telegram, "markdown": ServerChangeMessage.to_markdown,
+    "json": ServerChangeMessage.to_json, "webhook": ServerChangeMessage.to_webhook,
+}
+
+
+def register_formatter(name: str, formatter: Callable[[ServerChangeMessage], str]) -> None:
+    message_formatters[name] = formatter
+
 
 @dataclass
 class ServerChange:
@@ -71,30 +119,51 @@ class ServerChange:
 
     attrs: dict[str, Any]
 
-    def to_console_str(self) -> str | None:
-        it = self.to_message()
-        if it is None:
-            return it
+    # The price before a `price_changed`. It is not logged, it is only needed to tell if the server matched the filters before.
+    old_price: float | None = None
 
-        return it.to_console()
+    # If the server is on the watchlist, the change is notified regardless of the filters and ahead of all others. It is not logged either.
+    is_watched: bool = False
 
-    def to_telegram_str(self) -> str | None:
+    # The message is built once by `to_message` and shared by every consumer of the change
+    message: ServerChangeMessage | None = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_log(cls, kind: ServerChangeType, server_id: int, last_message_id: int | None, attrs: dict[str, Any]) -> ServerChange:
+        return cls(kind, server_id, last_message_id, attrs)
+
+    def __composite_values__(self) -> tuple[ServerChangeType, int, int | None, dict[str, Any]]:
+        """Only these are logged. The composite is created by `from_log`, as SQLAlchemy would otherwise map every field of the dataclass to a column."""
+        return self.kind, self.server_id, self.last_message_id, self.attrs
+
+    def render(self, formatter: str) -> str | None:
         it = self.to_message()
         if it is None:
             return it
 
-        return it.to_telegram()
+        return it.render(formatter)
+
+    def to_console_str(self) -> str | None:
+        return self.render("console")
+
+    def to_telegram_str(self) -> str | None:
+        return self.render("telegram")
 
     def to_message(self) -> ServerChangeMessage | None:
+        if self.message is None:
+            self.message = self.build_message()
+
+        return self.message
 
-        was_sold = False
+    def build_message(self) -> ServerChangeMessage | None:
+        was_sold, server = False, "watched server" if self.is_watched else "server"
         match self.kind:
             case ServerChangeType.new:
-                header = "A new server", "has appeared."
+                header = f"The {server}" if self.is_watched else "A new server", "has appeared."
             case ServerChangeType.price_changed:
-                header = "The price of the server", "has changed."
+                header = f"The price of the {server}", "has changed."
             case ServerChangeType.sold:
-                header = "The server", "was sold"
+                header = f"The {server}", "was sold"
                 was_sold = True
             case _:
                 return None  # type:ignore[unreachable]
@@ -124,6 +193,17 @@ Disks: {', '.join(filter(lambda it: it, [
         return ServerChangeMessage(self.server_id, was_sold, header, url, price, price_decreases_in, specs, specials, location)
 
 
+@dataclass
+class ServerChangeLogRecord:
+    """
+    A detached snapshot of a `ServerChangeLog`. The notifiers only work on these, so sending a message never has to touch the database.
+    """
+    id: int
+    server_id: int
+    time: datetime
+    change: ServerChange
+
+
 class ServerChangeLog(DataBase):  # type:ignore[valid-type, misc]
     __tablename__ = "server_change_logs"
 
@@ -131,5 +211,18 @@ class ServerChangeLog(DataBase):  # type:ignore[valid-type, misc]
     server_id: Mapped[int] = mapped_column(ForeignKey("servers.id"), nullable=True)
     time: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
 
-    change: Mapped[ServerChange] = composite(mapped_column("kind", nullable=False), mapped_column("change_server_id"), mapped_column("last_message_id"), mapped_column("attrs", JSONType))
+    change: Mapped[ServerChange] = composite(
+        ServerChange.from_log, mapped_column("kind", SqlEnum(ServerChangeType), nullable=False), mapped_column("change_server_id", Integer, nullable=False),
+        mapped_column("last_message_id", Integer, nullable=True), mapped_column("attrs", JSONType, nullable=False)
+    )
     server: Mapped[Server] = relationship(Server)
+
+    def to_record(self) -> ServerChangeLogRecord:
+        return ServerChangeLogRecord(self.id, self.server_id, self.time, self.change)
+
+
+# A copy of the `server_change_logs` table for bulk inserts: The attrs are passed as pre-serialized JSON instead of going through the `JSONType` of the ORM for every row.
+server_change_logs_bulk_table = Table(
+    ServerChangeLog.__tablename__, MetaData(),
+    *(Column(it.name, UnicodeText if it.name == "attrs" else it.type, primary_key=it.primary_key) for it in ServerChangeLog.__table__.columns)
+)
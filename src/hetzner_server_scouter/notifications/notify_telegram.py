@@ -4,67 +4,102 @@ import asyncio
 import os
 import re
 from traceback import format_exception
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, cast
 
 from sqlalchemy.orm import Session as DatabaseSession
-from telegram import Bot
+from telegram import Bot, Message
 
-from hetzner_server_scouter.db.db_utils import database_transaction
+from hetzner_server_scouter.db.crud import write_last_message_ids
+from hetzner_server_scouter.db.db_utils import database_transaction_async
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.notifications.error_reporting import ErrorReporter
+from hetzner_server_scouter.notifications.models import ServerChangeType
 from hetzner_server_scouter.settings import error_text
 from hetzner_server_scouter.utils import RateLimiter, print_exception
 
 if TYPE_CHECKING:
-    from hetzner_server_scouter.notifications.models import ServerChangeLog
+    from hetzner_server_scouter.notifications.models import ServerChangeLogRecord
 
 
-async def telegram_notify_about_changes(db: DatabaseSession, change_logs: list[ServerChangeLog]) -> None:
+async def telegram_notify_about_changes(db: DatabaseSession, change_logs: asyncio.Queue[ServerChangeLogRecord | None], bot: Bot | None = None) -> None:
+    """
+    The delivery stage of the pipeline: Sends every log of the queue until `None` is received.
+    The ids of the sent messages are collected and written back in a single UPDATE at the end.
+    """
     api_token = os.getenv("TELEGRAM_API_TOKEN")
     chat_id = os.getenv("TELEGRAM_CHAT_ID")
 
-    if api_token is None or chat_id is None:
+    if bot is None and api_token is not None:
+        bot = Bot(token=api_token)
+
+    if bot is None or chat_id is None:
+        # The queue still has to be drained, otherwise the previous stages would wait forever
+        while await change_logs.get() is not None:
+            pass
+
         return
 
-    bot = Bot(token=api_token)
     limiter = RateLimiter(rate_s=1, rate_m=20)
+    reporter = ErrorReporter(send_error_text_via_telegram)
+    message_ids: dict[int, int] = {}
 
-    async def send_message(log: ServerChangeLog) -> None:
-        last_message_id = log.server.last_message_id if log.server is not None else log.change.attrs.get("last_message_id")
+    async def send_message(log: ServerChangeLogRecord) -> Message | None:
+        assert bot is not None
+        with metrics.span("render"):
+            text = log.change.to_telegram_str() or f"Error producing the message for server {log.server_id}!"
 
         i = 0
         while i < 20:
             try:
                 await limiter.wait()
-                msg = await bot.send_message(
-                    chat_id=chat_id, text=log.change.to_telegram_str() or f"Error producing the message for server {log.server_id}!",
-                    reply_to_message_id=last_message_id, read_timeout=10, parse_mode="html", disable_web_page_preview=True,
-                )
-                break
+                with metrics.span("telegram_send"):
+                    msg = cast(Message, await bot.send_message(
+                        chat_id=chat_id, text=text,
+                        reply_to_message_id=log.change.last_message_id, read_timeout=10, parse_mode="html", disable_web_page_preview=True,
+                    ))
+
+                metrics.count("telegram_messages_sent")
+                return msg
 
             except Exception as ex:
                 i += 1
+                metrics.count("telegram_retries")
+
+                reporter.report(ex)
 
                 if (it := re.match(r"Flood control exceeded. Retry in (\d+) seconds", str(ex))) is not None:
                     to_sleep = int(it.group(1)) + 1
+                    metrics.count("telegram_flood_waits")
                     print(f"{error_text} Telegram flood control exceeded. Retrying in {to_sleep} seconds...", flush=True)
                     await asyncio.sleep(to_sleep)
-                    await notify_exception_via_telegram(ex)
 
                 else:
-                    await notify_exception_via_telegram(ex)
                     await asyncio.sleep(5)
 
-        if log.server is not None:
-            log.server.last_message_id = msg.message_id
+        return None
 
-    messages = [send_message(log) for log in change_logs]
-    for message in messages:
-        # We deliberately not use as_completed because it is *too* fast
-        await message
+    # The messages are deliberately sent one after another, sending them concurrently is *too* fast
+    while (log := await change_logs.get()) is not None:
+        msg = await send_message(log)
 
-    database_transaction(db, lambda: None)
+        # Sold servers are deleted, so there is nothing to reply to
+        if msg is not None and log.change.kind != ServerChangeType.sold:
+            message_ids[log.server_id] = msg.message_id
+
+    await reporter.close()
+    await database_transaction_async(db, lambda: write_last_message_ids(db, message_ids))
 
 
 async def notify_exception_via_telegram(ex: Exception) -> None:
+    await send_error_text_via_telegram(f"An unexpected error has occured:\n```{chr(10).join(format_exception(ex))[:4096 - 40]}```")
+
+
+async def send_error_text_via_telegram(text: str) -> None:
+    await send_text_via_telegram(text, parse_mode="markdown")
+
+
+async def send_text_via_telegram(text: str, parse_mode: str) -> None:
+    """Sends a single message outside of the pipeline, e.g. an error or a change of a ranking"""
     api_token = os.getenv("TELEGRAM_API_TOKEN")
     chat_id = os.getenv("TELEGRAM_CHAT_ID")
 
@@ -76,8 +111,7 @@ async def notify_exception_via_telegram(ex: Exception) -> None:
     i = 0
     while i < 5:
         try:
-            text = f"An unexpected error has occured:\n```{chr(10).join(format_exception(ex))[:4096 - 40]}```"
-            await bot.send_message(chat_id=chat_id, text=text[:4096], parse_mode="markdown")
+            await bot.send_message(chat_id=chat_id, text=text[:4096], parse_mode=parse_mode)
             break
 
         except Exception as ex2:
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from time import thread_time
+from types import FrameType
+from typing import Iterator
+
+from hetzner_server_scouter.settings import profiling_sample_interval_s, profiling_memory_check_interval_s
+from hetzner_server_scouter.utils import path
+
+# If the innermost frame of a thread is in one of these files, the thread waits: The event loop for I/O or a timer, the database thread for work
+idle_files = ("selectors.py", "threading.py", "queue.py")
+
+# If the innermost frame is in one of these files, the thread is blocked on the network, e.g. in a synchronous `requests.get`
+blocking_io_files = ("socket.py", "ssl.py")
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})".replace(";", ",")
+
+
+def collapse_stack(thread_name: str, frame: FrameType) -> str:
+    """
+    The stack in the collapsed format of flamegraph.pl / speedscope: `root;caller;callee`.
+    Idle threads are grouped under `[idle]`, stacks that are blocked on the network end in `[blocking I/O]`.
+    """
+    file_name = Path(frame.f_code.co_filename).name
+    if file_name in idle_files:
+        return f"{thread_name};[idle]"
+
+    frames = []
+    it: FrameType | None = frame
+    while it is not None:
+        frames.append(frame_name(it))
+        it = it.f_back
+
+    return ";".join([thread_name, *reversed(frames), *(["[blocking I/O]"] if file_name in blocking_io_files else [])])
+
+
+@dataclass
+class StackSampler:
+    """
+    Samples the stacks of all threads every `interval` seconds. Unlike cProfile, this measures wall time and includes the database thread.
+    The time the event loop waits (e.g. on an awaited request) is counted as `[idle]`, so it is separate from the time the CPU is busy.
+    """
+    interval: float = profiling_sample_interval_s
+    samples: Counter[str] = field(default_factory=Counter)
+
+    _stop: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="hscout-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        frames = sys._current_frames()
+
+        for thread in threading.enumerate():
+            if thread is self._thread or (frame := frames.get(thread.ident or -1)) is None:
+                continue
+
+            self.samples[collapse_stack(thread.name, frame)] += 1
+
+    def to_collapsed(self) -> str:
+        return "".join(f"{stack} {num}\n" for stack, num in self.samples.most_common())
+
+    def summary(self) -> str:
+        total, idle, blocked = Counter[str](), Counter[str](), Counter[str]()
+        for stack, num in self.samples.items():
+            thread_name = stack.split(";", 1)[0]
+            total[thread_name] += num
+            idle[thread_name] += num if stack.endswith(";[idle]") else 0
+            blocked[thread_name] += num if stack.endswith(";[blocking I/O]") else 0
+
+        return "\n".join(
+            f"{name}: {num * self.interval:.2f}s sampled, {100 * (num - idle[name] - blocked[name]) / num:.0f}% busy, "
+            f"{100 * blocked[name] / num:.0f}% blocked on I/O, {100 * idle[name] / num:.0f}% idle"
+            for name, num in total.most_common()
+        )
+
+
+@dataclass
+class MemoryPeakTracker:
+    """
+    Keeps a tracemalloc snapshot of the peak memory usage. The parsed servers and ORM objects are gone by the end of the run, so a snapshot at the end would miss them.
+    A new snapshot is taken whenever the traced memory has grown by `growth` since the last one.
+    """
+    interval: float = profiling_memory_check_interval_s
+    growth: float = 1.1
+
+    snapshot: tracemalloc.Snapshot | None = None
+    snapshot_size: int = 0
+
+    _stop: threading.Event = field(default_factory=threading.Event, repr=False)
+    _thread: threading.Thread | None = field(default=None, repr=False)
+
+    def start(self) -> None:
+        tracemalloc.start()
+        self._thread = threading.Thread(target=self._run, name="hscout-memory-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self.check()
+        tracemalloc.stop()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> None:
+        if (size := tracemalloc.get_traced_memory()[0]) > self.snapshot_size * self.growth:
+            self.snapshot, self.snapshot_size = tracemalloc.take_snapshot(), size
+
+    def report(self, top_n: int) -> str:
+        assert self.snapshot is not None
+        snapshot = self.snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")])
+        stats = snapshot.statistics("lineno")
+
+        lines = [f"Top {top_n} allocations by line at the peak of {self.snapshot_size / 1024 ** 2:.1f} MiB\n"]
+        for i, it in enumerate(stats[:top_n], start=1):
+            frame = it.traceback[0]
+            lines.append(f"{i:>3}. {frame.filename}:{frame.lineno}  {it.size / 1024:.1f} KiB in {it.count} blocks")
+
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profile_run(profile: bool, memory_top_n: int | None) -> Iterator[None]:
+    """
+    Profiles everything that runs inside. The reports are written into `<working dir>/profiles`:
+      - `.pstats`: cProfile of the main thread, measured in CPU time of the thread (so awaiting doesn't count), e.g. for `snakeviz`
+      - `.collapsed`: Sampled stacks of all threads in wall time, e.g. for `flamegraph.pl` or speedscope
+      - `-memory.txt`: The lines that hold the most memory at the peak (with `memory_top_n`)
+    """
+    if not profile and memory_top_n is None:
+        yield
+        return
+
+    profiler, sampler, memory_tracker = cProfile.Profile(thread_time), StackSampler(), MemoryPeakTracker()
+    if memory_top_n is not None:
+        memory_tracker.start()
+
+    if profile:
+        sampler.start()
+        profiler.enable()
+
+    try:
+        yield
+
+    finally:
+        if profile:
+            profiler.disable()
+            sampler.stop()
+        if memory_top_n is not None:
+            memory_tracker.stop()
+
+        name = f"profile-{datetime.now():%Y%m%d-%H%M%S}"
+        os.makedirs(path("profiles"), exist_ok=True)
+        reports = []
+
+        if profile:
+            profiler.dump_stats(path("profiles", f"{name}.pstats"))
+            path("profiles", f"{name}.collapsed").write_text(sampler.to_collapsed())
+            reports += [path("profiles", f"{name}.pstats"), path("profiles", f"{name}.collapsed")]
+
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            print(f"{out.getvalue()}\n{sampler.summary()}\n")
+
+        if memory_top_n is not None:
+            report = memory_tracker.report(memory_top_n)
+            path("profiles", f"{name}-memory.txt").write_text(report)
+            reports.append(path("profiles", f"{name}-memory.txt"))
+            print(report)
+
+        print("The profiling reports have been written to:\n" + "\n".join(f"  {it}" for it in reports))
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import bisect
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType
+from hetzner_server_scouter.notifications.notify_telegram import send_text_via_telegram
+from hetzner_server_scouter.settings import Datacenters, rankings_size
+from hetzner_server_scouter.utils import hetzner_notify_format_disks
+
+
+def price_per(server: Server, amount: float | None) -> float | None:
+    """The total price of the server divided by the amount, or `None` if there is nothing to divide by"""
+    if not amount:
+        return None
+
+    return server.calculate_price() / amount
+
+
+# The keys that servers can be ranked by, together with their unit. A server without the key (e.g. without ECC RAM) is not ranked.
+ranking_keys: dict[str, tuple[str, Callable[[Server], float | None]]] = {
+    "raid1": ("€ per usable TB in RAID1", lambda it: price_per(it, (it.disk_summary.raid1_size or 0) / 1000)),
+    "storage": ("€ per TB", lambda it: price_per(it, it.disk_summary.total_size / 1000)),
+    "ram": ("€ per GB RAM", lambda it: price_per(it, it.ram_size)),
+    "ecc_ram": ("€ per GB ECC RAM", lambda it: price_per(it, it.ram_size) if it.ram_is_ecc else None),
+    "core": ("€ per core", lambda it: price_per(it, it.cpu_cores)),
+}
+
+
+def server_url(server_id: int) -> str:
+    return f"https://www.hetzner.com/sb/#search={server_id}"
+
+
+@dataclass
+class RankingChange:
+    """The servers that have entered (with their rank and key) or left a ranking since it has last been notified about"""
+    title: str
+    unit: str
+    entered: list[tuple[int, int, float]]
+    left: list[int]
+
+    def to_console(self) -> str:
+        lines = [f"The ranking {self.title} has changed."]
+        lines += [f"#{rank} {server_url(server_id)} has entered ({key:.2f}{self.unit})" for rank, server_id, key in self.entered]
+        lines += [f"{server_url(server_id)} has left" for server_id in self.left]
+        return "\n".join(lines)
+
+    def to_telegram(self) -> str:
+        lines = [f"The ranking <b>{self.title}</b> has changed."]
+        lines += [f"#{rank} <a href='{server_url(server_id)}'>{server_id}</a> has entered ({key:.2f}{self.unit})" for rank, server_id, key in self.entered]
+        lines += [f"<a href='{server_url(server_id)}'>{server_id}</a> has left" for server_id in self.left]
+        return "\n".join(lines)
+
+
+@dataclass
+class Ranking:
+    """
+    The cheapest servers by one of the `ranking_keys`, optionally only the ones of a datacenter. Every ranked server is kept in a list of `(key, server id)`
+    that is sorted at all times, so a change only needs a binary search and an insert instead of sorting the whole auction again.
+    The ranking itself is the first `size` entries.
+    """
+    key_name: str
+    datacenter: Datacenters | None = None
+    size: int = rankings_size
+
+    entries: list[tuple[float, int]] = field(default_factory=list, repr=False)
+    keys: dict[int, float] = field(default_factory=dict, repr=False)
+
+    # The servers of the ranking when it has last been committed
+    members: set[int] = field(default_factory=set, repr=False)
+
+    @classmethod
+    def from_name(cls, name: str, size: int = rankings_size) -> Ranking:
+        """Parses a ranking as given in `rankings_watched`, e.g. "raid1@FSN" """
+        key_name, _, datacenter = name.partition("@")
+        if key_name not in ranking_keys:
+            raise ValueError(f"Unknown ranking {key_name!r}, expected one of {', '.join(ranking_keys)}")
+
+        if datacenter and Datacenters.from_data(datacenter) is None:
+            raise ValueError(f"Unknown datacenter {datacenter!r} for the ranking {key_name!r}")
+
+        return cls(key_name, Datacenters.from_data(datacenter or None), size)
+
+    @property
+    def unit(self) -> str:
+        return ranking_keys[self.key_name][0]
+
+    @property
+    def title(self) -> str:
+        return f"{self.unit}{f' ({self.datacenter})' if self.datacenter is not None else ''}"
+
+    def key(self, server: Server) -> float | None:
+        if self.datacenter is not None and server.datacenter != self.datacenter:
+            return None
+
+        return ranking_keys[self.key_name][1](server)
+
+    def build(self, servers: Iterable[Server]) -> None:
+        """Ranks the servers from scratch"""
+        self.keys = {it.id: key for it in servers if (key := self.key(it)) is not None}
+        self.entries = sorted((key, server_id) for server_id, key in self.keys.items())
+
+    def update(self, server: Server) -> None:
+        self.remove(server.id)
+
+        if (key := self.key(server)) is not None:
+            self.keys[server.id] = key
+            bisect.insort(self.entries, (key, server.id))
+
+    def remove(self, server_id: int) -> None:
+        if (key := self.keys.pop(server_id, None)) is not None:
+            del self.entries[bisect.bisect_left(self.entries, (key, server_id))]
+
+    def top(self) -> list[tuple[float, int]]:
+        return self.entries[:self.size]
+
+    def commit(self) -> RankingChange | None:
+        """Compares the ranking with the one of the last commit. Only a change of the members counts, not a change of their order or keys."""
+        top = self.top()
+        members = {server_id for _, server_id in top}
+        entered = [(rank, server_id, key) for rank, (key, server_id) in enumerate(top, 1) if server_id not in self.members]
+        left = sorted(self.members - members)
+
+        self.members = members
+        return RankingChange(self.title, self.unit, entered, left) if entered or left else None
+
+
+@dataclass
+class Rankings:
+    """The rankings that are kept up to date from the changes of every run"""
+    rankings: list[Ranking]
+
+    @classmethod
+    def from_names(cls, names: Iterable[str], size: int = rankings_size) -> Rankings:
+        return cls([Ranking.from_name(it, size) for it in names])
+
+    def build(self, servers: Iterable[Server]) -> Rankings:
+        """Ranks the servers from scratch and commits the result, so only the changes from here on are notified"""
+        servers = list(servers)
+        for ranking in self.rankings:
+            ranking.build(servers)
+            ranking.commit()
+
+        return self
+
+    def apply(self, changes: Iterable[ServerChange]) -> None:
+        for change in changes:
+            if change.kind == ServerChangeType.sold:
+                for ranking in self.rankings:
+                    ranking.remove(change.server_id)
+                continue
+
+            server = Server.from_dict(change.attrs)
+            for ranking in self.rankings:
+                ranking.update(server)
+
+    def commit(self) -> list[RankingChange]:
+        return [it for ranking in self.rankings if (it := ranking.commit()) is not None]
+
+
+async def notify_about_ranking_changes(changes: list[RankingChange], print_changes: bool = True) -> None:
+    for change in changes:
+        if print_changes:
+            print(f"\n{change.to_console()}")
+
+        await send_text_via_telegram(change.to_telegram(), parse_mode="html")
+
+
+def format_ranking(ranking: Ranking, servers: dict[int, Server]) -> str:
+    """The ranking as a table for `hscout top`"""
+    lines = [ranking.title]
+    for rank, (key, server_id) in enumerate(ranking.top(), 1):
+        it = servers[server_id]
+        disks = ", ".join(filter(None, [
+            hetzner_notify_format_disks(it.disks.get("hdd", []), "HDD"), hetzner_notify_format_disks(it.disks.get("ssd", []), "SSD"),
+            hetzner_notify_format_disks(it.disks.get("enterprise_hdd", []), "Enterprise HDD"), hetzner_notify_format_disks(it.disks.get("enterprise_ssd", []), "Enterprise SSD"),
+        ]))
+        lines.append(f"{rank:>3}. {key:>8.2f}  {server_id:>8}  {it.calculate_price():>7.2f}€  {it.cpu_name}, {it.ram_size}GB RAM, {disks}  {it.datacenter}")
+
+    return "\n".join(lines)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Iterable
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session as DatabaseSession, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from hetzner_server_scouter.data_sources import Snapshot
+from hetzner_server_scouter.db.crud import stream_server_changes
+from hetzner_server_scouter.db.db_conf import DataBase
+from hetzner_server_scouter.db.db_utils import run_in_database_thread
+from hetzner_server_scouter.notifications.crud import process_changes, DeliveryStage
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog, ServerChangeType
+from hetzner_server_scouter.settings import pipeline_change_queue_size
+from hetzner_server_scouter.utils import clock, run_concurrently, hetzner_prices
+
+
+@dataclass
+class ReplayStats:
+    snapshots: int = 0
+    servers: int = 0
+    changes: Counter[ServerChangeType] = field(default_factory=Counter)
+    took: float = 0
+
+    def to_str(self) -> str:
+        changes = ", ".join(f"{self.changes[kind]} {kind.name}" for kind in ServerChangeType)
+        return f"Replayed {self.snapshots} snapshots with {self.servers} servers in {self.took:.2f}s ({self.snapshots / max(self.took, 1e-9):.1f} snapshots/s): {changes}"
+
+
+def make_replay_session() -> DatabaseSession:
+    """A replay starts with an empty in-memory database, so it never touches the real state."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    DataBase.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, bind=engine)()
+
+
+def count_changes_since(db: DatabaseSession, log_id: int) -> tuple[Counter[ServerChangeType], int]:
+    rows = db.execute(select(ServerChangeLog.__table__.c.kind, func.count(), func.max(ServerChangeLog.id)).where(ServerChangeLog.id > log_id).group_by(ServerChangeLog.__table__.c.kind)).all()
+    return Counter({kind: num for kind, num, _ in rows}), max((last_id for *_, last_id in rows), default=log_id)
+
+
+async def replay_snapshots(db: DatabaseSession, snapshots: Iterable[Snapshot], deliver: DeliveryStage, print_changes: bool = False) -> ReplayStats:
+    """
+    Pushes the snapshots through the full diff / notify pipeline as fast as possible.
+    While a snapshot is processed, the clock is fixed to its time.
+    """
+    stats, last_log_id = ReplayStats(), 0
+    s = perf_counter()
+
+    try:
+        for snapshot in snapshots:
+            clock.fixed_time = snapshot.time
+            hetzner_prices.update_from_snapshot(snapshot.data)
+
+            changes: asyncio.Queue[ServerChange | None] = asyncio.Queue(maxsize=pipeline_change_queue_size)
+            await run_concurrently(stream_server_changes(db, snapshot.data, changes), process_changes(db, changes, deliver, print_changes))
+
+            new_changes, last_log_id = await run_in_database_thread(lambda: count_changes_since(db, last_log_id))
+            stats.snapshots += 1
+            stats.servers += len(snapshot.data["server"])
+            stats.changes += new_changes
+
+            print(f"{snapshot.time:%Y-%m-%d %H:%M:%S}  {len(snapshot.data['server']):>5} servers  " + "  ".join(f"{new_changes[kind]:>4} {kind.name}" for kind in ServerChangeType), flush=True)
+
+    finally:
+        clock.fixed_time = None
+        stats.took = perf_counter() - s
+
+    return stats
@@ -6,9 +6,7 @@ import sys
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
-from typing import NoReturn, Any, cast
-
-import requests
+from typing import NoReturn
 
 error_text = "\033[1;91mError:\033[0m"
 warning_text = "\033[1;33mWarning:\033[0m"
@@ -52,6 +50,123 @@ if is_testing:
 # -/- Test Settings ---
 
 
+# --- Pipeline ---
+
+# The maximum number of found changes that wait to be logged. If the notifications lag behind, the diff waits for them which keeps the memory bounded.
+pipeline_change_queue_size = 128
+
+# The changes are logged to the database in batches of at most this size.
+pipeline_log_batch_size = 32
+
+# The maximum number of logged changes that wait to be sent.
+pipeline_send_queue_size = 64
+
+# -/- Pipeline ---
+
+
+# --- Payload Validation ---
+
+# How thoroughly the records of the auction are checked against each other, e.g. the parsed `hdd_arr` against the `serverDiskData`, see `validation.py`.
+# "off" skips the checks, "sampled" checks `payload_validation_sample_rate` of the records and "full" checks every record. It can be overwritten with `--validate`.
+# A record that fails a check is skipped and reported as an anomaly, the run continues with the others.
+payload_validation_mode = "full" if is_testing else "sampled"
+payload_validation_sample_rate = 0.05
+
+# Every anomaly is appended as a JSON line to this file. Set to None to only log and count them.
+payload_anomalies_path: Path | None = Path(working_dir_location, "anomalies.jsonl")
+
+# -/- Payload Validation ---
+
+
+# --- Parse Tables ---
+
+# The parse results of the disk strings, CPU names and datacenter codes are kept for the lifetime of the process, see `db/parse_tables.py`.
+# If a table grows beyond this many entries, it is cleared, so an auction with unexpectedly many distinct strings can't grow the memory without bound.
+parse_tables_max_size = 10_000
+
+# -/- Parse Tables ---
+
+
+# --- Rankings ---
+
+# The number of servers in a ranking, e.g. the 20 cheapest servers per TB. It can be overwritten for `hscout top` with `-n`.
+rankings_size = 20
+
+# The rankings that are kept up to date during every run, see `rankings.py`. You are notified whenever a server enters or leaves one of them.
+# Each is the name of a ranking key, optionally restricted to a datacenter, e.g. "raid1@FSN". Rank the whole auction with `--store-all`.
+rankings_watched: list[str] = []
+
+# -/- Rankings ---
+
+
+# --- Export ---
+
+# `hscout export` streams the rows from the database in chunks of this size, so its memory doesn't grow with the history. Parquet gets one row group per chunk.
+export_chunk_size = 1000
+
+# -/- Export ---
+
+
+# --- Change Feed ---
+
+# If set to True an Atom feed, a JSON Feed and an HTML page of the latest changes are kept in `working_dir_location/feed`, see `change_feed.py`.
+# They are static files, so any web server can publish them.
+change_feed_enabled = True
+
+# The number of changes in the feeds
+change_feed_size = 200
+
+change_feed_title = "Hetzner Server Auction Changes"
+
+# The URL of the directory the feeds are published at, ending with a slash. It is used for the ids and the self links of the feeds.
+change_feed_url: str | None = None
+
+# -/- Change Feed ---
+
+
+# --- Metrics ---
+
+# After every run the timings and counters (see `metrics.py`) are written to this file. It can be overwritten with `--metrics`.
+# A `.prom` file is written in the Prometheus textfile format, every other file gets one JSON line appended per run. Set to None to disable.
+metrics_export_path: Path | None = Path(working_dir_location, "metrics.prom")
+
+# -/- Metrics ---
+
+
+# --- Daemon ---
+
+# With `hscout daemon`, the auction is polled at this interval
+daemon_poll_interval_s = 3600
+
+# The address of the `/metrics` endpoint of the daemon. Only listen on localhost by default, the endpoint has no authentication.
+daemon_metrics_host = "127.0.0.1"
+daemon_metrics_port = 9464
+
+# The buckets (in seconds) of the latency histograms (fetch, Telegram send) and of the cycle duration histogram
+daemon_latency_buckets_s = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+daemon_cycle_buckets_s = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# The address of the query API of `hscout serve`. It also serves `/metrics`.
+serve_host = "127.0.0.1"
+serve_port = 9465
+
+# -/- Daemon ---
+
+
+# --- Profiling ---
+
+# With `--profile`, the stacks of all threads are sampled at this interval
+profiling_sample_interval_s = 0.005
+
+# The number of lines that are reported with `--profile-memory` if no number is given
+profiling_memory_top_n = 25
+
+# With `--profile-memory`, the traced memory is checked at this interval to find its peak
+profiling_memory_check_interval_s = 0.05
+
+# -/- Profiling ---
+
+
 # --- Database Configuration ---
 
 def _make_db_name(db_name: str) -> str:
@@ -77,32 +192,54 @@ database_url = db_make_sqlite_url(sqlite_database_name)
 # If set to True all the emitted SQL is echo'd back
 database_verbose_sql = False
 
+# If set to True all database work is done on a dedicated worker thread, so commits don't block the event loop (and thereby the notifications).
+database_use_worker_thread = True
+
+# If set to True every server of the auction is stored, not only the ones that match the filters. Notifications are still only sent for the matching ones.
+# Changing the filters then doesn't change the stored state, and the matching servers can be queried with `read_matching_servers`.
+database_store_full_auction = False
+
 # -/- Database Configuration ---
 
 # --- Hetzner API specifics ---
 
-hetzner_api_url = "https://www.hetzner.com/_resources/app/jsondata/live_data_sb.json"
+# The feeds of the auction by their currency. They are fetched concurrently and merged by the server id into one snapshot, see `fetch.py`.
+# The first feed is the base of the snapshot, the prices of all others are added to its servers, e.g. add
+#   "USD": "https://www.hetzner.com/_resources/app/data/app/live_data_sb_USD.json"
+hetzner_api_feeds = {"EUR": "https://www.hetzner.com/_resources/app/data/app/live_data_sb_EUR.json"}
+
+# The page with the price of a primary IPv4, which is added to the price of every server with IPv4. It is fetched together with the feeds.
+hetzner_ipv4_price_url = "https://docs.hetzner.com/de/general/others/ipv4-pricing/"
+
 hetzner_api_get_headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"}
-hetzner_api_retry_count = 5
 
+# A request that takes longer than this is abandoned. It is retried up to `hetzner_api_retry_count` times, waiting 1×, 2×, 4×, … the backoff in between.
+hetzner_api_timeout_s = 30
+hetzner_api_retry_count = 3
+hetzner_api_retry_backoff_s = 1
 
-def get(url: str) -> Any | None:
-    for i in range(hetzner_api_retry_count):
-        try:
-            return requests.get(url, headers=hetzner_api_get_headers)
-        except Exception as ex:
-            print(f"Error fetching API: {ex}")
+# If a request takes longer than this quantile of the recent latencies of its source, a second (hedged) request is sent and the first response wins.
+# Set to None to disable hedging. Hedging only starts once there are `hetzner_api_hedge_min_samples` latencies.
+hetzner_api_hedge_quantile: float | None = 0.95
+hetzner_api_hedge_min_samples = 10
+hetzner_api_latency_history = 100
 
-    return None
+# After this many failed fetches in a row, a source is not fetched at all for `hetzner_api_breaker_open_s` seconds, so an outage is not hammered by every run.
+# Afterwards, a single request is tried. The state is kept in `working_dir_location/fetch_state.json`, so it is shared between runs.
+# Like the database, the tests use their own file, so their failed fetches never open the breaker of the real runs.
+hetzner_api_breaker_threshold = 3
+hetzner_api_breaker_open_s = 1800
+hetzner_api_state_file_name = _make_db_name("fetch_state.json")
 
+# If set to True every downloaded auction is archived in `working_dir_location/archive`, see `archive.py`
+snapshot_archive_enabled = True
 
-def get_hetzner_api() -> dict[str, Any] | None:
-    """Fetches the live hetzner data, pretending to be a Chrome instance from Windows 10."""
-    response = get("https://www.hetzner.com/_resources/app/data/app/live_data_sb_EUR.json")
-    if response is None or not response.ok:
-        return None
+# Every n-th archived snapshot is stored in full, all others only as a delta to the previous one.
+# A higher interval makes the archive smaller, but random access slower, as up to n deltas have to be applied.
+snapshot_archive_keyframe_interval = 48
 
-    return cast(dict[str, Any], response.json())
+# The zlib compression level (0-9) of the archived snapshots
+snapshot_archive_compression_level = 9
 
 
 # Unfortunately, this class has to be here due to the shared dependency with utils.py
@@ -147,3 +284,14 @@ class ServerSpecials:
     has_HWR: bool  # Hardware RAID
 
 # -/- Hetzner API specifics ---
+
+
+# --- Telegram ---
+
+# Exceptions that occur while sending notifications are collected and sent as one summary every `telegram_error_report_window_s` seconds.
+telegram_error_report_window_s = 60
+
+# The maximum number of error summaries sent per minute. This is independent of the budget for the actual notifications.
+telegram_error_report_rate_m = 2
+
+# -/- Telegram ---
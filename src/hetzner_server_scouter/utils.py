@@ -5,26 +5,33 @@ import inspect
 import itertools
 import logging
 import os
-import re
+import shlex
 import sys
-from argparse import ArgumentParser, Namespace, RawTextHelpFormatter, Action
+from argparse import ArgumentParser, Namespace, RawTextHelpFormatter, Action, SUPPRESS
 from asyncio import AbstractEventLoop, get_event_loop
+from collections import Counter, deque
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import datetime
 from functools import wraps
 from pathlib import Path
 from time import perf_counter
 from traceback import format_exception
-from typing import TypeVar, Callable, Iterable, Any, TYPE_CHECKING
+from typing import TypeVar, Callable, Iterable, Iterator, Any, Coroutine, NoReturn, TYPE_CHECKING
 
 import requests
 
-from hetzner_server_scouter.settings import is_linux, is_macos, is_testing, is_windows, working_dir_location, database_url, Datacenters, error_text, get
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.settings import is_linux, is_macos, is_testing, is_windows, working_dir_location, database_url, Datacenters, error_text, metrics_export_path, profiling_memory_top_n, daemon_poll_interval_s, daemon_metrics_host, daemon_metrics_port, serve_host, serve_port, database_store_full_auction, rankings_size, payload_validation_mode
 from hetzner_server_scouter.version import __version__
 
 if TYPE_CHECKING:
     from hetzner_server_scouter.db.models import Server
 
+T = TypeVar("T")
+U = TypeVar("U")
+KT = TypeVar("KT")
+
 
 def print_version() -> None:
     # This is such an ingenious solution constructed by ChatGPT
@@ -53,16 +60,12 @@ def print_exception(ex: Exception) -> None:
     print(f"{error_text} An unexpected error has occured:\n{chr(10).join(format_exception(ex))}", flush=True)
 
 
-def parse_args() -> Namespace:
-    """Parse the command line arguments"""
-    parser = ArgumentParser(prog="hscout", formatter_class=lambda prog: RawTextHelpFormatter(prog, max_help_position=31), description="""A tool to watch and get notified about updates on the hetzner server auction""")
-
-    parser.add_argument("-v", "--verbose", help="Make the application more verbose", action="count", default=0)
-    parser.add_argument("-d", "--debug", help="Debug the application (triggers debug asserts and highest log level)", action="store_true")
-    parser.add_argument("-V", "--version", help="Print the version", action="store_true")
-    parser.add_argument("-4", "--force-ipv4", help="Forces IPv4 for networks that don't support v6", action="store_true")
-
-    parser.add_argument("--tax", metavar="<tax>", type=int, action=Percentage, default=19, help="Set the tax rate  [default: 19]")
+def add_filter_arguments(parser: ArgumentParser, with_defaults: bool = True) -> None:
+    """
+    Adds the filters to the parser. They are shared between the main command and the subcommands.
+    Without defaults, only the filters that are given are set, so they don't overwrite the ones of the main command.
+    """
+    parser.add_argument("--tax", metavar="<tax>", type=int, action=Percentage, default=19 if with_defaults else SUPPRESS, help="Set the tax rate  [default: 19]")
 
     filter_group = parser.add_argument_group("Available Filters")
     filter_group.add_argument("--price", metavar="<price>", type=int, help="Filter by price (in €)")
@@ -74,7 +77,7 @@ def parse_args() -> Namespace:
     disk_group.add_argument("--disk-num", metavar="<num>", type=int, help="The exact number of disks the server should have")
     disk_group.add_argument("--disk-num-exact", metavar="<num>", type=int, help="The minimum number of disks the server should have")
     disk_group.add_argument("--disk-num-quick", metavar="<num>", type=int, help="The number of SATA / NVME disks the server should have")
-    disk_group.add_argument("--disk-enterprise", action="store_true", help="If all disks should be enterprise grade")
+    disk_group.add_argument("--disk-enterprise", action="store_true", default=False if with_defaults else SUPPRESS, help="If all disks should be enterprise grade")
     disk_group.add_argument("--disk-size", metavar="<size>", type=int, help="The minimum size (in GB) of *each* disk")
     disk_group.add_argument("--disk-size-any", metavar="<size>", type=int, help="The minimum size (in GB) of any disk")
     disk_group.add_argument("--disk-size-exact", metavar="<size>", type=int, help="The exact size (in GB) of *each* disk")
@@ -85,15 +88,112 @@ def parse_args() -> Namespace:
     disk_group.add_argument("--disk-size-raid6", metavar="<size>", type=int)
 
     specials_group = parser.add_argument_group("Require specials")
-    specials_group.add_argument("--ipv4", action="store_true")
-    specials_group.add_argument("--gpu", action="store_true")
-    specials_group.add_argument("--inic", action="store_true")
-    specials_group.add_argument("--ecc", action="store_true")
-    specials_group.add_argument("--hwr", action="store_true")
+    for special in ["ipv4", "gpu", "inic", "ecc", "hwr"]:
+        specials_group.add_argument(f"--{special}", action="store_true", default=False if with_defaults else SUPPRESS)
+
+
+def parse_filter_variant(variant: str, base: Namespace) -> Namespace:
+    """Parses a set of filters as it would be given on the command line, e.g. `--price 50 --ram 64`. Every filter that is not given is taken from `base`."""
+    parser = ArgumentParser(prog="hscout backtest --variant", add_help=False)
+    add_filter_arguments(parser)
+
+    return parser.parse_args(shlex.split(variant), namespace=Namespace(**vars(base)))
+
+
+class FilterQueryError(ValueError):
+    pass
+
+
+class FilterQueryParser(ArgumentParser):
+    def error(self, message: str) -> NoReturn:
+        raise FilterQueryError(message)
+
+
+def parse_filter_query(query: dict[str, list[str]], base: Namespace) -> Namespace:
+    """
+    Parses the filters of a query string, e.g. `price=60&ram=64&ecc&datacenter=FSN,HEL`. The keys are the names of the command line filters.
+    Every filter that is not given is taken from `base`. Invalid filters raise a `FilterQueryError`.
+    """
+    argv = []
+    for key, values in query.items():
+        option = f"--{key.replace('_', '-')}"
+
+        if isinstance(getattr(base, key.replace("-", "_"), None), bool):
+            if values[-1].lower() in {"", "1", "true", "yes"}:
+                argv.append(option)
+        else:
+            argv += [option, *(it for value in values for it in value.split(","))]
+
+    parser = FilterQueryParser(add_help=False)
+    add_filter_arguments(parser)
+    return parser.parse_args(argv, namespace=Namespace(**vars(base)))
+
+
+def parse_args() -> Namespace:
+    """Parse the command line arguments"""
+    parser = ArgumentParser(prog="hscout", formatter_class=lambda prog: RawTextHelpFormatter(prog, max_help_position=31), description="""A tool to watch and get notified about updates on the hetzner server auction""")
+
+    parser.add_argument("-v", "--verbose", help="Make the application more verbose", action="count", default=0)
+    parser.add_argument("-d", "--debug", help="Debug the application (triggers debug asserts and highest log level)", action="store_true")
+    parser.add_argument("-V", "--version", help="Print the version", action="store_true")
+    parser.add_argument("-4", "--force-ipv4", help="Forces IPv4 for networks that don't support v6", action="store_true")
+
+    parser.add_argument("--source", metavar="<path>", type=Path, help="Read the auction from a snapshot file or the latest snapshot of a directory instead of the Hetzner API")
+    parser.add_argument("--record", metavar="<dir>", type=Path, help="Record every downloaded auction as a snapshot into this directory")
+    parser.add_argument("--store-all", action="store_true", default=database_store_full_auction, help="Store the whole auction, not only the servers that match the filters")
+    parser.add_argument("--metrics", metavar="<path>", type=Path, default=metrics_export_path, help="Write the timings and counters of the run to this file (.prom or JSON lines)")
+    parser.add_argument("--validate", choices=["off", "sampled", "full"], default=payload_validation_mode, help=f"How many records of the auction are validated  [default: {payload_validation_mode}]")
+    parser.add_argument("--profile", action="store_true", help="Profile the run and write the reports into the working directory")
+    parser.add_argument("--profile-memory", metavar="<n>", type=int, nargs="?", const=profiling_memory_top_n, help=f"Track the allocations and report the top <n> lines  [default: {profiling_memory_top_n}]")
+
+    add_filter_arguments(parser)
+
+    # The filters can also be given after the subcommand
+    subcommand_filters = ArgumentParser(add_help=False, argument_default=SUPPRESS)
+    add_filter_arguments(subcommand_filters, with_defaults=False)
+
+    subparsers = parser.add_subparsers(dest="command", metavar="<command>", title="Commands")
+
+    replay_parser = subparsers.add_parser("replay", parents=[subcommand_filters], formatter_class=RawTextHelpFormatter, help="Replay recorded snapshots through the diff and the notifications")
+    replay_parser.add_argument("replay_source", metavar="<path>", type=Path, help="A snapshot file or a directory of recorded snapshots")
+    replay_parser.add_argument("--notify", action="store_true", help="Send the notifications of the replay via telegram")
+    replay_parser.add_argument("--print-changes", action="store_true", help="Print every change of the replay")
+
+    backtest_parser = subparsers.add_parser("backtest", parents=[subcommand_filters], formatter_class=RawTextHelpFormatter, help="Evaluate filter variants against the archived history")
+    backtest_parser.add_argument("backtest_source", metavar="<path>", type=Path, nargs="?", help="The snapshots to test against  [default: the archive]")
+    backtest_parser.add_argument("--variant", metavar="<filters>", dest="variants", action="append", default=[], help="A set of filters, e.g. \"--price 50 --ram 64\". Can be given multiple times.\nFilters that are not given are taken from the command line.")
+    backtest_parser.add_argument("--variants-file", metavar="<file>", type=Path, help="A file with one set of filters per line")
+
+    daemon_parser = subparsers.add_parser("daemon", parents=[subcommand_filters], formatter_class=RawTextHelpFormatter, help="Poll the auction periodically and serve the metrics via HTTP")
+    daemon_parser.add_argument("--interval", metavar="<s>", type=float, default=daemon_poll_interval_s, help=f"The polling interval in seconds  [default: {daemon_poll_interval_s}]")
+    daemon_parser.add_argument("--metrics-host", metavar="<host>", default=daemon_metrics_host, help=f"The address of the /metrics endpoint  [default: {daemon_metrics_host}]")
+    daemon_parser.add_argument("--metrics-port", metavar="<port>", type=int, default=daemon_metrics_port, help=f"The port of the /metrics endpoint  [default: {daemon_metrics_port}]")
+
+    serve_parser = subparsers.add_parser("serve", parents=[subcommand_filters], formatter_class=RawTextHelpFormatter, help="Poll the auction periodically and answer queries over it via HTTP")
+    serve_parser.add_argument("--interval", metavar="<s>", type=float, default=daemon_poll_interval_s, help=f"The polling interval in seconds  [default: {daemon_poll_interval_s}]")
+    serve_parser.add_argument("--host", metavar="<host>", default=serve_host, help=f"The address of the API  [default: {serve_host}]")
+    serve_parser.add_argument("--port", metavar="<port>", type=int, default=serve_port, help=f"The port of the API  [default: {serve_port}]")
+
+    top_parser = subparsers.add_parser("top", parents=[subcommand_filters], formatter_class=RawTextHelpFormatter, help="Rank the stored servers that match the filters, e.g. by the price per TB")
+    top_parser.add_argument("rankings", metavar="<ranking>", nargs="*", help="The rankings to show, optionally restricted to a datacenter, e.g. raid1@FSN  [default: all]\nOne of raid1, storage, ram, ecc_ram, core")
+    top_parser.add_argument("-n", dest="rankings_size", metavar="<n>", type=int, default=rankings_size, help=f"The number of servers per ranking  [default: {rankings_size}]")
+
+    export_parser = subparsers.add_parser("export", formatter_class=RawTextHelpFormatter, help="Export the stored servers or the history of changes as CSV, JSON lines or Parquet")
+    export_parser.add_argument("export_table", metavar="<table>", choices=["servers", "changes"], help="Either servers or changes")
+    export_parser.add_argument("export_path", metavar="<path>", type=Path, nargs="?", help="The file to export to  [default: stdout]")
+    export_parser.add_argument("--format", dest="export_format", choices=["csv", "jsonl", "parquet"], help="The format  [default: from the extension of the file, else csv]")
+    export_parser.add_argument("--since-id", metavar="<id>", type=int, help="Only export the changes after this log id, e.g. the last one of the previous export")
+    export_parser.add_argument("--since", metavar="<time>", type=datetime.fromisoformat, help="Only export the changes from this time on, e.g. 2024-01-31T12:00")
+
+    watch_parser = subparsers.add_parser("watch", formatter_class=RawTextHelpFormatter, help="Manage the watchlist: Watched servers are always notified, regardless of the filters")
+    watch_subparsers = watch_parser.add_subparsers(dest="watch_command", metavar="<action>", required=True)
+    watch_subparsers.add_parser("add", help="Watch servers").add_argument("server_ids", metavar="<id>", type=int, nargs="+")
+    watch_subparsers.add_parser("remove", help="Stop watching servers").add_argument("server_ids", metavar="<id>", type=int, nargs="+")
+    watch_subparsers.add_parser("list", help="List the watched servers")
 
     if is_testing:
         # Pytest adds extra arguments that don't fit into the defined schema.
-        return parser.parse_known_args()[0]
+        return parser.parse_args([])
 
     parsed_args = parser.parse_args()
 
@@ -175,6 +275,72 @@ def queue_get_nowait(q: asyncio.Queue[T]) -> T | None:
         return None
 
 
+async def queue_get_batch(q: asyncio.Queue[T | None], max_size: int) -> tuple[list[T], bool]:
+    """
+    Waits for the first item of the queue and then takes everything that is already available, up to `max_size` items.
+    The queue is expected to be terminated with `None`, the second return value indicates whether this end has been reached.
+    """
+    batch: list[T] = []
+
+    it = await q.get()
+    while it is not None:
+        batch.append(it)
+        if len(batch) >= max_size:
+            return batch, False
+
+        try:
+            it = q.get_nowait()
+        except asyncio.QueueEmpty:
+            return batch, False
+
+    return batch, True
+
+
+class UrgentFirstQueue(asyncio.Queue[T]):
+    """A FIFO queue, except that the urgent items are taken before all others that are waiting. The urgent items stay in order among themselves."""
+
+    def __init__(self, is_urgent: Callable[[T], bool], maxsize: int = 0) -> None:
+        self.is_urgent = is_urgent
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        super()._init(maxsize)
+        self._urgent: deque[T] = deque()
+
+    def _put(self, item: T) -> None:
+        if self.is_urgent(item):
+            self._urgent.append(item)
+        else:
+            super()._put(item)
+
+    def _get(self) -> T:
+        return self._urgent.popleft() if self._urgent else super()._get()
+
+    def qsize(self) -> int:
+        return len(self._urgent) + super().qsize()
+
+    def empty(self) -> bool:
+        return not self._urgent and super().empty()
+
+
+async def run_concurrently(*coroutines: Coroutine[Any, Any, Any]) -> None:
+    """
+    Runs the stages of a pipeline concurrently.
+    If one of them fails, the others are cancelled (as they would otherwise wait on their queues forever) and the exception is raised.
+    """
+    tasks = [asyncio.ensure_future(it) for it in coroutines]
+
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    for task in done:
+        if (ex := task.exception()) is not None:
+            raise ex
+
+
 def datetime_nullable_fromtimestamp(it: int | None) -> datetime | None:
     if it is None:
         return None
@@ -191,28 +357,33 @@ def datetime_nullable_fromisoformat(it: str | None) -> datetime | None:
 
 # Adapted from https://stackoverflow.com/a/5929165 and https://stackoverflow.com/a/36944992
 def debug_time(str_to_put: str | None = None, func_to_call: Any = None, debug_level: int = logging.DEBUG) -> Callable[[Any], Any]:
+    """Logs the time a function (or coroutine) takes and records it as a span in the metrics of the run"""
+
     def decorator(function: Any) -> Any:
-        @wraps(function)
-        def _self_impl(self: Any, *method_args: Any, **method_kwargs: Any) -> Any:
-            logger.log(debug_level, f"Starting: {str_to_put if func_to_call is None else func_to_call(self)}")
-            s = perf_counter()
+        is_method = "self" in inspect.getfullargspec(function).args
 
-            method_output = function(self, *method_args, **method_kwargs)
-            logger.log(debug_level, f"Finished: {str_to_put if func_to_call is None else func_to_call(self)} in {perf_counter() - s:.3f}s")
+        @contextmanager
+        def timed(method_args: tuple[Any, ...]) -> Iterator[None]:
+            name = str(str_to_put if func_to_call is None or not is_method else func_to_call(method_args[0]))
+            logger.log(debug_level, f"Starting: {name}")
 
-            return method_output
+            with metrics.span(name) as span:
+                yield
 
-        def _impl(*method_args: Any, **method_kwargs: Any) -> Any:
-            logger.log(debug_level, f"Starting: {str_to_put}")
-            s = perf_counter()
+            logger.log(debug_level, f"Finished: {name} in {span.took:.3f}s")
 
-            method_output = function(*method_args, **method_kwargs)
-            logger.log(debug_level, f"Finished: {str_to_put} in {perf_counter() - s:.3f}s")
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def _async_impl(*method_args: Any, **method_kwargs: Any) -> Any:
+                with timed(method_args):
+                    return await function(*method_args, **method_kwargs)
 
-            return method_output
+            return _async_impl
 
-        if "self" in inspect.getfullargspec(function).args:
-            return _self_impl
+        @wraps(function)
+        def _impl(*method_args: Any, **method_kwargs: Any) -> Any:
+            with timed(method_args):
+                return function(*method_args, **method_kwargs)
 
         return _impl
 
@@ -290,6 +461,17 @@ class RateLimiter:
         self.tokens_m.append(now)
 
 
+@dataclass
+class Clock:
+    """
+    The current time of the application. During a replay it is fixed to the time of the replayed snapshot, so e.g. the countdowns of the price reductions stay consistent.
+    """
+    fixed_time: datetime | None = None
+
+    def now(self) -> datetime:
+        return self.fixed_time or datetime.now()
+
+
 def filter_none(it: list[T | None]) -> list[T]:
     return [item for item in it if item is not None]
 
@@ -298,115 +480,108 @@ def filter_none(it: list[T | None]) -> list[T]:
 
 # --- Hetzner API ---
 
-def get_hetzner_ipv4_price() -> float | None:
-    req = get("https://docs.hetzner.com/de/general/others/ipv4-pricing/")
-    if req is None or not req.ok:
-        return None
-
-    it = re.search(r"Primäre IPv4[\w</>\s]*(\d,\d\d)\s*€ pro Monat", req.text)
-    if it is None:
-        return None
+@dataclass
+class HetznerPrices:
+    """
+    The prices that are not part of the auction feed. They are fetched together with the feeds (see `fetch.py`) and recorded with every snapshot,
+    so a replay uses the prices of back then. The last fetched prices are kept in the state file of the fetch and loaded at startup (see `load_hetzner_prices`),
+    so the commands that don't fetch and the runs whose fetch of them fails still know them.
+    """
+    ipv4: float | None = None
 
-    try:
-        return float(it.group(1).replace(",", "."))
-    except Exception:
-        return None
+    def update_from_snapshot(self, data: dict[str, Any]) -> None:
+        if (it := data.get("ipv4_price")) is not None:
+            self.ipv4 = it
 
 
 def filter_server_with_program_args(server: Server) -> Server | None:
-    if program_args.price and server.calculate_price() > program_args.price:
-        return None
+    return filter_server(server, program_args)
 
-    if program_args.cpu and program_args.cpu.lower() not in server.cpu_name.lower():
-        return None
 
-    if program_args.datacenter and server.datacenter not in {Datacenters.from_data(it) for it in program_args.datacenter}:
+def filter_server(server: Server, args: Namespace) -> Server | None:
+    """Applies the filters of `args` (as added by `add_filter_arguments`) to the server"""
+    if not server_matches_price(server, args) or not server_matches_hardware(server, args):
         return None
 
-    if program_args.ram and server.ram_size < program_args.ram:
-        return None
+    return server
 
-    # Now, check for the disks
-    num_quick_disks = len(server.all_ssds)
-    if program_args.disk_num and num_quick_disks + len(server.all_hdds) < program_args.disk_num:
-        return None
 
-    if program_args.disk_num_exact and num_quick_disks + len(server.all_hdds) != program_args.disk_num_exact:
-        return None
+def server_matches_price(server: Server, args: Namespace) -> bool:
+    return not args.price or server.calculate_price(args.tax) <= args.price
 
-    if program_args.disk_num_quick and num_quick_disks != program_args.disk_num_quick:
-        return None
 
-    if program_args.disk_size or program_args.disk_size_any or program_args.disk_size_exact:
-        max_size_seen = 0
-        for disk in server.all_disks:
-            max_size_seen = max(max_size_seen, disk)
+def server_matches_hardware(server: Server, args: Namespace) -> bool:
+    """All filters except the price. As the hardware of a server never changes, neither does the result."""
+    if args.cpu and args.cpu.lower() not in server.cpu_name.lower():
+        return False
 
-            if program_args.disk_size and disk < program_args.disk_size:
-                return None
-            if program_args.disk_size_exact and disk != program_args.disk_size_exact:
-                return None
+    if args.datacenter and server.datacenter not in {Datacenters.from_data(it) for it in args.datacenter}:
+        return False
 
-        if program_args.disk_size_any and max_size_seen < program_args.disk_size_any:
-            return None
+    if args.ram and server.ram_size < args.ram:
+        return False
 
-    # Now check if the server satisfies the required raid size
-    all_disks = server.all_disks
-    if not all_disks:
-        return None
+    # Now, check for the disks. The summary is calculated once when the server is parsed, so these are all plain reads.
+    disks = server.disk_summary
+    if args.disk_num and disks.num < args.disk_num:
+        return False
 
-    if program_args.disk_enterprise:
-        if server.disks["hdd"] or server.disks["ssd"]:
-            return None
+    if args.disk_num_exact and disks.num != args.disk_num_exact:
+        return False
 
-    min_disk_size = min(all_disks)
+    if args.disk_num_quick and disks.num_quick != args.disk_num_quick:
+        return False
 
-    def cant_raid0(size: int | None) -> bool:
-        return size is not None and sum(all_disks) < size
+    if disks.min_size is None or disks.max_size is None:
+        return False
 
-    def cant_raid1(size: int | None) -> bool:
-        return size is not None and min_disk_size * (len(all_disks) // 2) < size
+    if args.disk_size and disks.min_size < args.disk_size:
+        return False
+    if args.disk_size_exact and (disks.min_size != args.disk_size_exact or disks.max_size != args.disk_size_exact):
+        return False
+    if args.disk_size_any and disks.max_size < args.disk_size_any:
+        return False
 
-    def cant_raid5(size: int | None) -> bool:
-        return size is not None and (len(all_disks) < 3 or min_disk_size * (len(all_disks) - 1) < size)
+    if args.disk_enterprise and not disks.is_enterprise:
+        return False
 
-    def cant_raid6(size: int | None) -> bool:
-        return size is not None and (len(all_disks) < 4 or min_disk_size * (len(all_disks) - 2) < size)
+    # Now check if the server satisfies the required raid size
+    def cant_raid(size: int | None, raid_size: int | None) -> bool:
+        return size is not None and (raid_size is None or raid_size < size)
 
-    if (it := program_args.disk_size_redundant) is not None and cant_raid1(it) and cant_raid5(it) and cant_raid6(it):
-        return None
-    else:
-        for i in [0, 1, 5, 6]:
-            if eval(f"cant_raid{i}(program_args.disk_size_raid{i})"):
-                return None
+    if (it := args.disk_size_redundant) is not None and cant_raid(it, disks.raid1_size) and cant_raid(it, disks.raid5_size) and cant_raid(it, disks.raid6_size):
+        return False
+    elif (cant_raid(args.disk_size_raid0, disks.raid0_size) or cant_raid(args.disk_size_raid1, disks.raid1_size) or
+          cant_raid(args.disk_size_raid5, disks.raid5_size) or cant_raid(args.disk_size_raid6, disks.raid6_size)):
+        return False
 
     # Finally, check for specials
-    if program_args.ipv4 and not server.specials.has_IPv4:
-        return None
-    if program_args.gpu and not server.specials.has_GPU:
-        return None
-    if program_args.inic and not server.specials.has_iNIC:
-        return None
-    if program_args.ecc and not server.ram_is_ecc:
-        return None
-    if program_args.hwr and not server.specials.has_HWR:
-        return None
+    if args.ipv4 and not server.specials.has_IPv4:
+        return False
+    if args.gpu and not server.specials.has_GPU:
+        return False
+    if args.inic and not server.specials.has_iNIC:
+        return False
+    if args.ecc and not server.ram_is_ecc:
+        return False
+    if args.hwr and not server.specials.has_HWR:
+        return False
 
-    return server
+    return True
 
 
 def hetzner_notify_format_disks(disks: list[int], kind: str) -> str:
     if not disks:
         return ""
 
-    return ", ".join(f"{disks.count(disk)}× {f'{round(disk / 1000, 1)}TB' if disk >= 1000 else f'{disk}GB'}" for disk in sorted(set(disks))) + f" ({kind})"
+    return ", ".join(f"{num}× {f'{round(disk / 1000, 1)}TB' if disk >= 1000 else f'{disk}GB'}" for disk, num in sorted(Counter(disks).items())) + f" ({kind})"
 
 
 def hetzner_notify_calculate_price_time_decrease(time_of_next_price_reduce: datetime | None) -> str:
     if time_of_next_price_reduce is None:
         return ""
 
-    time_left_in_s = int((time_of_next_price_reduce - datetime.now()).total_seconds())
+    time_left_in_s = int((time_of_next_price_reduce - clock.now()).total_seconds())
     hours_left = time_left_in_s // 3600
     minutes_left = (time_left_in_s // 60) % 60
 
@@ -415,13 +590,10 @@ def hetzner_notify_calculate_price_time_decrease(time_of_next_price_reduce: date
 
 # -/- Hetzner API ---
 
-T = TypeVar("T")
-U = TypeVar("U")
-KT = TypeVar("KT")
-
 startup()
+clock = Clock()
 program_args = parse_args()
 logger = create_logger(program_args.verbose)
 
-hetzner_ipv4_price = get_hetzner_ipv4_price()
+hetzner_prices = HetznerPrices()
 DEBUG_ASSERTS = program_args.debug
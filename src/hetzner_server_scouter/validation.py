@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+import random
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.db.parse_tables import PayloadError
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.settings import payload_validation_sample_rate, payload_anomalies_path
+from hetzner_server_scouter.utils import program_args, logger, clock
+
+
+@dataclass
+class PayloadAnomaly:
+    """A record of the auction that was skipped, as it failed the `check`"""
+    time: datetime
+    server_id: int | None
+    check: str
+    message: str
+
+    def to_json(self) -> str:
+        return json.dumps({"time": self.time.isoformat(), "server_id": self.server_id, "check": self.check, "message": self.message})
+
+
+def check_disks(server: Server, data: dict[str, Any]) -> None:
+    """The disks parsed from the `hdd_arr` have to be the same as the ones in the `serverDiskData`"""
+    disks, disk_data = server.disks, data["serverDiskData"]
+
+    if sorted(disk_data["hdd"]) != sorted(disks.get("hdd", []) + disks.get("enterprise_hdd", [])):
+        raise PayloadError("disks", f"The HDDs {disk_data['hdd']} don't match the hdd_arr {data['hdd_arr']}")
+    if sorted(disk_data["sata"] + disk_data["nvme"]) != sorted(disks.get("ssd", []) + disks.get("enterprise_ssd", [])):
+        raise PayloadError("disks", f"The SSDs {disk_data['sata'] + disk_data['nvme']} don't match the hdd_arr {data['hdd_arr']}")
+
+
+@dataclass
+class PayloadValidator:
+    """
+    Parses the records of the auction and checks them depending on `--validate`: "off", "sampled" (a random fraction of the records) or "full".
+    A record that can't be parsed or fails a check doesn't abort the run. It is skipped, counted and reported as an anomaly.
+    """
+    sample_rate: float = payload_validation_sample_rate
+    anomalies_path: Path | None = payload_anomalies_path
+    anomalies: deque[PayloadAnomaly] = field(default_factory=lambda: deque(maxlen=100))
+    rng: random.Random = field(default_factory=random.Random)
+
+    def should_check(self) -> bool:
+        match program_args.validate:
+            case "full":
+                return True
+            case "sampled":
+                return self.rng.random() < self.sample_rate
+            case _:
+                return False
+
+    def parse(self, data: dict[str, Any]) -> Server | None:
+        """The parsed server, or `None` if the record is skipped"""
+        try:
+            server = Server.parse(data)
+            if self.should_check():
+                metrics.count("payload_records_validated")
+                check_disks(server, data)
+
+        except PayloadError as ex:
+            self.report(data, ex.check, str(ex))
+            return None
+
+        except (KeyError, IndexError, TypeError, ValueError) as ex:
+            self.report(data, "parse", f"{type(ex).__name__}: {ex}")
+            return None
+
+        return server
+
+    def report(self, data: dict[str, Any], check: str, message: str) -> PayloadAnomaly:
+        anomaly = PayloadAnomaly(clock.now(), data.get("id"), check, message)
+        self.anomalies.append(anomaly)
+
+        metrics.count("payload_anomalies")
+        metrics.count(f"payload_anomalies_{check}")
+        logger.warning(f"Skipping the server {anomaly.server_id}, it failed the {check} check: {message}")
+
+        if self.anomalies_path is not None:
+            with self.anomalies_path.open("a") as f:
+                f.write(anomaly.to_json() + "\n")
+
+        return anomaly
+
+
+payload_validator = PayloadValidator()
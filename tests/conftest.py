@@ -1,11 +1,17 @@
 import copy
+import os
+import random
+from pathlib import Path
 from typing import Generator, Any
 
 from pytest import fixture
+from sqlalchemy import delete
 from sqlalchemy.orm import Session as DatabaseSession
 
 from hetzner_server_scouter.db.db_conf import DatabaseSessionMaker, init_database
-from hetzner_server_scouter.settings import get_hetzner_api
+from hetzner_server_scouter.db.models import Server, WatchedServer
+from hetzner_server_scouter.notifications.models import ServerChangeLog
+from hetzner_server_scouter.data_sources import make_data_source
 from hetzner_server_scouter.utils import startup, program_args
 
 
@@ -24,6 +30,31 @@ class MockProgramsArgs:
             setattr(program_args, k, getattr(self.prev_args, k))
 
 
+def make_server_data(server_id: int, price: float = 40, **kwargs: Any) -> dict[str, Any]:
+    """Creates the data of a single server in the format of the Hetzner API"""
+    return {
+        "id": server_id, "price": price, "fixed_price": False, "next_reduce_timestamp": 1700000000,
+        "datacenter": "FSN1-DC1", "cpu": "Intel Core i7-8700", "ram_size": 64, "ram": ["4x RAM 16384 MB DDR4"], "specials": ["ECC", "IPv4"],
+        "hdd_arr": ["2 TB Enterprise HDD", "2 TB Enterprise HDD", "512 GB SSD"], "serverDiskData": {"hdd": [2000, 2000], "sata": [512], "nvme": [], "general": []},
+    } | kwargs
+
+
+random_disks = [("2 TB Enterprise HDD", "hdd", 2000), ("4 TB HDD", "hdd", 4000), ("512 GB SSD", "sata", 512), ("1 TB NVMe SSD", "nvme", 1000)]
+
+
+def make_random_server_data(rng: random.Random, server_id: int) -> dict[str, Any]:
+    """Creates a server with random hardware, for testing the filters"""
+    server_disks = [rng.choice(random_disks)] * rng.randint(1, 4)
+    disk_data: dict[str, list[int]] = {"hdd": [], "sata": [], "nvme": [], "general": []}
+    for _, kind, size in server_disks:
+        disk_data[kind].append(size)
+
+    return make_server_data(
+        server_id, price=round(rng.uniform(25, 120), 2), ram_size=rng.choice([16, 32, 64, 128]), datacenter=rng.choice(["FSN1-DC1", "NBG1-DC3", "HEL1-DC2"]),
+        specials=[it for it in ["ECC", "IPv4", "GPU"] if rng.random() < 0.4], hdd_arr=[it[0] for it in server_disks], serverDiskData=disk_data,
+    )
+
+
 def pytest_configure() -> None:
     startup()
 
@@ -36,9 +67,21 @@ def db() -> Generator[DatabaseSession, None, None]:
         yield session
 
 
+@fixture
+def empty_db(db: DatabaseSession) -> DatabaseSession:
+    db.execute(delete(ServerChangeLog))
+    db.execute(delete(Server))
+    db.execute(delete(WatchedServer))
+    db.commit()
+
+    return db
+
+
 @fixture(scope="session")
 def data() -> Generator[dict[str, Any], None, None]:
-    data = get_hetzner_api()
-    assert data is not None
+    # Set `HSCOUT_TEST_SOURCE` to a recorded snapshot to run the tests offline
+    source = os.getenv("HSCOUT_TEST_SOURCE")
+    snapshot = make_data_source(Path(source) if source else None).latest()
+    assert snapshot is not None
 
-    yield data
+    yield snapshot.data
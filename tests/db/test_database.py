@@ -0,0 +1,296 @@
+import asyncio
+import random
+from functools import partial
+from itertools import count
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+from sqlalchemy import select, event, create_engine, text, inspect
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_server_data, make_random_server_data, MockProgramsArgs
+from hetzner_server_scouter.db.crud import (
+    read_server_snapshots, stream_server_changes, update_server_list, parse_server_list, read_matching_servers, apply_server_changes, add_to_watchlist, read_watchlist, remove_from_watchlist
+)
+from hetzner_server_scouter.db.db_utils import run_in_database_thread, database_transaction
+from hetzner_server_scouter.db.state_file import ServerStateFile, find_changed_ids
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.db.db_conf import database_engine, add_missing_columns, DataBase
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.db.parse_tables import DiskSummary
+from hetzner_server_scouter.db.parse_tables import ParseTables
+from hetzner_server_scouter.notifications.crud import process_changes
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog, ServerChangeType
+from hetzner_server_scouter.notifications import notify_telegram
+from hetzner_server_scouter.notifications.notify_telegram import telegram_notify_about_changes
+from hetzner_server_scouter.settings import Datacenters, pipeline_change_queue_size
+from hetzner_server_scouter.utils import run_concurrently, RateLimiter, filter_server, parse_filter_query, program_args
+
+
+def api_data(*servers: dict[str, Any]) -> dict[str, Any]:
+    return {"server": list(servers)}
+
+
+def test_server_dict_roundtrip() -> None:
+    server, = parse_server_list(api_data(make_server_data(1)))
+    assert Server.from_dict(server.to_dict()) == server
+    assert Server.from_dict(server.to_dict()).to_dict() == server.to_dict()
+
+
+def test_disk_summary() -> None:
+    server, = parse_server_list(api_data(make_server_data(1)))
+    assert server.disk_summary == DiskSummary(0, 2, 1, 0, 512, 2000, 4512, raid1_size=512, raid5_size=1024, raid6_size=None)
+    assert (server.disk_summary.num, server.disk_summary.num_quick, server.disk_summary.is_enterprise) == (3, 1, False)
+    assert Server.from_dict(server.to_dict()).disk_summary == server.disk_summary
+
+    no_disks = Server.parse(make_server_data(2, hdd_arr=[], serverDiskData={"hdd": [], "sata": [], "nvme": [], "general": []}))
+    assert no_disks.disk_summary == DiskSummary(0, 0, 0, 0, None, None, 0, None, None, None)
+
+
+def test_parse_tables() -> None:
+    tables = ParseTables(max_size=3)
+    first, second = (Server.parse(make_server_data(i, cpu="".join(["Intel ", "Core i7-8700"]))) for i in range(2))
+    assert first.disks is second.disks and first.disk_summary is second.disk_summary and first.cpu_name is second.cpu_name
+
+    assert tables.parse_disks(["4 TB HDD", "512 GB SSD"]).disks == {"hdd": [4000], "enterprise_hdd": [], "ssd": [512], "enterprise_ssd": []}
+    assert tables.datacenter("HEL1-DC2") == Datacenters.helsinki and tables.datacenter(None) is None
+    assert [tables.cores_of_cpu(it) for it in ["Intel Core i7-8700", "Intel Xeon E3-1275V6", "AMD Ryzen 7 PRO 1700X", "AMD EPYC 7502P", "Unknown CPU"]] == [6, 4, 8, 32, None]
+
+    # A full table is cleared instead of growing
+    for i in range(4):
+        tables.cpu_name(f"CPU {i}")
+    assert tables.cpu_names == {"CPU 3": "CPU 3"}
+
+
+def test_update_server_list(empty_db: DatabaseSession) -> None:
+    changes = update_server_list(empty_db, parse_server_list(api_data(make_server_data(1), make_server_data(2))))
+    assert [(it.kind, it.server_id) for it in changes] == [(ServerChangeType.new, 1), (ServerChangeType.new, 2)]
+
+    changes = update_server_list(empty_db, parse_server_list(api_data(make_server_data(1, price=30), make_server_data(3))))
+    assert [(it.kind, it.server_id) for it in changes] == [(ServerChangeType.price_changed, 1), (ServerChangeType.new, 3), (ServerChangeType.sold, 2)]
+    assert changes[0].attrs["price"] == 30
+
+    snapshots = read_server_snapshots(empty_db)
+    assert set(snapshots) == {1, 3}
+    assert snapshots[1]["price"] == 30
+
+    assert update_server_list(empty_db, parse_server_list(api_data(make_server_data(1, price=30), make_server_data(3)))) == []
+
+
+@pytest.mark.asyncio
+async def test_pipeline(empty_db: DatabaseSession) -> None:
+    async def run(*servers: dict[str, Any]) -> None:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue(maxsize=4)
+        await run_concurrently(stream_server_changes(empty_db, api_data(*servers), changes), process_changes(empty_db, changes))
+
+    await run(*(make_server_data(i) for i in range(100)))
+    await run(*(make_server_data(i, price=20 if i % 2 else 40) for i in range(50)))
+
+    logs = empty_db.execute(select(ServerChangeLog)).scalars().all()
+    assert sum(log.change.kind == ServerChangeType.new for log in logs) == 100
+    assert sum(log.change.kind == ServerChangeType.price_changed for log in logs) == 25
+    assert sum(log.change.kind == ServerChangeType.sold for log in logs) == 50
+    assert set(read_server_snapshots(empty_db)) == set(range(50))
+
+
+@pytest.mark.parametrize("query", [
+    {}, {"price": ["60"]}, {"price": ["60"], "tax": ["0"]}, {"cpu": ["i7"], "ram": ["64"], "ecc": [""]}, {"datacenter": ["FSN,HEL"], "disk_size": ["1000"]},
+    {"disk_size_exact": ["2000"], "ipv4": ["1"]}, {"disk_size_any": ["3000"], "disk_num_quick": ["2"]}, {"disk_size_raid0": ["8000"], "price": ["90"]},
+    {"disk_size_raid1": ["4000"], "gpu": ["true"]}, {"disk_size_raid5": ["1000"]}, {"disk_size_redundant": ["3000"], "disk_enterprise": [""]}, {"disk_num": ["3"], "disk_size_raid6": ["500"]},
+])
+def test_filter_pushdown(empty_db: DatabaseSession, query: dict[str, list[str]]) -> None:
+    rng = random.Random(0)
+    with MockProgramsArgs(store_all=True):
+        update_server_list(empty_db, parse_server_list(api_data(*(make_random_server_data(rng, i) for i in range(300)))))
+
+    args = parse_filter_query(query, program_args)
+    servers = [Server.from_dict(it) for it in read_server_snapshots(empty_db).values()]
+    assert len(servers) == 300
+    assert sorted(it.id for it in read_matching_servers(empty_db, args)) == sorted(it.id for it in servers if filter_server(it, args) is not None)
+
+
+@pytest.mark.asyncio
+async def test_pipeline_store_all(empty_db: DatabaseSession) -> None:
+    async def run(*servers: dict[str, Any]) -> list[tuple[ServerChangeType, int]]:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+        num_logs = len(empty_db.execute(select(ServerChangeLog)).scalars().all())
+        await run_concurrently(stream_server_changes(empty_db, api_data(*servers), changes), process_changes(empty_db, changes, print_changes=False))
+        return [(it.change.kind, it.server_id) for it in empty_db.execute(select(ServerChangeLog).order_by(ServerChangeLog.id)).scalars().all()[num_logs:]]
+
+    with MockProgramsArgs(store_all=True, price=60, tax=0):
+        assert await run(make_server_data(1, price=40), make_server_data(2, price=70), make_server_data(3, price=80)) == [(ServerChangeType.new, 1)]
+        assert set(read_server_snapshots(empty_db)) == {1, 2, 3}
+
+        # Moving into and out of the filters is notified as if only the matching servers were stored
+        assert await run(make_server_data(1, price=65), make_server_data(2, price=50), make_server_data(3, price=75)) == [(ServerChangeType.sold, 1), (ServerChangeType.new, 2)]
+
+    # Changing the filters doesn't make the already stored servers appear as new
+    with MockProgramsArgs(store_all=True, price=100, tax=0):
+        assert await run(make_server_data(1, price=65), make_server_data(2, price=50), make_server_data(3, price=75)) == []
+        assert await run(make_server_data(1, price=65), make_server_data(2, price=50)) == [(ServerChangeType.sold, 3)]
+
+
+def test_add_missing_columns(tmp_path: Path) -> None:
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE servers (id INTEGER PRIMARY KEY, price FLOAT NOT NULL)"))
+
+    added = add_missing_columns(engine, DataBase.metadata)
+    assert "servers.total_price" in added and "servers.price" not in added
+    assert {it["name"] for it in inspect(engine).get_columns("servers")} == {it.name for it in Server.__table__.columns}
+    assert "ix_servers_ipv4_price" in {it["name"] for it in inspect(engine).get_indexes("servers")}
+    assert add_missing_columns(engine, DataBase.metadata) == []
+
+
+def test_state_file_records(tmp_path: Path) -> None:
+    state = ServerStateFile(tmp_path / "state.bin")
+    state.write([(5, 50.0), (1, 10.0), (3, 30.5)])
+
+    prices = state.read()
+    assert prices is not None and list(prices) == [(1, 10.0), (3, 30.5), (5, 50.0)]
+    assert [prices.get(it) for it in range(7)] == [None, 10.0, None, 30.5, None, 50.0, None]
+    assert find_changed_ids(prices, [(0, 1.0), (1, 10.0), (3, 31.0), (4, 1.0)]) == [3, 5]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_state_file(empty_db: DatabaseSession, tmp_path: Path) -> None:
+    state = ServerStateFile(tmp_path / "state.bin")
+
+    async def run(*servers: dict[str, Any]) -> list[tuple[ServerChangeType, int, float]]:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+        found: list[tuple[ServerChangeType, int, float]] = []
+
+        async def collect(db: DatabaseSession, changes: asyncio.Queue[ServerChange | None]) -> None:
+            while (it := await changes.get()) is not None:
+                found.append((it.kind, it.server_id, it.attrs["price"]))
+                update_server_list_changes.append(it)
+
+            await run_in_database_thread(lambda: database_transaction(db, lambda: apply_server_changes(db, update_server_list_changes)))
+
+        update_server_list_changes: list[ServerChange] = []
+        await run_concurrently(stream_server_changes(empty_db, api_data(*servers), changes, state), collect(empty_db, changes))
+        state.commit()
+        return found
+
+    metrics.reset()
+    assert await run(*(make_server_data(i) for i in range(100))) == [(ServerChangeType.new, i, 40) for i in range(100)]
+    assert metrics.counters["state_file_misses"] == 1
+
+    # Only the rows of the changed and sold servers are loaded
+    metrics.reset()
+    changes = await run(*(make_server_data(i, price=30 if i == 7 else 40) for i in range(1, 101)))
+    assert changes == [(ServerChangeType.price_changed, 7, 30), (ServerChangeType.new, 100, 40), (ServerChangeType.sold, 0, 40)]
+    assert metrics.counters["state_file_hits"] == 1 and metrics.counters["state_file_rows_loaded"] == 2
+
+    # A change of the database that the state file doesn't know about makes it stale
+    update_server_list(empty_db, parse_server_list(api_data(*(make_server_data(i, price=30 if i == 7 else 40) for i in range(1, 100)))))
+    metrics.reset()
+    assert await run(*(make_server_data(i, price=30 if i == 7 else 40) for i in range(1, 101))) == [(ServerChangeType.new, 100, 40)]
+    assert metrics.counters["state_file_misses"] == 1
+
+
+class FakeMessage:
+    def __init__(self, message_id: int) -> None:
+        self.message_id = message_id
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.message_ids = count(1)
+        self.sent: list[dict[str, Any]] = []
+
+    async def send_message(self, **kwargs: Any) -> FakeMessage:
+        self.sent.append(kwargs)
+        return FakeMessage(next(self.message_ids))
+
+
+@pytest.fixture
+def count_queries() -> Iterator[list[str]]:
+    queries: list[str] = []
+
+    def listener(*args: Any) -> None:
+        queries.append(args[2])
+
+    event.listen(database_engine, "before_cursor_execute", listener)
+    yield queries
+    event.remove(database_engine, "before_cursor_execute", listener)
+
+
+@pytest.mark.asyncio
+async def test_notifications_query_count(empty_db: DatabaseSession, count_queries: list[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "1")
+    monkeypatch.setattr(notify_telegram, "RateLimiter", lambda **_: RateLimiter(rate_s=1000, rate_m=1000))
+
+    async def run(bot: FakeBot, *servers: dict[str, Any]) -> None:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+        count_queries.clear()
+        await run_concurrently(stream_server_changes(empty_db, api_data(*servers), changes), process_changes(empty_db, changes, partial(telegram_notify_about_changes, bot=bot)))
+
+    num_queries = []
+    for num_servers in [5, 20]:
+        bot = FakeBot()
+        await run(bot, *(make_server_data(i) for i in range(num_servers)))
+        await run(bot, *(make_server_data(i, price=30) for i in range(num_servers)))
+        num_queries.append(len(count_queries))
+
+        # Only the servers are read once, the notifications never load anything and the message ids are written with a single UPDATE
+        assert sum(it.startswith("SELECT") for it in count_queries) == 1
+        assert sum(it.startswith("UPDATE servers SET last_message_id") for it in count_queries) == 1
+
+        # The price changes are replies to the messages of the new servers
+        assert [it["reply_to_message_id"] for it in bot.sent] == [None] * num_servers + list(range(1, num_servers + 1))
+        assert {it["last_message_id"] for it in read_server_snapshots(empty_db).values()} == set(range(num_servers + 1, 2 * num_servers + 1))
+
+        await run(bot)
+
+    # Both runs fit into the same number of batches, so the number of queries must not depend on the number of changes
+    assert num_queries[0] == num_queries[1]
+
+
+@pytest.mark.asyncio
+async def test_watchlist(empty_db: DatabaseSession, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "1")
+    monkeypatch.setattr(notify_telegram, "RateLimiter", lambda **_: RateLimiter(rate_s=1000, rate_m=1000))
+
+    class SlowBot(FakeBot):
+        async def send_message(self, **kwargs: Any) -> FakeMessage:
+            await asyncio.sleep(0.01)
+            return await super().send_message(**kwargs)
+
+    async def run(bot: FakeBot, *servers: dict[str, Any]) -> list[tuple[ServerChangeType, int]]:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue(maxsize=pipeline_change_queue_size)
+        num_logs = len(empty_db.execute(select(ServerChangeLog)).scalars().all())
+        await run_concurrently(stream_server_changes(empty_db, api_data(*servers), changes, watchlist=read_watchlist(empty_db)), process_changes(empty_db, changes, partial(telegram_notify_about_changes, bot=bot), print_changes=False))
+        return [(it.change.kind, it.server_id) for it in empty_db.execute(select(ServerChangeLog).order_by(ServerChangeLog.id)).scalars().all()[num_logs:]]
+
+    add_to_watchlist(empty_db, [1000, 1000, 2000])
+    assert read_watchlist(empty_db) == {1000, 2000}
+
+    with MockProgramsArgs(price=50, tax=0):
+        # The watched server doesn't match the filters and comes last, but its message overtakes the ones that wait to be sent
+        bot = SlowBot()
+        assert sorted(await run(bot, *(make_server_data(i, price=40) for i in range(50)), make_server_data(1000, price=90))) == [(ServerChangeType.new, i) for i in [*range(50), 1000]]
+        assert any("watched server <a href='https://www.hetzner.com/sb/#search=1000'>1000</a>" in it["text"] for it in bot.sent[:10])
+        assert set(read_server_snapshots(empty_db)) == set(range(50)) | {1000}
+
+        assert await run(bot, *(make_server_data(i, price=40) for i in range(50)), make_server_data(1000, price=85)) == [(ServerChangeType.price_changed, 1000)]
+        assert await run(bot, *(make_server_data(i, price=40) for i in range(50))) == [(ServerChangeType.sold, 1000)]
+
+        # Once it is unwatched, a server that doesn't match the filters is dropped silently instead of being reported as sold in the next run
+        add_to_watchlist(empty_db, [3000])
+        assert await run(bot, *(make_server_data(i, price=40) for i in range(50)), make_server_data(3000, price=90)) == [(ServerChangeType.new, 3000)]
+        remove_from_watchlist(empty_db, [3000, 1])
+        assert set(read_server_snapshots(empty_db)) == set(range(50))
+        assert await run(bot, *(make_server_data(i, price=40) for i in range(50)), make_server_data(3000, price=90)) == []
+
+        # With `--store-all`, the filters don't decide about the watched servers either
+        remove_from_watchlist(empty_db, [2000])
+        with MockProgramsArgs(store_all=True):
+            assert await run(bot, *(make_server_data(i, price=40) for i in range(50)), make_server_data(1000, price=90), make_server_data(2000, price=90)) == [(ServerChangeType.new, 1000)]
+
+            # In a refresh with far more changes than fit into the queues, the watched change still comes first and is sent first
+            num_sent, new_ids = len(bot.sent), range(10_000, 10_000 + 4 * pipeline_change_queue_size)
+            logs = await run(bot, *(make_server_data(i, price=40) for i in [*range(50), *new_ids]), make_server_data(1000, price=80), make_server_data(2000, price=90))
+            assert logs == [(ServerChangeType.price_changed, 1000)] + [(ServerChangeType.new, i) for i in new_ids]
+            assert "watched server <a href='https://www.hetzner.com/sb/#search=1000'>1000</a>" in bot.sent[num_sent]["text"]
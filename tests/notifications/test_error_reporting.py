@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from hetzner_server_scouter.notifications.error_reporting import ErrorReporter, exception_signature
+
+
+def raise_flood_error(seconds: int) -> None:
+    raise RuntimeError(f"Flood control exceeded. Retry in {seconds} seconds")
+
+
+def catch(func: object, *args: int) -> Exception:
+    try:
+        func(*args)  # type:ignore[operator]
+    except Exception as ex:
+        return ex
+
+    assert False, "The function did not raise"
+
+
+def test_exception_signature_ignores_message() -> None:
+    assert exception_signature(catch(raise_flood_error, 12)) == exception_signature(catch(raise_flood_error, 13))
+    assert exception_signature(catch(raise_flood_error, 12)) != exception_signature(catch(lambda: 1 / 0))
+
+
+@pytest.mark.asyncio
+async def test_error_reporter_aggregates() -> None:
+    sent: list[str] = []
+
+    async def send(text: str) -> None:
+        sent.append(text)
+
+    reporter = ErrorReporter(send, window_s=3600)
+    for i in range(10):
+        reporter.report(catch(raise_flood_error, i))
+    reporter.report(catch(lambda: 1 / 0))
+
+    # Reporting must not send anything by itself
+    await asyncio.sleep(0)
+    assert sent == []
+
+    await reporter.close()
+    assert len(sent) == 1
+    assert "11 unexpected error(s) of 2 kind(s)" in sent[0]
+    assert "10× RuntimeError: Flood control exceeded. Retry in 9 seconds" in sent[0]
+    assert "1× ZeroDivisionError" in sent[0]
+    assert len(sent[0]) <= 4096
+
+
+@pytest.mark.asyncio
+async def test_error_reporter_survives_failing_send() -> None:
+    async def send(text: str) -> None:
+        raise ConnectionError("Telegram is down")
+
+    reporter = ErrorReporter(send, window_s=3600)
+    reporter.report(catch(lambda: 1 / 0))
+    await reporter.close()
+
+    assert reporter.pending == {}
+
+
+@pytest.mark.asyncio
+async def test_error_reporter_summary_format() -> None:
+    sent: list[str] = []
+
+    async def send(text: str) -> None:
+        sent.append(text)
+
+    reporter = ErrorReporter(send, window_s=3600)
+    reporter.report(KeyError("next_reduce_timestamp"))
+    next(iter(reporter.pending.values())).traceback = "Traceback\n" + "x" * 10_000
+    await reporter.close()
+
+    # The markdown of Telegram would trip over the `_` and `*` of the errors, so all of it is inside a single, closed code block
+    assert sent[0].startswith("```\n") and sent[0].endswith("```") and sent[0].count("```") == 2
+    assert "1× KeyError: 'next_reduce_timestamp'" in sent[0] and len(sent[0]) <= 4096
+
+
+@pytest.mark.asyncio
+async def test_error_reporter_close_finishes_sending() -> None:
+    sent: list[str] = []
+    is_sending = asyncio.Event()
+
+    async def send(text: str) -> None:
+        is_sending.set()
+        await asyncio.sleep(0.05)
+        sent.append(text)
+
+    reporter = ErrorReporter(send, window_s=0.01)
+    reporter.report(catch(lambda: 1 / 0))
+    await is_sending.wait()
+
+    # The summary of the window is already being sent when the reporter is closed
+    reporter.report(catch(raise_flood_error, 1))
+    await reporter.close()
+    assert len(sent) == 2 and "ZeroDivisionError" in sent[0] and "RuntimeError" in sent[1]
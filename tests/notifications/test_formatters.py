@@ -0,0 +1,79 @@
+import asyncio
+import json
+from functools import partial
+from typing import Any
+
+import pytest
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_server_data
+from hetzner_server_scouter.db.crud import stream_server_changes
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.notifications import models, notify_telegram
+from hetzner_server_scouter.notifications.crud import process_changes
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType, ServerChangeMessage, message_formatters, register_formatter
+from hetzner_server_scouter.notifications.notify_telegram import telegram_notify_about_changes
+from hetzner_server_scouter.utils import run_concurrently, RateLimiter
+
+
+def make_change(kind: ServerChangeType = ServerChangeType.new) -> ServerChange:
+    return ServerChange(kind, 1, None, Server.parse(make_server_data(1, specials=["IPv4", "GPU"])).to_dict())
+
+
+def test_formatters() -> None:
+    change = make_change()
+    assert set(message_formatters) >= {"console", "telegram", "markdown", "json", "webhook"}
+
+    assert "<b>Price</b>" in (change.render("telegram") or "")
+    assert "[1](https://www.hetzner.com/sb/#search=1)" in (change.render("markdown") or "") and "- GPU: ✓" in (change.render("markdown") or "")
+    assert json.loads(change.render("json") or "")["specs"][0] == "CPU: Intel Core i7-8700"
+    assert json.loads(change.render("webhook") or "")["text"] == change.render("markdown")
+
+    sold = make_change(ServerChangeType.sold)
+    assert (sold.render("markdown") or "").startswith("The server [1](https://www.hetzner.com/sb/#search=1) was sold for")
+
+
+def test_rendered_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[int] = []
+
+    def plain(message: ServerChangeMessage) -> str:
+        calls.append(message.server_id)
+        return f"{message.server_id}: {message.price:.2f}€"
+
+    monkeypatch.setattr(models, "message_formatters", message_formatters.copy())
+    register_formatter("plain", plain)
+
+    change = make_change()
+    assert change.to_message() is change.to_message()
+    assert change.render("plain") == change.render("plain") == f"1: {change.to_message().price:.2f}€" and calls == [1]  # type:ignore[union-attr]
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def send_message(self, text: str, **_: Any) -> Any:
+        self.sent.append(text)
+        return type("Message", (), {"message_id": len(self.sent)})
+
+
+@pytest.mark.asyncio
+async def test_message_shared_by_consumers(empty_db: DatabaseSession, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("TELEGRAM_CHAT_ID", "1")
+    monkeypatch.setattr(notify_telegram, "RateLimiter", lambda **_: RateLimiter(rate_s=1000, rate_m=1000))
+
+    built: list[int] = []
+    build_message = ServerChange.build_message
+
+    def counted_build_message(self: ServerChange) -> ServerChangeMessage | None:
+        built.append(self.server_id)
+        return build_message(self)
+
+    monkeypatch.setattr(ServerChange, "build_message", counted_build_message)
+
+    # The console and Telegram both render every change, but its message is only built once
+    bot = FakeBot()
+    changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+    await run_concurrently(stream_server_changes(empty_db, {"server": [make_server_data(i) for i in range(5)]}, changes), process_changes(empty_db, changes, partial(telegram_notify_about_changes, bot=bot)))
+
+    assert len(bot.sent) == 5 and sorted(built) == list(range(5))
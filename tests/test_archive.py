@@ -0,0 +1,91 @@
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from conftest import make_server_data
+from hetzner_server_scouter.archive import ArchiveEntry, SnapshotArchive, encode_delta, apply_delta
+from hetzner_server_scouter.data_sources import Snapshot, make_data_source
+
+start = datetime(2024, 1, 1, 12)
+
+
+def make_snapshots(num: int) -> list[Snapshot]:
+    rng = random.Random(0)
+    servers = {i: make_server_data(i, price=rng.randint(30, 100)) for i in range(50)}
+    snapshots = []
+
+    for i in range(num):
+        for server_id in rng.sample(sorted(servers), 3):
+            servers[server_id] = servers[server_id] | {"price": servers[server_id]["price"] - 1}
+        for server_id in rng.sample(sorted(servers), 2):
+            del servers[server_id]
+        for server_id in range(100 + 2 * i, 102 + 2 * i):
+            servers[server_id] = make_server_data(server_id)
+
+        snapshots.append(Snapshot(start + timedelta(hours=i), {"server": list(servers.values()), "serverCount": len(servers)}))
+
+    return snapshots
+
+
+def test_delta_roundtrip() -> None:
+    a, b = make_snapshots(2)
+    assert apply_delta(a.data, encode_delta(a.data, b.data)) == b.data
+
+    # The order of the servers is kept, even if it can't be derived
+    shuffled = b.data | {"server": list(reversed(b.data["server"]))}
+    assert apply_delta(a.data, encode_delta(a.data, shuffled)) == shuffled
+
+    # Removed fields are restored
+    without_field = b.data | {"server": [{k: v for k, v in it.items() if k != "specials"} for it in b.data["server"]]}
+    assert apply_delta(a.data, encode_delta(a.data, without_field)) == without_field
+
+
+def test_archive(tmp_path: Path) -> None:
+    snapshots = make_snapshots(20)
+    archive = SnapshotArchive(tmp_path, keyframe_interval=6)
+
+    for snapshot in snapshots:
+        archive.append(snapshot)
+
+    # Appending an older snapshot is ignored
+    assert archive.append(snapshots[3]) is None
+
+    assert [it.is_keyframe for it in archive.entries()] == [i % 6 == 0 for i in range(20)]
+    assert list(archive.snapshots()) == snapshots
+    assert archive.latest() == snapshots[-1]
+    assert list(archive.snapshots(start=snapshots[8].time, end=snapshots[13].time)) == snapshots[8:14]
+
+    assert archive.at(snapshots[9].time + timedelta(minutes=30)) == snapshots[9]
+    assert archive.at(start - timedelta(hours=1)) is None
+
+    assert isinstance(make_data_source(tmp_path), SnapshotArchive)
+
+
+def test_archive_latest_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    snapshots = make_snapshots(8)
+    archive = SnapshotArchive(tmp_path, keyframe_interval=6)
+    archive.append(snapshots[0])
+
+    # Appending a delta uses the cached previous snapshot instead of decoding the segment
+    decoded: list[int] = []
+    decode = archive.decode
+
+    def counted_decode(entries: list[ArchiveEntry]) -> Iterator[Snapshot]:
+        decoded.append(len(entries))
+        return decode(entries)
+
+    monkeypatch.setattr(archive, "decode", counted_decode)
+
+    for snapshot in snapshots[1:4]:
+        archive.append(snapshot)
+    assert decoded == []
+
+    # Without a matching cache, the previous snapshot is decoded as before
+    archive.latest_path.unlink()
+    for snapshot in snapshots[4:]:
+        archive.append(snapshot)
+
+    assert decoded == [4] and list(archive.snapshots()) == snapshots
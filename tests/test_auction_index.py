@@ -0,0 +1,46 @@
+import json
+import random
+from datetime import datetime
+
+import pytest
+
+from conftest import make_random_server_data
+from hetzner_server_scouter.auction_index import AuctionIndex, AuctionApi
+from hetzner_server_scouter.data_sources import Snapshot
+from hetzner_server_scouter.utils import filter_server, parse_filter_query, program_args
+
+
+@pytest.fixture(scope="module")
+def snapshot() -> Snapshot:
+    rng = random.Random(0)
+    return Snapshot(datetime(2024, 1, 1, 12), {"server": [make_random_server_data(rng, i) for i in range(300)]})
+
+
+@pytest.mark.parametrize("query", [
+    {}, {"price": ["60"]}, {"price": ["60"], "tax": ["0"]}, {"ram": ["64"], "ecc": [""]}, {"datacenter": ["FSN,HEL"], "disk_size": ["1000"]},
+    {"disk_size_exact": ["2000"], "ipv4": ["1"]}, {"disk_size_raid0": ["8000"], "price": ["90"]}, {"disk_size_raid1": ["4000"], "gpu": ["true"]},
+])
+def test_query_matches_filter(snapshot: Snapshot, query: dict[str, list[str]]) -> None:
+    index = AuctionIndex.build(snapshot)
+    args = parse_filter_query(query, program_args)
+
+    expected = sorted((it.id for it in index.servers if filter_server(it, args) is not None))
+    assert sorted(it.id for it in index.query(args)) == expected
+
+
+@pytest.mark.asyncio
+async def test_api(snapshot: Snapshot) -> None:
+    api = AuctionApi(program_args)
+    assert api.servers({})[0] == "503 Service Unavailable"
+
+    await api.update(snapshot)
+    status, _, body = api.servers({"price": ["60"], "limit": ["5"]})
+    response = json.loads(body)
+
+    assert status == "200 OK"
+    assert len(response["servers"]) == 5 and response["count"] > 5
+    assert [it["total_price"] for it in response["servers"]] == sorted(it["total_price"] for it in response["servers"])
+
+    assert api.servers({"unknown": ["1"]})[0] == "400 Bad Request"
+    assert api.servers({"price": ["cheap"]})[0] == "400 Bad Request"
+    assert api.servers({"limit": ["-1"]})[0] == "400 Bad Request"
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from conftest import make_server_data
+from hetzner_server_scouter.backtest import backtest_filters
+from hetzner_server_scouter.data_sources import Snapshot
+from hetzner_server_scouter.notifications.models import ServerChangeType
+from hetzner_server_scouter.utils import parse_filter_variant, program_args
+
+start = datetime(2024, 1, 1, 12)
+
+
+def make_server(server_id: int, price: float, ram_size: int = 64) -> dict[str, object]:
+    return make_server_data(server_id, price, ram_size=ram_size, specials=["ECC"])
+
+
+def make_snapshots() -> list[Snapshot]:
+    servers = [
+        [make_server(1, 40), make_server(2, 60), make_server(3, 50, ram_size=32)],
+        [make_server(1, 40), make_server(2, 45), make_server(3, 50, ram_size=32), make_server(4, 40)],
+        [make_server(2, 45), make_server(3, 50, ram_size=32), make_server(4, 38)],
+        [make_server(2, 45), make_server(3, 50, ram_size=32)],
+    ]
+
+    return [Snapshot(start + timedelta(hours=i), {"server": it}) for i, it in enumerate(servers)]
+
+
+def test_backtest() -> None:
+    variants = {it: parse_filter_variant(it, program_args) for it in ["--tax 0 --price 50", "--tax 0 --price 50 --ram 64", "--tax 0 --price 42"]}
+    result = backtest_filters(make_snapshots(), variants)
+    first, second, third = result.variants
+
+    assert result.snapshots == 4
+    assert [it.initial_matches for it in result.variants] == [2, 1, 1]
+
+    assert first.alerts == {ServerChangeType.new: 2, ServerChangeType.price_changed: 1, ServerChangeType.sold: 2}
+    assert second.alerts == {ServerChangeType.new: 2, ServerChangeType.price_changed: 1, ServerChangeType.sold: 2}
+    assert third.alerts == {ServerChangeType.new: 1, ServerChangeType.price_changed: 1, ServerChangeType.sold: 2}
+
+    # Only server 4 was listed during the backtest, the sale of server 1 has no known listing time
+    assert first.times_to_sale == [timedelta(hours=2)]
+    assert set(first.matches) == {2, 3}
+    assert set(second.matches) == {2}
+    assert set(third.matches) == set()
+
+
+def test_parse_filter_variant() -> None:
+    base = parse_filter_variant("--ram 64 --ecc", program_args)
+    variant = parse_filter_variant("--price 50 --datacenter FSN HEL", base)
+
+    assert (variant.price, variant.ram, variant.ecc, variant.datacenter) == (50, 64, True, ["FSN", "HEL"])
+    assert program_args.ram is None
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any
+from xml.etree import ElementTree
+
+import pytest
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_server_data
+from hetzner_server_scouter import change_feed as change_feed_module
+from hetzner_server_scouter.change_feed import ChangeFeed, FeedEntry, feed_files
+from hetzner_server_scouter.db.crud import stream_server_changes
+from hetzner_server_scouter.notifications.crud import process_changes, discard_changes, read_change_logs
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLogRecord, ServerChangeMessage
+from hetzner_server_scouter.utils import run_concurrently
+
+atom = "{http://www.w3.org/2005/Atom}"
+
+
+async def run(db: DatabaseSession, *servers: dict[str, Any]) -> list[ServerChangeLogRecord]:
+    changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+    logged: list[ServerChangeLogRecord] = []
+    await run_concurrently(stream_server_changes(db, {"server": list(servers)}, changes), process_changes(db, changes, discard_changes, print_changes=False, logged=logged))
+    return logged
+
+
+def update_feed(db: DatabaseSession, directory: Path) -> ChangeFeed:
+    feed = ChangeFeed.load(directory)
+    feed.update(read_change_logs(db, feed.last_id, 100))
+    return feed
+
+
+@pytest.mark.asyncio
+async def test_change_feed(empty_db: DatabaseSession, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(change_feed_module, "change_feed_size", 4)
+
+    await run(empty_db, *(make_server_data(i) for i in range(3)))
+    feed = update_feed(empty_db, tmp_path)
+    assert [it.id for it in feed.entries] == sorted((it.id for it in feed.entries), reverse=True)
+    ids = [it.id for it in feed.entries]
+
+    # Only the new changes are rendered, the stored ones are reused
+    rendered, render = [], FeedEntry.render
+
+    def counted_render(log: ServerChangeLogRecord) -> FeedEntry | None:
+        rendered.append(log.id)
+        return render(log)
+
+    monkeypatch.setattr(FeedEntry, "render", counted_render)
+    await run(empty_db, make_server_data(0, price=30), make_server_data(1, price=30), make_server_data(2))
+    feed = update_feed(empty_db, tmp_path)
+    assert len(rendered) == 2 and [it.id for it in feed.entries] == sorted(rendered, reverse=True) + ids[:2]
+
+    # Nothing changed
+    rendered.clear()
+    assert update_feed(empty_db, tmp_path).entries == feed.entries and rendered == []
+
+
+@pytest.mark.asyncio
+async def test_change_feed_reuses_logs(empty_db: DatabaseSession, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    await run(empty_db, make_server_data(0))
+    feed = ChangeFeed.load(tmp_path)
+    logged = await run(empty_db, make_server_data(0, price=30), make_server_data(1), make_server_data(2))
+
+    # The logs of this run are used as they are, only the older one is read from the database
+    logs = read_change_logs(empty_db, feed.last_id, 100, logged)
+    assert [it.id for it in logs] == list(range(1, 5)) and all(a is b for a, b in zip(logs[1:], logged))
+    assert read_change_logs(empty_db, 0, 2, logged) == logged[1:] and read_change_logs(empty_db, 2, 100, logged) == logged[1:]
+
+    # The messages that the notifiers already built are rendered into the feed without building them again
+    built: list[int] = []
+    build_message = ServerChange.build_message
+
+    def counted_build_message(self: ServerChange) -> ServerChangeMessage | None:
+        built.append(self.server_id)
+        return build_message(self)
+
+    for log in logged:
+        log.change.to_message()
+
+    monkeypatch.setattr(ServerChange, "build_message", counted_build_message)
+    assert feed.update(logs) == 4 and built == [0]
+
+
+@pytest.mark.asyncio
+async def test_change_feed_files(empty_db: DatabaseSession, tmp_path: Path) -> None:
+    await run(empty_db, make_server_data(1), make_server_data(2, price=30))
+    await run(empty_db, make_server_data(1, price=35), make_server_data(2, price=30))
+    update_feed(empty_db, tmp_path)
+
+    entries = ElementTree.parse(tmp_path / feed_files["atom"]).getroot().findall(f"{atom}entry")
+    assert len(entries) == 3
+    assert "price" in (entries[0].findtext(f"{atom}title") or "") and "<br>" in (entries[0].findtext(f"{atom}content") or "")
+
+    items = json.loads((tmp_path / feed_files["json"]).read_text())["items"]
+    assert [it["id"] for it in items] == [it.findtext(f"{atom}id") for it in entries]
+    assert items[-1]["url"].endswith("1") and "content_text" in items[-1]
+
+    assert (tmp_path / feed_files["html"]).read_text().count("<article") == 3
+    assert not list(tmp_path.glob(".*.tmp"))
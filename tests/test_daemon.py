@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from hetzner_server_scouter.daemon import MetricsExposition, HttpServer, run_daemon
+from hetzner_server_scouter.metrics import metrics
+
+
+async def http_get(port: int, target: str) -> tuple[str, str]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+
+    response = (await reader.read()).decode()
+    writer.close()
+
+    head, body = response.split("\r\n\r\n", 1)
+    return head.split("\r\n")[0], body
+
+
+@pytest.mark.asyncio
+async def test_daemon_metrics() -> None:
+    exposition = MetricsExposition(metrics)
+    server = HttpServer({"/metrics": exposition.response}, "127.0.0.1", 0)
+    scrapes: list[tuple[str, str]] = []
+
+    async def poll() -> bool:
+        with metrics.span("fetch"):
+            await asyncio.sleep(0.01)
+
+        metrics.count("servers_seen", 100)
+        metrics.count("servers_matched", 7)
+
+        # The endpoint is served on the same loop while a cycle runs
+        scrapes.append(await http_get(server.port, "/metrics"))
+        return len(scrapes) != 2
+
+    await run_daemon(poll, 0, exposition, server, max_cycles=3)
+
+    # The text is rendered at the end of a cycle, so the first scrape sees nothing of the first cycle
+    assert all(status == "HTTP/1.1 200 OK" for status, _ in scrapes)
+    assert "hscout_cycles_total 0" in scrapes[0][1]
+    assert "hscout_servers_in_auction 100" in scrapes[1][1] and "hscout_servers_matching 7" in scrapes[1][1]
+
+    # The histograms are cumulative, while the other metrics are reset every cycle
+    last = exposition.text.decode()
+    assert "hscout_cycles_total 3" in last and "hscout_failed_cycles_total 1" in last
+    assert "hscout_fetch_latency_seconds_count 3" in last
+    assert 'hscout_fetch_latency_seconds_bucket{le="+Inf"} 3' in last
+    assert "hscout_cycle_duration_seconds_count 3" in last
+
+
+@pytest.mark.asyncio
+async def test_http_server_not_found() -> None:
+    server = HttpServer({"/metrics": MetricsExposition(metrics).response}, "127.0.0.1", 0)
+    await server.start()
+
+    try:
+        status, _ = await http_get(server.port, "/")
+        assert status == "HTTP/1.1 404 Not Found"
+    finally:
+        await server.stop()
@@ -0,0 +1,75 @@
+import asyncio
+import csv
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_server_data
+from hetzner_server_scouter import export as export_module
+from hetzner_server_scouter.db.crud import stream_server_changes
+from hetzner_server_scouter.export import export, read_change_chunks, export_columns
+from hetzner_server_scouter.notifications.crud import process_changes, discard_changes
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog
+from hetzner_server_scouter.utils import run_concurrently
+
+
+async def run(db: DatabaseSession, *servers: dict[str, Any]) -> None:
+    changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+    await run_concurrently(stream_server_changes(db, {"server": list(servers)}, changes), process_changes(db, changes, discard_changes, print_changes=False))
+
+
+@pytest.mark.asyncio
+async def test_export_servers(empty_db: DatabaseSession, tmp_path: Path) -> None:
+    await run(empty_db, make_server_data(1), make_server_data(2, price=30, cpu="Unknown CPU"))
+    assert export(empty_db, "servers", tmp_path / "servers.csv", "csv") == (2, None)
+
+    with (tmp_path / "servers.csv").open() as f:
+        rows = list(csv.DictReader(f))
+
+    assert [it["id"] for it in rows] == ["1", "2"]
+    assert list(rows[0]) == list(export_columns["servers"])
+    assert rows[0]["disks_enterprise_hdd"] == "2000 2000" and rows[0]["disks_hdd"] == "" and rows[0]["has_ipv4"] == "True"
+    assert rows[0]["cpu_cores"] == "6" and rows[1]["cpu_cores"] == ""
+    assert rows[0]["time_of_next_price_reduce"] == datetime.fromtimestamp(1700000000).isoformat()
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_export_changes_incrementally(empty_db: DatabaseSession, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(export_module, "export_chunk_size", 2)
+
+    await run(empty_db, *(make_server_data(i) for i in range(5)))
+    await run(empty_db, *(make_server_data(i, price=30) for i in range(3)))
+    assert [len(it) for it in read_change_chunks(empty_db)] == [2] * 5
+
+    num_rows, last_id = export(empty_db, "changes", tmp_path / "changes.jsonl", "jsonl")
+    rows = [json.loads(it) for it in (tmp_path / "changes.jsonl").read_text().splitlines()]
+    assert num_rows == len(rows) == 10 and last_id == rows[-1]["log_id"]
+    assert [it["kind"] for it in rows] == ["new"] * 5 + ["price_changed"] * 3 + ["sold"] * 2
+    assert rows[0]["disks_ssd"] == [512] and rows[0]["has_ipv4"] is True
+
+    # Only the changes after the last export
+    await run(empty_db, *(make_server_data(i, price=20) for i in range(3)))
+    assert export(empty_db, "changes", tmp_path / "changes.csv", "csv", since_id=last_id)[0] == 3
+
+    # Only the changes from a time on
+    empty_db.execute(update(ServerChangeLog).where(ServerChangeLog.id <= last_id).values(time=datetime.now() - timedelta(days=2)))
+    empty_db.commit()
+    assert export(empty_db, "changes", tmp_path / "changes.csv", "csv", since=datetime.now() - timedelta(days=1))[0] == 3
+
+
+@pytest.mark.asyncio
+async def test_export_parquet(empty_db: DatabaseSession, tmp_path: Path) -> None:
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+    await run(empty_db, *(make_server_data(i) for i in range(3)))
+    assert export(empty_db, "changes", tmp_path / "changes.parquet", "parquet")[0] == 3
+
+    table = pyarrow_parquet.read_table(tmp_path / "changes.parquet")
+    assert table.column_names == list(export_columns["changes"])
+    assert table.column("disks_enterprise_hdd").to_pylist() == [[2000, 2000]] * 3
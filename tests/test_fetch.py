@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Iterator, Any
+
+import pytest
+
+from conftest import make_server_data
+from hetzner_server_scouter import fetch
+from hetzner_server_scouter.fetch import FetchState, fetch_auction, merge_feeds, load_hetzner_prices
+from hetzner_server_scouter.utils import hetzner_prices
+
+
+class StubServer:
+    """A local HTTP server that answers every path with the scripted responses `(delay in s, status, body)`. The last response of a path is repeated."""
+
+    def __init__(self) -> None:
+        self.responses: dict[str, list[tuple[float, int, bytes]]] = {}
+        self.requests: Counter[str] = Counter()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                stub.requests[self.path] += 1
+                script = stub.responses[self.path]
+                delay, status, body = script.pop(0) if len(script) > 1 else script[0]
+
+                time.sleep(delay)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # The client has given up
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self) -> "StubServer":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch: pytest.MonkeyPatch) -> Iterator[StubServer]:
+    monkeypatch.setattr(fetch, "hetzner_api_timeout_s", 0.5)
+    monkeypatch.setattr(fetch, "hetzner_api_retry_backoff_s", 0.01)
+
+    with StubServer() as it:
+        yield it
+
+
+def test_merge_feeds() -> None:
+    eur, usd = {"server": [make_server_data(1, price=40), make_server_data(2, price=50)]}, {"server": [make_server_data(2, price=55), make_server_data(3, price=60)]}
+    assert merge_feeds({"EUR": eur}) is eur
+
+    merged = merge_feeds({"EUR": eur, "USD": usd})
+    assert [(it["id"], it["price"], it["prices"]) for it in merged["server"]] == [(1, 40, {"EUR": 40}), (2, 50, {"EUR": 50, "USD": 55})]
+
+
+@pytest.mark.asyncio
+async def test_fetch_auction_concurrently(stub: StubServer, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    stub.responses = {
+        "/eur": [(0.2, 200, json.dumps({"server": [make_server_data(1, price=40)]}).encode())],
+        "/usd": [(0.2, 200, json.dumps({"server": [make_server_data(1, price=45)]}).encode())],
+        "/ipv4": [(0.2, 200, "Primäre IPv4</td><td>1,70 € pro Monat".encode())],
+    }
+    monkeypatch.setattr(fetch, "hetzner_api_feeds", {"EUR": f"{stub.url}/eur", "USD": f"{stub.url}/usd"})
+    monkeypatch.setattr(fetch, "hetzner_ipv4_price_url", f"{stub.url}/ipv4")
+    monkeypatch.setattr(hetzner_prices, "ipv4", None)
+
+    s = time.perf_counter()
+    data = await fetch_auction(tmp_path / "fetch_state.json")
+    assert time.perf_counter() - s < 0.5  # All three sources take 0.6s one after another
+
+    assert data is not None and data["ipv4_price"] == hetzner_prices.ipv4 == 1.7
+    assert data["server"][0]["prices"] == {"EUR": 40, "USD": 45}
+    assert set(FetchState.load(tmp_path / "fetch_state.json").sources) == {"feed_EUR", "feed_USD", "ipv4_price"}
+
+
+@pytest.mark.asyncio
+async def test_ipv4_price_persisted(stub: StubServer, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    stub.responses = {"/eur": [(0, 200, json.dumps({"server": [make_server_data(1)]}).encode())], "/ipv4": [(0, 200, "Primäre IPv4</td><td>1,70 € pro Monat".encode())]}
+    monkeypatch.setattr(fetch, "hetzner_api_feeds", {"EUR": f"{stub.url}/eur"})
+    monkeypatch.setattr(fetch, "hetzner_ipv4_price_url", f"{stub.url}/ipv4")
+    monkeypatch.setattr(hetzner_prices, "ipv4", None)
+    await fetch_auction(tmp_path / "fetch_state.json")
+
+    # A later process that doesn't fetch, or whose fetch of the price fails, still knows the price of the last fetch
+    monkeypatch.setattr(hetzner_prices, "ipv4", None)
+    load_hetzner_prices(tmp_path / "fetch_state.json")
+    assert hetzner_prices.ipv4 == 1.7
+
+    monkeypatch.setattr(hetzner_prices, "ipv4", None)
+    stub.responses["/ipv4"] = [(0, 404, b"")]
+    data = await fetch_auction(tmp_path / "fetch_state.json")
+    assert data is not None and data["ipv4_price"] == hetzner_prices.ipv4 == 1.7
+
+
+@pytest.mark.asyncio
+async def test_fetch_retries(stub: StubServer) -> None:
+    # The first request fails, the second one hangs past the deadline
+    stub.responses["/"] = [(0, 500, b""), (2, 200, b"slow"), (0, 200, b"ok")]
+
+    s = time.perf_counter()
+    response = await fetch.fetch("test", stub.url)
+    assert response is not None and response.text == "ok"
+    assert time.perf_counter() - s < 1.5
+    assert stub.requests["/"] == 3
+
+
+@pytest.mark.asyncio
+async def test_fetch_hedged(stub: StubServer) -> None:
+    stub.responses["/"] = [(0.4, 200, b"slow"), (0, 200, b"hedged")]
+    state = FetchState()
+    state["test"].latencies = [0.05] * 20
+
+    s = time.perf_counter()
+    response = await fetch.fetch("test", stub.url, state)
+    assert response is not None and response.text == "hedged"
+    assert time.perf_counter() - s < 0.3
+    assert stub.requests["/"] == 2
+
+    # Without enough latencies to estimate the delay, there is no hedging
+    stub.responses["/"] = [(0.1, 200, b"slow"), (0, 200, b"hedged")]
+    response = await fetch.fetch("test", stub.url)
+    assert response is not None and response.text == "slow"
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(stub: StubServer, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(fetch, "hetzner_api_breaker_threshold", 2)
+    monkeypatch.setattr(fetch, "hetzner_api_retry_count", 2)
+    stub.responses["/"] = [(0, 503, b"")]
+    state = FetchState()
+
+    for _ in range(2):
+        assert await fetch.fetch("test", stub.url, state) is None
+
+    assert stub.requests["/"] == 4
+    assert state["test"].is_open(time.time())
+
+    # The state survives the run, and while the breaker is open nothing is fetched
+    state.save(tmp_path / "state.json")
+    state = FetchState.load(tmp_path / "state.json")
+    assert await fetch.fetch("test", stub.url, state) is None
+    assert stub.requests["/"] == 4
+
+    # After the breaker has been open, only a single request is tried. Its success closes the breaker.
+    state["test"].open_until = 0
+    assert await fetch.fetch("test", stub.url, state) is None
+    assert stub.requests["/"] == 5
+
+    state["test"].open_until = 0
+    stub.responses["/"] = [(0, 200, b"ok")]
+    assert await fetch.fetch("test", stub.url, state) is not None
+    assert state["test"].failures == 0 and not state["test"].is_open(time.time())
@@ -5,16 +5,18 @@ import pytest
 from conftest import MockProgramsArgs
 from hetzner_server_scouter.db.crud import download_server_list
 from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.fetch import fetch_ipv4_price
 from hetzner_server_scouter.settings import Datacenters
-from hetzner_server_scouter.utils import flat_map, get_hetzner_ipv4_price
+from hetzner_server_scouter.utils import flat_map
 
 
 def test_data_specials(data: dict[str, Any]) -> None:
     assert set(flat_map(lambda it: it["specials"], data["server"])) == {'IPv4', 'GPU', 'iNIC', 'ECC', 'HWR'}
 
 
-def test_ipv4_price() -> None:
-    price = get_hetzner_ipv4_price()
+@pytest.mark.asyncio
+async def test_ipv4_price() -> None:
+    price = await fetch_ipv4_price()
     assert price is not None
     assert 1 < price < 10
 
@@ -0,0 +1,75 @@
+import asyncio
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from conftest import MockProgramsArgs
+from hetzner_server_scouter import __main__ as main_module
+from hetzner_server_scouter.metrics import Metrics, metrics
+from hetzner_server_scouter.utils import debug_time
+
+
+def test_metrics_export(tmp_path: Path) -> None:
+    it = Metrics()
+    for _ in range(3):
+        with it.span("parse"):
+            pass
+
+    it.count("servers_seen", 3)
+    time = datetime(2024, 1, 1, 12)
+
+    it.export(Path(tmp_path, "metrics.prom"), time)
+    text = Path(tmp_path, "metrics.prom").read_text()
+    assert 'hscout_span_count{span="parse"} 3' in text
+    assert "hscout_servers_seen 3" in text
+    assert f"hscout_last_run_timestamp_seconds {time.timestamp():.0f}" in text
+
+    # Every export appends one line
+    it.export(Path(tmp_path, "metrics.jsonl"), time)
+    it.export(Path(tmp_path, "metrics.jsonl"), time)
+    lines = [json.loads(line) for line in Path(tmp_path, "metrics.jsonl").read_text().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["spans"]["parse"]["count"] == 3 and lines[0]["counters"] == {"servers_seen": 3}
+
+
+@pytest.mark.asyncio
+async def test_metrics_export_on_failure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    async def poll() -> None:
+        return None
+
+    # Like the real one, it exits without running any `finally`, so the metrics have to be exported by then
+    def error_exit(code: int, reason: str) -> None:
+        exported.append(Path(tmp_path, "metrics.jsonl").exists())
+        raise SystemExit(code)
+
+    exported: list[bool] = []
+
+    monkeypatch.setattr(main_module, "poll", poll)
+    monkeypatch.setattr(main_module, "error_exit", error_exit)
+
+    # A failed download still exports the metrics before exiting
+    with MockProgramsArgs(metrics=Path(tmp_path, "metrics.jsonl")), pytest.raises(SystemExit):
+        await main_module.run()
+
+    assert exported == [True] and json.loads(Path(tmp_path, "metrics.jsonl").read_text())["spans"]["run"]["count"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_debug_time() -> None:
+    @debug_time("test_sync")
+    def sync() -> int:
+        return 1
+
+    @debug_time("test_async")
+    async def wait() -> int:
+        await asyncio.sleep(0.05)
+        return 2
+
+    assert sync() == 1
+    assert await wait() == 2
+
+    # The span of a coroutine covers its whole runtime, not only the creation of the coroutine
+    assert metrics.spans["test_sync"].count == 1
+    assert metrics.spans["test_async"].count == 1 and metrics.spans["test_async"].total >= 0.05
@@ -0,0 +1,43 @@
+import threading
+
+from hetzner_server_scouter.profiling import StackSampler, MemoryPeakTracker
+
+
+def busy_function(started: threading.Event, stop: threading.Event) -> None:
+    started.set()
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_stack_sampler() -> None:
+    sampler, started, stop = StackSampler(), threading.Event(), threading.Event()
+    idle_thread = threading.Thread(target=stop.wait, name="idle-thread")
+    busy_thread = threading.Thread(target=busy_function, args=(started, stop), name="busy-thread")
+    idle_thread.start()
+    busy_thread.start()
+    started.wait()
+
+    for _ in range(10):
+        sampler.sample()
+
+    stop.set()
+    idle_thread.join()
+    busy_thread.join()
+
+    assert sampler.samples["idle-thread;[idle]"] == 10
+    assert sum(num for stack, num in sampler.samples.items() if stack.startswith("busy-thread;") and "busy_function" in stack) == 10
+    assert "idle-thread: 0.05s sampled, 0% busy, 0% blocked on I/O, 100% idle" in sampler.summary()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in sampler.to_collapsed().splitlines())
+
+
+def test_memory_peak_tracker() -> None:
+    tracker = MemoryPeakTracker()
+    tracker.start()
+
+    data = [str(i) * 10 for i in range(100_000)]
+    tracker.check()
+    del data
+
+    tracker.stop()
+    assert tracker.snapshot_size > 1024 ** 2
+    assert __file__ in tracker.report(3).splitlines()[2]
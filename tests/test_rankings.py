@@ -0,0 +1,101 @@
+import asyncio
+import random
+from typing import Any
+
+import pytest
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_random_server_data, make_server_data, MockProgramsArgs
+from hetzner_server_scouter.db.crud import stream_server_changes, read_matching_servers
+from hetzner_server_scouter.db.models import Server
+from hetzner_server_scouter.notifications.crud import process_changes, discard_changes
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeType
+from hetzner_server_scouter.rankings import Ranking, Rankings, ranking_keys
+from hetzner_server_scouter.settings import Datacenters
+from hetzner_server_scouter.utils import program_args, run_concurrently
+
+
+def make_servers(rng: random.Random, ids: range) -> list[Server]:
+    return [Server.parse(make_random_server_data(rng, i) | {"cpu": rng.choice(["Intel Core i7-6700", "Intel Xeon E5-1650V3", "AMD Ryzen 9 5950X", "Unknown CPU"])}) for i in ids]
+
+
+def test_ranking_from_name() -> None:
+    assert Ranking.from_name("raid1").datacenter is None
+    assert Ranking.from_name("ecc_ram@FSN", 5).datacenter == Datacenters.frankfurt
+
+    with pytest.raises(ValueError):
+        Ranking.from_name("cheap")
+    with pytest.raises(ValueError):
+        Ranking.from_name("raid1@Mars")
+
+
+@pytest.mark.parametrize("name", [*ranking_keys, "raid1@HEL", "core@NBG"])
+def test_incremental_ranking(name: str) -> None:
+    rng = random.Random(0)
+    servers = {it.id: it for it in make_servers(rng, range(200))}
+    rankings = Rankings.from_names([name], size=10).build(servers.values())
+
+    for i in range(200, 400):
+        match rng.choice(list(ServerChangeType)):
+            case ServerChangeType.new:
+                server, = make_servers(rng, range(i, i + 1))
+                change = ServerChange(ServerChangeType.new, server.id, None, server.to_dict())
+            case ServerChangeType.price_changed:
+                server = Server.from_dict(rng.choice(list(servers.values())).to_dict() | {"price": round(rng.uniform(25, 120), 2)})
+                change = ServerChange(ServerChangeType.price_changed, server.id, None, server.to_dict())
+            case ServerChangeType.sold:
+                server_id = rng.choice(list(servers))
+                change = ServerChange(ServerChangeType.sold, server_id, None, servers.pop(server_id).to_dict())
+
+        if change.kind != ServerChangeType.sold:
+            servers[server.id] = server
+
+        rankings.apply([change])
+
+    # The same as ranking the final auction from scratch
+    ranking, = rankings.rankings
+    expected = Ranking.from_name(name, 10)
+    expected.build(servers.values())
+    assert ranking.top() == expected.top()
+    assert len(ranking.entries) == len(expected.entries)
+
+
+def test_ranking_membership_changes() -> None:
+    servers = [Server.parse(make_server_data(i, price=40 + i)) for i in range(5)]
+    rankings = Rankings.from_names(["raid1"], size=3).build(servers)
+
+    # Changes within the ranking or below it don't change its members
+    rankings.apply([ServerChange(ServerChangeType.price_changed, 1, None, servers[1].to_dict() | {"price": 39})])
+    rankings.apply([ServerChange(ServerChangeType.price_changed, 4, None, servers[4].to_dict() | {"price": 43.5})])
+    assert rankings.commit() == []
+
+    rankings.apply([
+        ServerChange(ServerChangeType.new, 10, None, Server.parse(make_server_data(10, price=30)).to_dict()),
+        ServerChange(ServerChangeType.price_changed, 4, None, servers[4].to_dict() | {"price": 38}),
+        ServerChange(ServerChangeType.sold, 0, None, servers[0].to_dict()),
+    ])
+    change, = rankings.commit()
+    assert [(rank, server_id) for rank, server_id, _ in change.entered] == [(1, 10), (2, 4)]
+    assert change.left == [0, 2]
+    assert rankings.commit() == []
+
+
+@pytest.mark.asyncio
+async def test_rankings_follow_filters(empty_db: DatabaseSession) -> None:
+    async def run(*servers: dict[str, Any]) -> None:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+        await run_concurrently(stream_server_changes(empty_db, {"server": list(servers)}, changes), process_changes(empty_db, changes, discard_changes, print_changes=False, rankings=rankings))
+
+    # With `--store-all`, the servers that don't match the filters are stored, but they are neither ranked nor notified about
+    with MockProgramsArgs(store_all=True, price=50, tax=0):
+        rankings = Rankings.from_names(["raid1"]).build(read_matching_servers(empty_db, program_args))
+        await run(make_server_data(1, price=40, specials=[]), make_server_data(2, price=60, specials=[]))
+        change, = rankings.commit()
+        assert [server_id for _, server_id, _ in change.entered] == [1] and change.left == []
+
+        await run(make_server_data(1, price=70, specials=[]), make_server_data(2, price=45, specials=[]))
+        change, = rankings.commit()
+        assert [server_id for _, server_id, _ in change.entered] == [2] and change.left == [1]
+
+        # The rankings of the next start agree with the ones that were kept up to date
+        assert Rankings.from_names(["raid1"]).build(read_matching_servers(empty_db, program_args)).rankings[0].top() == rankings.rankings[0].top()
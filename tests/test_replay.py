@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_server_data
+from hetzner_server_scouter.data_sources import Snapshot, record_snapshot, make_data_source, DirectorySource, FileSource
+from hetzner_server_scouter.notifications.models import ServerChangeLogRecord, ServerChangeType
+from hetzner_server_scouter.replay import make_replay_session, replay_snapshots
+from hetzner_server_scouter.utils import clock
+
+start = datetime(2024, 1, 1, 12)
+
+
+def make_snapshots() -> list[Snapshot]:
+    reduce_timestamp = int((start + timedelta(hours=3)).timestamp())
+
+    return [
+        Snapshot(start, {"server": [make_server_data(1, next_reduce_timestamp=reduce_timestamp), make_server_data(2)]}),
+        Snapshot(start + timedelta(hours=1), {"server": [make_server_data(1, price=30, next_reduce_timestamp=reduce_timestamp), make_server_data(2)]}),
+        Snapshot(start + timedelta(hours=2), {"server": [make_server_data(1, price=30, next_reduce_timestamp=reduce_timestamp)]}),
+    ]
+
+
+def test_record_snapshots(tmp_path: Path) -> None:
+    # Record them out of order, the source has to sort them
+    for snapshot in reversed(make_snapshots()):
+        record_snapshot(tmp_path, snapshot)
+
+    source = make_data_source(tmp_path)
+    assert isinstance(source, DirectorySource)
+    assert list(source.snapshots()) == make_snapshots()
+    assert source.latest() == make_snapshots()[-1]
+
+    file_source = make_data_source(source.files()[0])
+    assert isinstance(file_source, FileSource)
+    assert file_source.latest() == make_snapshots()[0]
+
+
+@pytest.mark.asyncio
+async def test_replay() -> None:
+    messages: list[tuple[ServerChangeType, str | None]] = []
+
+    async def collect(db: DatabaseSession, logs: asyncio.Queue[ServerChangeLogRecord | None]) -> None:
+        while (log := await logs.get()) is not None:
+            messages.append((log.change.kind, log.change.to_console_str()))
+
+    with make_replay_session() as db:
+        stats = await replay_snapshots(db, make_snapshots(), collect)
+
+    assert stats.snapshots == 3
+    assert stats.changes == {ServerChangeType.new: 2, ServerChangeType.price_changed: 1, ServerChangeType.sold: 1}
+    assert clock.fixed_time is None
+
+    # The countdown is relative to the time of the snapshot, not to the time of the replay
+    assert [kind for kind, _ in messages] == [ServerChangeType.new, ServerChangeType.new, ServerChangeType.price_changed, ServerChangeType.sold]
+    assert "decreasing in 3h 0min" in (messages[0][1] or "")
+    assert "decreasing in 2h 0min" in (messages[2][1] or "")
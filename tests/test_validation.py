@@ -0,0 +1,75 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session as DatabaseSession
+
+from conftest import make_server_data, MockProgramsArgs
+from hetzner_server_scouter.db.crud import parse_server_list, stream_server_changes, read_server_snapshots
+from hetzner_server_scouter.db.state_file import ServerStateFile
+from hetzner_server_scouter.metrics import metrics
+from hetzner_server_scouter.notifications.crud import process_changes, discard_changes
+from hetzner_server_scouter.notifications.models import ServerChange, ServerChangeLog, ServerChangeType
+from hetzner_server_scouter.utils import run_concurrently
+from hetzner_server_scouter.validation import payload_validator
+
+wrong_disks = {"hdd": [2000], "sata": [512], "nvme": [], "general": []}
+
+
+@pytest.fixture
+def anomalies_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    monkeypatch.setattr(payload_validator, "anomalies_path", tmp_path / "anomalies.jsonl")
+    payload_validator.anomalies.clear()
+    metrics.reset()
+
+    yield tmp_path / "anomalies.jsonl"
+
+
+def test_validation_skips_records(anomalies_path: Path) -> None:
+    skipped: set[int] = set()
+    servers = list(parse_server_list({"server": [
+        make_server_data(1), make_server_data(2, serverDiskData=wrong_disks), make_server_data(3, hdd_arr=["2 XB HDD"]), make_server_data(4, ram=[]), {"price": 40},
+    ]}, skipped=skipped))
+
+    assert [it.id for it in servers] == [1] and skipped == {2, 3, 4}
+    assert [(it.server_id, it.check) for it in payload_validator.anomalies] == [(2, "disks"), (3, "disks"), (4, "parse"), (None, "parse")]
+    assert [json.loads(it)["server_id"] for it in anomalies_path.read_text().splitlines()] == [2, 3, 4, None]
+    assert metrics.counters["payload_anomalies"] == 4 and metrics.counters["payload_anomalies_disks"] == 2 and metrics.counters["payload_records_validated"] == 2
+
+
+def test_validation_modes(anomalies_path: Path) -> None:
+    data = {"server": [make_server_data(i, serverDiskData=wrong_disks) for i in range(1000)]}
+
+    with MockProgramsArgs(validate="off"):
+        assert len(list(parse_server_list(data))) == 1000
+
+    with MockProgramsArgs(validate="sampled"):
+        num_servers = len(list(parse_server_list(data)))
+
+    # Only a sample is checked, so most of the broken records are let through
+    assert metrics.counters["payload_records_validated"] == metrics.counters["payload_anomalies"] == 1000 - num_servers
+    assert 0 < 1000 - num_servers < 150
+
+
+@pytest.mark.asyncio
+async def test_pipeline_skipped_records(empty_db: DatabaseSession, tmp_path: Path, anomalies_path: Path) -> None:
+    state = ServerStateFile(tmp_path / "state.bin")
+
+    async def run(*servers: dict[str, Any]) -> None:
+        changes: asyncio.Queue[ServerChange | None] = asyncio.Queue()
+        await run_concurrently(stream_server_changes(empty_db, {"server": list(servers)}, changes, state), process_changes(empty_db, changes, discard_changes, print_changes=False))
+        state.commit()
+
+    await run(make_server_data(1), make_server_data(2))
+    assert state.read() is not None
+
+    # A broken record of a stored server neither aborts the run nor makes the server look sold
+    await run(make_server_data(1, price=30), make_server_data(2, serverDiskData=wrong_disks))
+    assert set(read_server_snapshots(empty_db)) == {1, 2} and state.read() is None
+
+    await run(make_server_data(1, price=30))
+    logs = empty_db.execute(select(ServerChangeLog).order_by(ServerChangeLog.id)).scalars().all()
+    assert [(it.change.kind, it.server_id) for it in logs][2:] == [(ServerChangeType.price_changed, 1), (ServerChangeType.sold, 2)]